@@ -0,0 +1,141 @@
+"""
+Replays a range of a Kafka topic into Elasticsearch, e.g. to reindex after a mapping change, and exits at its end.
+
+    python backfill.py TOPIC [--partitions 0,1] [--from-offset N | --from-time T] [--to-offset N | --to-time T]
+                       [--batch-size 5000] [--in-flight 16] [--group NAME] [--keep-index-settings]
+
+Times are ISO 8601, UTC unless they carry a zone, or epoch milliseconds. The bounds apply to every
+partition and an open end stops at the end offsets found when the backfill starts. The partitions are
+assigned to this process without joining a group and read together by the pipelined mode with large
+bulks. Indexed offsets are committed to BACKFILL_GROUP (KAFKA_CONSUMER_GROUP with a `-backfill` suffix
+by default), never to the group of the running loader. The target indices have refreshes and replicas
+turned off until the end. Elasticsearch, transform, dead letters and telemetry are configured by the same
+environment as main.py. Exits with 0 once the whole range is indexed, 1 otherwise.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import signal
+from datetime import datetime, timezone
+
+from config import (
+    BackfillSettings, DeadLetterSettings, ElasticSettings, KafkaSettings, TelemetrySettings, TransformSettings,
+    get_settings
+)
+from domain.transform import compile_transform, load_transform_spec
+from logger import get_logger
+from ports.input.kafka_service import KafkaConsumerService
+from ports.input.replay import ReplayRange
+from ports.output.dead_letter import DeadLetterService
+from ports.output.elastic_service import ElasticsearchClientService
+from ports.output.telemetry import TelemetryJournal
+
+logger = get_logger(__name__)
+
+
+def parse_time(value: str) -> int:
+    """ Epoch milliseconds of an ISO 8601 time or of epoch milliseconds """
+    if value.isdigit():
+        return int(value)
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("topic")
+    parser.add_argument("--partitions", type=lambda value: [int(item) for item in value.split(",")],
+                        help="comma-separated partitions, all by default")
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument("--from-offset", type=int)
+    start.add_argument("--from-time", type=parse_time)
+    end = parser.add_mutually_exclusive_group()
+    end.add_argument("--to-offset", type=int, help="first offset not replayed")
+    end.add_argument("--to-time", type=parse_time, help="records written from this time on are not replayed")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--in-flight", type=int)
+    parser.add_argument("--group")
+    parser.add_argument("--keep-index-settings", action="store_true",
+                        help="leave refresh_interval and number_of_replicas of the target indices as they are")
+    return parser.parse_args(argv)
+
+
+def backfill_settings(args: argparse.Namespace, kafka: KafkaSettings, backfill: BackfillSettings) -> KafkaSettings:
+    """ Consumer settings of the live loader tuned for throughput """
+    return kafka.model_copy(update={
+        "consumer_topics": args.topic,
+        "consumer_group": args.group or backfill.group or f"{kafka.consumer_group}-backfill",
+        "mode": "pipelined",
+        "batch_size": args.batch_size or backfill.batch_size,
+        "max_batch_size": max(kafka.max_batch_size, args.batch_size or backfill.batch_size),
+        "max_in_flight": args.in_flight or backfill.max_in_flight,
+        "queue_size": backfill.queue_size,
+        # The lag of the live group is exported by the loader, the backfill reports its own progress
+        "lag_interval_s": 0,
+    })
+
+
+async def backfill(args: argparse.Namespace) -> bool:
+    settings: BackfillSettings = get_settings(BackfillSettings)
+    kafka_settings = backfill_settings(args, get_settings(KafkaSettings), settings)
+    telemetry_settings: TelemetrySettings = get_settings(TelemetrySettings)
+    replay = ReplayRange(
+        args.topic, args.partitions, start_offset=args.from_offset, end_offset=args.to_offset,
+        start_time_ms=args.from_time, end_time_ms=args.to_time, progress_interval_s=settings.progress_interval_s)
+
+    dead_letters = DeadLetterService(
+        settings=get_settings(DeadLetterSettings), bootstrap_servers=kafka_settings.bootstrap_servers)
+    elastic_client = ElasticsearchClientService(
+        settings=get_settings(ElasticSettings), dead_letters=dead_letters, in_flight=kafka_settings.max_in_flight)
+    journal = TelemetryJournal(telemetry_settings) if telemetry_settings.path else None
+    kafka_consumer = KafkaConsumerService(
+        elastic_client=elastic_client, settings=kafka_settings, dead_letters=dead_letters,
+        transform=compile_transform(load_transform_spec(get_settings(TransformSettings))), journal=journal,
+        replay=replay)
+
+    connecting = asyncio.gather(kafka_consumer.connect(), elastic_client.connect())
+    try:
+        await connecting
+    except BaseException:
+        connecting.cancel()
+        await asyncio.gather(connecting, return_exceptions=True)
+        await kafka_consumer.close()
+        raise
+    await dead_letters.start()
+    if journal:
+        await journal.start()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, kafka_consumer.stop)
+    index_settings = contextlib.nullcontext()
+    if settings.bulk_settings and not args.keep_index_settings:
+        index_settings = elastic_client.bulk_load()
+    try:
+        async with index_settings:
+            await kafka_consumer.start()
+    finally:
+        await dead_letters.stop()
+        if journal:
+            await journal.stop()
+        await elastic_client.client.close()
+
+    if not kafka_consumer.replay_complete:
+        logger.warning("Backfill stopped before the end of its range, the committed offsets show how far it got")
+        return False
+    logger.info("Backfill complete")
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        completed = asyncio.run(backfill(parse_args()))
+    except asyncio.CancelledError:
+        logger.warning("Backfill stopped before its batches were drained")
+        completed = False
+    except Exception as e:
+        logger.error(f"Backfill error messages: {e}")
+        completed = False
+    raise SystemExit(0 if completed else 1)
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of the JSON codecs on log-like payloads.
+
+    PYTHONPATH=src python benchmarks/bench_codec.py [--events 2000] [--repeat 5]
+
+For every installed codec it reports the decode time of the raw Kafka values and the
+encode time of a bulk request built from them, per event.
+"""
+
+import argparse
+import random
+import string
+import timeit
+
+from codec import CODECS, get_codec
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+
+def make_event(rng: random.Random, size: str) -> dict:
+    event = {
+        "asctime": "2024-05-01 12:00:00,123",
+        "levelname": rng.choice(LEVELS),
+        "name": "ports.input.kafka_service",
+        "message": " ".join(rng.choice(string.ascii_lowercase) * rng.randint(2, 9) for _ in range(12)),
+        "filename": "kafka_service.py",
+        "pod": f"streaming-data-loader-{rng.randint(0, 9)}",
+        "latency_ms": rng.random() * 100,
+        "status": rng.choice([200, 201, 429, 503]),
+    }
+    if size in ("medium", "large"):
+        event["labels"] = {f"label_{i}": rng.choice(string.ascii_letters) * 8 for i in range(10)}
+        event["tags"] = [rng.choice(string.ascii_lowercase) * 6 for _ in range(10)]
+    if size == "large":
+        event["payload"] = [
+            {"id": i, "value": rng.random(), "name": "item" * 4, "ok": rng.random() > 0.5} for i in range(40)
+        ]
+    return event
+
+
+def bench(events: int, repeat: int):
+    rng = random.Random(42)
+    stdlib = get_codec("json")
+    print(f"{'payload':<8} {'codec':<8} {'bytes/event':>12} {'decode us/event':>16} {'encode us/event':>16}")
+    for size in ("small", "medium", "large"):
+        documents = [make_event(rng, size) for _ in range(events)]
+        raw = [stdlib.dumps(document) for document in documents]
+        average = sum(map(len, raw)) / len(raw)
+        action = {"index": {"_index": "events"}}
+
+        for name in sorted(CODECS):
+            codec = get_codec(name)
+            decode = min(timeit.repeat(lambda: [codec.loads(value) for value in raw], number=1, repeat=repeat))
+            encode = min(timeit.repeat(
+                lambda: b"\n".join(codec.dumps(line) for document in documents for line in (action, document)),
+                number=1, repeat=repeat))
+            print(f"{size:<8} {name:<8} {average:>12.0f} {decode / events * 1e6:>16.2f} {encode / events * 1e6:>16.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    bench(args.events, args.repeat)
@@ -0,0 +1,281 @@
+"""
+End-to-end benchmark of KafkaConsumerService -> process_events -> ElasticsearchClientService.
+
+    PYTHONPATH=src python benchmarks/bench_pipeline.py [--scenario NAME ...] [--events 20000]
+        [--save-baseline FILE | --compare FILE [--tolerance 0.1]]
+
+The consumer reads from an in-process fake Kafka consumer that serves pre-encoded log-like
+payloads, and the client sends real bulk requests to a local aiohttp stand-in of the `_bulk`
+endpoint running in its own process, with injectable latency and per-item 429 rate.
+
+Every scenario runs in a fresh process of its own. For every scenario it reports throughput,
+p50/p99 bulk latency, loader CPU time per document and the peak RSS of that process.
+`--save-baseline` stores the results, `--compare` exits with status 1 when the
+throughput of a scenario dropped by more than `--tolerance` against the stored baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+from aiohttp import web
+from aiokafka import TopicPartition
+
+from bench_codec import make_event
+from codec import get_codec
+from config import ElasticSettings, KafkaSettings
+from ports.input.kafka_service import KafkaConsumerService
+from ports.output.elastic_service import ElasticsearchClientService
+
+# name: consumer settings, payload size and behaviour of the bulk endpoint
+SCENARIOS = {
+    "serial-small": {"kafka": {"mode": "serial"}, "payload": "small"},
+    "pipelined-small": {"kafka": {"mode": "pipelined"}, "payload": "small"},
+    "pipelined-large": {"kafka": {"mode": "pipelined"}, "payload": "large"},
+    "partitioned-medium": {"kafka": {"mode": "partitioned"}, "payload": "medium"},
+    "raw-small": {"kafka": {"mode": "pipelined", "raw_bulk": True}, "payload": "small"},
+    "slow-elastic": {"kafka": {"mode": "pipelined"}, "payload": "small", "latency_ms": 50},
+    "throttled": {"kafka": {"mode": "pipelined"}, "payload": "small", "throttle_rate": 0.05},
+}
+PARTITIONS = 4
+TOPIC = "bench"
+HEADERS = {"X-Elastic-Product": "Elasticsearch", "Content-Type": "application/json"}
+
+
+class FakeRecord:
+    __slots__ = ("topic", "partition", "offset", "value", "serialized_value_size")
+
+    def __init__(self, partition: int, offset: int, value: bytes):
+        self.topic = TOPIC
+        self.partition = partition
+        self.offset = offset
+        self.value = value
+        self.serialized_value_size = len(value)
+
+
+class FakeConsumer:
+    """ Serves `total` records spread over the partitions and signals once all of them are committed """
+
+    def __init__(self, values: list[bytes], total: int):
+        self.values = values
+        self.partitions = [TopicPartition(TOPIC, partition) for partition in range(PARTITIONS)]
+        self.per_partition = total // PARTITIONS
+        self.total = self.per_partition * PARTITIONS
+        self.positions = dict.fromkeys(self.partitions, 0)
+        self.committed = dict.fromkeys(self.partitions, 0)
+        self.paused = set()
+        self.done = asyncio.Event()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, topics: list[str], listener=None):
+        self.listener = listener
+
+    def assignment(self) -> set:
+        return set(self.partitions)
+
+    def pause(self, *partitions):
+        self.paused.update(partitions)
+
+    def resume(self, *partitions):
+        self.paused.difference_update(partitions)
+
+    async def getmany(self, timeout_ms: int = 0, max_records: int | None = None) -> dict:
+        batch = {}
+        available = [tp for tp in self.partitions if tp not in self.paused and self.positions[tp] < self.per_partition]
+        if not available:
+            await asyncio.sleep(min(timeout_ms, 10) / 1000)
+            return batch
+        share = max(1, (max_records or 500) // len(available))
+        for tp in available:
+            start = self.positions[tp]
+            end = min(self.per_partition, start + share)
+            batch[tp] = [
+                FakeRecord(tp.partition, offset, self.values[(offset * PARTITIONS + tp.partition) % len(self.values)])
+                for offset in range(start, end)
+            ]
+            self.positions[tp] = end
+        await asyncio.sleep(0)
+        return batch
+
+    async def commit(self, offsets: dict):
+        for tp, offset in offsets.items():
+            self.committed[tp] = max(self.committed[tp], offset.offset)
+        if sum(self.committed.values()) >= self.total:
+            self.done.set()
+
+
+def serve_bulk(ready: multiprocessing.Queue, latency_ms: float, throttle_rate: float):
+    """ Stand-in of the Elasticsearch `_bulk` endpoint, run in a separate process """
+    rng = random.Random(7)
+    codec = get_codec("json")
+
+    async def ping(_: web.Request) -> web.Response:
+        return web.Response(headers=HEADERS)
+
+    async def bulk(request: web.Request) -> web.Response:
+        body = await request.read()
+        documents = body.count(b"\n") // 2
+        if latency_ms:
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * latency_ms / 1000)
+        statuses = [429 if rng.random() < throttle_rate else 201 for _ in range(documents)]
+        items = [{"index": {"status": status}} for status in statuses]
+        response = {"errors": 429 in statuses, "items": items}
+        return web.Response(body=codec.dumps(response), headers=HEADERS)
+
+    async def run():
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_route("HEAD", "/", ping)
+        # The client sends bulk requests with PUT
+        app.router.add_route("*", "/_bulk", bulk)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        ready.put(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def start_stand_in(latency_ms: float, throttle_rate: float) -> tuple[multiprocessing.Process, int]:
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target=serve_bulk, args=(ready, latency_ms, throttle_rate), daemon=True)
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+def percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+async def run_scenario(name: str, events: int, batch_size: int) -> dict:
+    scenario = SCENARIOS[name]
+    process, port = start_stand_in(scenario.get("latency_ms", 0), scenario.get("throttle_rate", 0))
+    rng = random.Random(42)
+    codec = get_codec("json")
+    values = [codec.dumps(make_event(rng, scenario["payload"])) for _ in range(1000)]
+    consumer = FakeConsumer(values, events)
+
+    kafka_settings = KafkaSettings(
+        bootstrap_servers="fake:9092", consumer_topics=TOPIC, consumer_group="bench", batch_size=batch_size,
+        timeout_ms=100, **scenario["kafka"])
+    elastic_settings = ElasticSettings(
+        url=f"http://127.0.0.1:{port}", index="bench", retry=10, retry_backoff_ms=10, retry_backoff_max_ms=200)
+    es_client = ElasticsearchClientService(elastic_settings, in_flight=kafka_settings.max_in_flight)
+    service = KafkaConsumerService(es_client, kafka_settings)
+
+    latencies = []
+    bulk_insert = es_client.bulk_insert
+
+    async def timed_bulk_insert(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await bulk_insert(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    es_client.bulk_insert = timed_bulk_insert
+    try:
+        with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            started = time.perf_counter()
+            task = asyncio.create_task(service.start())
+            done = asyncio.create_task(consumer.done.wait())
+            await asyncio.wait({done, task}, return_when=asyncio.FIRST_COMPLETED)
+            elapsed = time.perf_counter() - started
+            finished = resource.getrusage(resource.RUSAGE_SELF)
+            for pending in (done, task):
+                pending.cancel()
+            await asyncio.gather(done, task, return_exceptions=True)
+            # A service that stopped before committing everything failed, or the numbers would be wrong
+            if not consumer.done.is_set():
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+                raise RuntimeError(f"{name}: the consumer stopped before committing all {consumer.total} events")
+    finally:
+        await es_client.client.close()
+        process.terminate()
+        process.join()
+
+    cpu = (finished.ru_utime - usage.ru_utime) + (finished.ru_stime - usage.ru_stime)
+    return {
+        "events": consumer.total,
+        "docs_per_s": consumer.total / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "cpu_us_per_doc": cpu / consumer.total * 1e6,
+        # Of the process running this scenario alone, Linux reports kilobytes
+        "peak_rss_mb": finished.ru_maxrss / 1024,
+    }
+
+
+def run_isolated(name: str, events: int, batch_size: int) -> dict:
+    """ Runs a scenario in a fresh process, ru_maxrss only grows and would carry over the peak of
+    the scenarios run before it """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=logging.getLogger().setLevel, initargs=(logging.ERROR,)) as executor:
+        return executor.submit(_run_scenario, name, events, batch_size).result()
+
+
+def _run_scenario(name: str, events: int, batch_size: int) -> dict:
+    return asyncio.run(run_scenario(name, events, batch_size))
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name, {}).get("docs_per_s")
+        if expected and result["docs_per_s"] < expected * (1 - tolerance):
+            regressions.append(f"{name}: {result['docs_per_s']:.0f} docs/s, baseline {expected:.0f} docs/s")
+    return regressions
+
+
+def main(args: argparse.Namespace) -> int:
+    logging.getLogger().setLevel(logging.ERROR)
+    results = {}
+    print(f"{'scenario':<20} {'docs/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'cpu us/doc':>11} "
+          f"{'peak RSS MB':>12}")
+    for name in args.scenario or SCENARIOS:
+        result = results[name] = run_isolated(name, args.events, args.batch_size)
+        print(f"{name:<20} {result['docs_per_s']:>10.0f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['cpu_us_per_doc']:>11.1f} {result['peak_rss_mb']:>12.1f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed throughput drop, 0.1 is 10%%")
+    sys.exit(main(parser.parse_args()))
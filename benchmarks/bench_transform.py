@@ -0,0 +1,56 @@
+"""
+Micro-benchmark of the batch-compiled transform against the per-event EventModel.
+
+    PYTHONPATH=src python benchmarks/bench_transform.py [--events 5000] [--repeat 5]
+
+Reports the per-event time of EventModel.event_convert, of the compiled default spec
+(the same timestamp stamping, once per batch) and of a spec using every step.
+"""
+
+import argparse
+import copy
+import random
+import timeit
+
+from bench_codec import make_event
+from domain.models import EventModel
+from domain.transform import compile_transform
+
+FULL_SPEC = {
+    "drop_if": [{"field": "levelname", "equals": "DEBUG"}, {"field": "status", "in": [429]}],
+    "include": ["asctime", "levelname", "message", "pod", "latency_ms", "status"],
+    "exclude": ["asctime"],
+    "rename": {"levelname": "level", "latency_ms": "latency"},
+    "cast": {"status": "str", "latency": "int"},
+    "timestamp": "@timestamp",
+}
+
+
+def bench(events: int, repeat: int):
+    rng = random.Random(42)
+    documents = [make_event(rng, "small") for _ in range(events)]
+    default = compile_transform()
+    full = compile_transform(FULL_SPEC)
+
+    cases = {
+        "EventModel.event_convert": lambda batch: [EventModel(event).event_convert() for event in batch],
+        "compiled default spec": lambda batch: default(batch, 1700000000),
+        "compiled full spec": lambda batch: full(batch, 1700000000),
+    }
+    print(f"{'transform':<26} {'us/event':>10} {'speedup':>8}")
+    baseline = None
+    for name, run in cases.items():
+        # Every run gets fresh events, the transforms work in place
+        batches = [copy.deepcopy(documents) for _ in range(repeat)]
+        timings = [timeit.timeit(lambda: run(batch), number=1) for batch in batches]
+        per_event = min(timings) / events * 1e6
+        baseline = baseline or per_event
+        print(f"{name:<26} {per_event:>10.3f} {baseline / per_event:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    bench(args.events, args.repeat)
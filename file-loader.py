@@ -0,0 +1,117 @@
+"""
+Bulk-loads NDJSON exports into Elasticsearch through the same transform and bulk path as the Kafka consumer.
+
+    python file-loader.py PATH [PATH ...] [--batch-size 5000] [--in-flight 8] [--checkpoint FILE] [--restart]
+                          [--keep-index-settings] [--stdin-source NAME]
+
+A path of `-` reads stdin, which needs a source name (FILE_STDIN_SOURCE) standing for the file path. Gzip and zstd
+input is recognized by its magic bytes, zstd needs the `zstd` extra. Plain files are memory-mapped and their lines
+decoded in place, compressed files and stdin are read in chunks of FILE_READ_SIZE bytes. The byte offset up to
+which every file is indexed is saved to the checkpoint (FILE_CHECKPOINT_PATH) every FILE_CHECKPOINT_INTERVAL_S
+seconds and on exit, and a file is loaded from there when the loader runs again; completed files are skipped. Stdin
+is never checkpointed. Lines loaded twice after a crash are only deduplicated with ELASTIC_ID_STRATEGY=offset,
+which derives the `_id` from the resolved path of the file or the stdin source name and the byte offset of the
+line, or with a hash or field strategy. Give a stdin export the same source name every time it is loaded. The
+target indices have refreshes and replicas turned off until the end. Elasticsearch, transform, dead letters and
+telemetry are configured by the same environment as main.py. Exits with 0 once every file is indexed, 1 otherwise.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import signal
+
+from config import (
+    DeadLetterSettings, ElasticSettings, FileSettings, KafkaSettings, TelemetrySettings, TransformSettings,
+    get_settings
+)
+from domain.transform import compile_transform, load_transform_spec
+from logger import get_logger
+from ports.input.file_service import FileCheckpoint, FileLoaderService
+from ports.output.dead_letter import DeadLetterService
+from ports.output.elastic_service import ElasticsearchClientService
+from ports.output.telemetry import TelemetryJournal
+
+logger = get_logger(__name__)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="NDJSON files, optionally gzip or zstd compressed, `-` for stdin")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--in-flight", type=int)
+    parser.add_argument("--checkpoint", help="checkpoint file, FILE_CHECKPOINT_PATH by default")
+    parser.add_argument("--restart", action="store_true", help="load the files from their start")
+    parser.add_argument("--keep-index-settings", action="store_true",
+                        help="leave refresh_interval and number_of_replicas of the target indices as they are")
+    parser.add_argument("--stdin-source", help="name of the lines read from stdin, FILE_STDIN_SOURCE by default")
+    return parser.parse_args(argv)
+
+
+def loader_settings(args: argparse.Namespace, settings: FileSettings) -> FileSettings:
+    """ File settings with the command line overrides """
+    return settings.model_copy(update={
+        "batch_size": args.batch_size or settings.batch_size,
+        "max_in_flight": args.in_flight or settings.max_in_flight,
+        "checkpoint_path": args.checkpoint or settings.checkpoint_path,
+        "stdin_source": args.stdin_source or settings.stdin_source,
+    })
+
+
+async def load(args: argparse.Namespace) -> bool:
+    settings = loader_settings(args, get_settings(FileSettings))
+    telemetry_settings: TelemetrySettings = get_settings(TelemetrySettings)
+    checkpoint = None
+    if settings.checkpoint_path:
+        if args.restart and os.path.exists(settings.checkpoint_path):
+            os.remove(settings.checkpoint_path)
+        checkpoint = FileCheckpoint(settings.checkpoint_path)
+
+    dead_letters = DeadLetterService(
+        settings=get_settings(DeadLetterSettings), bootstrap_servers=get_settings(KafkaSettings).bootstrap_servers)
+    elastic_client = ElasticsearchClientService(
+        settings=get_settings(ElasticSettings), dead_letters=dead_letters, in_flight=settings.max_in_flight)
+    journal = TelemetryJournal(telemetry_settings) if telemetry_settings.path else None
+    loader = FileLoaderService(
+        elastic_client=elastic_client, settings=settings, dead_letters=dead_letters,
+        transform=compile_transform(load_transform_spec(get_settings(TransformSettings))), journal=journal,
+        checkpoint=checkpoint)
+
+    await elastic_client.connect()
+    await dead_letters.start()
+    if journal:
+        await journal.start()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, loader.stop)
+    index_settings = contextlib.nullcontext()
+    if settings.bulk_settings and not args.keep_index_settings:
+        index_settings = elastic_client.bulk_load()
+    try:
+        async with index_settings:
+            completed = await loader.load(args.paths)
+    finally:
+        await dead_letters.stop()
+        if journal:
+            await journal.stop()
+        await elastic_client.client.close()
+
+    if not completed:
+        logger.warning(f"Load stopped after {len(loader.loaded)} of {len(args.paths)} files, "
+                       f"the checkpoint shows how far it got")
+        return False
+    logger.info(f"Loaded {len(args.paths)} files")
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        completed = asyncio.run(load(parse_args()))
+    except asyncio.CancelledError:
+        logger.warning("Load stopped before its bulks were drained")
+        completed = False
+    except Exception as e:
+        logger.error(f"File loader error messages: {e}")
+        completed = False
+    raise SystemExit(0 if completed else 1)
@@ -1,70 +1,259 @@
+"""
+Report of the loading speed from the JSON logs of the loader.
+
+    python log-analyzer.py [PATH|GLOB ...] [--output log_report.pdf] [--workers N] [--chunk-mb 16]
+    python log-analyzer.py --journal [DIR|PATH|GLOB ...] [--output log_report.pdf] [--freq 1min]
+
+Inputs are plain or gzip-compressed (`.gz`) log files, globs are expanded (`**` included) and
+default to logs.txt. Files are read in chunks cut at line boundaries and the chunks are parsed
+in a process pool, so memory is bound by the chunk size and the number of workers, not by the
+size of the logs. Only lines mentioning an insert are decoded as JSON; the number of documents
+and the bulk duration come from the `documents` and `duration_s` fields, older logs fall back to
+the message text and a `duration:` line following the insert.
+
+With `--journal` the inputs are the per-batch telemetry journal written under TELEMETRY_PATH
+(`.arrow`, `.parquet` or `.jsonl` files, directories are searched for them). The journal is
+loaded as columns without any parsing, throughput is resampled per `--freq` interval and peaks
+and drops are flagged over those intervals.
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
 import re
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator
+
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-import logging
 
 LOG_FILE = "logs.txt"
 PDF_REPORT = "log_report.pdf"
+CHUNK_BYTES = 16 * 1024 * 1024
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+INSERT_MARKER = b"Successfully inserted"
+DURATION_MARKER = b"duration:"
 insert_pattern = re.compile(r'Successfully inserted (\d+) documents')
 duration_pattern = re.compile(r'duration:(\d+\.\d+)s')
 timestamp_pattern = re.compile(r'"asctime": "(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d+)"')
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+# Lines, the insert included, searched for the duration of an insert in older logs
+DURATION_LOOKAHEAD = 3
+JOURNAL_EXTENSIONS = (".arrow", ".parquet", ".jsonl")
+STAGES = ("decode_s", "transform_s", "index_s", "commit_s")
+
 
-def parse_logs(file_path):
-    records = []
+# --- Reading ---
+def expand_paths(patterns: Iterable[str]) -> list[str]:
+    """ Files matching the patterns, in order and without duplicates """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            logger.error(f"File {pattern} not found")
+        paths.extend(path for path in matches if os.path.isfile(path) and path not in paths)
+    return paths
+
+
+def read_chunks(path: str, chunk_bytes: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """ Chunks of about `chunk_bytes` ending at a line boundary, gzip files are decompressed on the fly """
+    opener = gzip.open if path.endswith(".gz") else open
     try:
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        logger.error(f"File {file_path} not found")
-        return pd.DataFrame()
-    except Exception as e:
-        logger.error(f"Error when reading a file {file_path}: {e}")
-        return pd.DataFrame()
+        with opener(path, "rb") as file:
+            rest = b""
+            while data := file.read(chunk_bytes):
+                data = rest + data
+                cut = data.rfind(b"\n") + 1
+                rest = data[cut:]
+                if cut:
+                    yield data[:cut]
+            if rest:
+                yield rest
+    except (OSError, EOFError) as e:
+        logger.error(f"Error when reading a file {path}: {e}")
+
+
+# --- Parsing ---
+def parse_chunk(data: bytes) -> dict[str, list]:
+    """ Inserts found in a chunk of log lines as columns """
+    columns = {"timestamp": [], "num_docs": [], "duration_sec": []}
+    waiting = None
+    lines_left = 0
+    for line in data.split(b"\n"):
+        lines_left -= 1
+        is_insert = INSERT_MARKER in line
+        looking = waiting is not None and lines_left >= 0
+        if not is_insert and not (looking and DURATION_MARKER in line):
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("not a log record")
+            message = str(record.get("message", ""))
+        except ValueError:
+            record = None
+            message = line.decode("utf-8", errors="replace")
+
+        duration = record.get("duration_s") if record else None
+        if duration is None:
+            match = duration_pattern.search(message)
+            duration = float(match.group(1)) if match else None
+        if not is_insert:
+            if duration is not None:
+                columns["duration_sec"][waiting] = duration
+                waiting = None
+            continue
+
+        documents = record.get("documents") if record else None
+        if documents is None:
+            match = insert_pattern.search(message)
+            if not match:
+                continue
+            documents = match.group(1)
+        if record:
+            timestamp = record.get("asctime")
+        else:
+            match = timestamp_pattern.search(message)
+            timestamp = match.group(1) if match else None
+        try:
+            documents = int(documents)
+            duration = 0.0 if duration is None else float(duration)
+        except (TypeError, ValueError):
+            logger.error(f"String parsing error: {message}")
+            continue
+        columns["timestamp"].append(timestamp)
+        columns["num_docs"].append(documents)
+        columns["duration_sec"].append(duration)
+        waiting = len(columns["num_docs"]) - 1 if not duration else None
+        lines_left = DURATION_LOOKAHEAD - 1
+    return columns
+
+
+def to_frame(columns: dict[str, list]) -> pd.DataFrame:
+    """ Typed frame of parsed columns """
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime(
+            pd.Series(columns["timestamp"], dtype="object"), format=TIMESTAMP_FORMAT, errors="coerce"),
+        "num_docs": pd.Series(columns["num_docs"], dtype="int64"),
+        "duration_sec": pd.Series(columns["duration_sec"], dtype="float64"),
+    })
+
+
+def parse_chunk_frame(data: bytes) -> pd.DataFrame:
+    return to_frame(parse_chunk(data))
+
+
+def _bounded_map(pool: ProcessPoolExecutor, function: Callable, items: Iterable, limit: int) -> Iterator:
+    """ Like `pool.map`, but reads `items` lazily and keeps at most `limit` of them in flight """
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(function, item))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def parse_logs(patterns: Iterable[str], workers: int | None = None, chunk_bytes: int = CHUNK_BYTES) -> pd.DataFrame:
+    workers = workers or os.cpu_count() or 1
+    chunks = (chunk for path in expand_paths(patterns) for chunk in read_chunks(path, chunk_bytes))
+    if workers == 1:
+        frames = [parse_chunk_frame(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            frames = list(_bounded_map(pool, parse_chunk_frame, chunks, workers * 2))
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return to_frame({"timestamp": [], "num_docs": [], "duration_sec": []})
+    return pd.concat(frames, ignore_index=True)
+
+
+# --- Telemetry journal ---
+def expand_journal(patterns: Iterable[str]) -> list[str]:
+    """ Journal files matching the patterns, directories are searched for them """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*")
+        paths.extend(path for path in expand_paths([pattern]) if path.endswith(JOURNAL_EXTENSIONS))
+    return list(dict.fromkeys(paths))
 
-    for i, line in enumerate(lines):
+
+def read_arrow_stream(path: str):
+    """ Record batches of an Arrow IPC stream, a file cut short by a crash is read up to its last complete batch """
+    import pyarrow as pa
+    batches = []
+    with pa.OSFile(path, "rb") as source:
+        reader = pa.ipc.open_stream(source)
+        try:
+            for batch in reader:
+                batches.append(batch)
+        except (pa.ArrowInvalid, OSError) as e:
+            logger.warning(f"Journal {path} is truncated, {len(batches)} batches read: {e}")
+        return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+def load_journal(patterns: Iterable[str]) -> pd.DataFrame:
+    """ Batch records of the journal, timestamps as UTC datetimes, sorted by completion """
+    frames = []
+    for path in expand_journal(patterns):
         try:
-            insert_match = insert_pattern.search(line)
-            if insert_match:
-                num_docs = int(insert_match.group(1))
-                duration = 0.0
-                for j in range(i, min(i+3, len(lines))):
-                    d_match = duration_pattern.search(lines[j])
-                    if d_match:
-                        duration = float(d_match.group(1))
-                        break
-                ts_match = timestamp_pattern.search(line)
-                timestamp = datetime.strptime(ts_match.group(1), "%Y-%m-%d %H:%M:%S,%f") if ts_match else None
-
-                records.append({
-                    'timestamp': timestamp,
-                    'num_docs': num_docs,
-                    'duration_sec': duration
-                })
-        except Exception as e:
-            logger.error(f"String parsing error {i}: {e}")
-    return pd.DataFrame(records)
+            if path.endswith(".arrow"):
+                frames.append(read_arrow_stream(path).to_pandas())
+            elif path.endswith(".parquet"):
+                frames.append(pd.read_parquet(path))
+            else:
+                frames.append(pd.read_json(path, lines=True, dtype=False))
+        except (OSError, ValueError) as e:
+            logger.error(f"Error when reading a journal {path}: {e}")
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    for column in ("started_at", "finished_at"):
+        df[column] = pd.to_datetime(df[column], unit="s", utc=True)
+    return df.sort_values("finished_at", kind="stable", ignore_index=True)
+
+
+def journal_throughput(df: pd.DataFrame, freq: str = "1min") -> pd.DataFrame:
+    """ Documents per minute over `freq` intervals, idle intervals included so stalls show up as drops """
+    totals = df.set_index("finished_at")[["documents", "records", "bytes", "failed", "retries"]].resample(freq).sum()
+    minutes = pd.Timedelta(freq) / pd.Timedelta(minutes=1)
+    throughput = totals.reset_index(names="timestamp")
+    throughput["speed_per_min"] = throughput["documents"] / minutes
+    return flag_peaks(throughput)
+
 
 # --- Analysis  ---
+def flag_peaks(df: pd.DataFrame, window: int = 30) -> pd.DataFrame:
+    """ Speeds more than 20% above or below their rolling average """
+    df["rolling_avg"] = df["speed_per_min"].rolling(window=window, min_periods=1).mean()
+    df["is_peak"] = df["speed_per_min"] > (df["rolling_avg"] * 1.2)
+    df["is_drop"] = df["speed_per_min"] < (df["rolling_avg"] * 0.8)
+    return df
+
+
 def enrich_dataframe(df):
     try:
         df = df[df["duration_sec"] > 0].copy()
-        df.sort_values("timestamp", inplace=True)
+        df.sort_values("timestamp", inplace=True, kind="stable")
         df["speed_per_min"] = df["num_docs"] / df["duration_sec"] * 60
-        df["rolling_avg"] = df["speed_per_min"].rolling(window=30, min_periods=1).mean()
-        df["is_peak"] = df["speed_per_min"] > (df["rolling_avg"] * 1.2)
-        df["is_drop"] = df["speed_per_min"] < (df["rolling_avg"] * 0.8)
+        df = flag_peaks(df)
     except Exception as e:
         logger.error(f"Data enrichment error: {e}")
     return df
 
+
 # --- Graphing ---
 def plot_speed_graph(df):
+    # Imported here, the parsing workers never need matplotlib
+    import matplotlib.pyplot as plt
     try:
         plt.figure(figsize=(10, 5))
         plt.plot(df["timestamp"], df["speed_per_min"], label="Speed", alpha=0.5)
@@ -81,10 +270,13 @@ def plot_speed_graph(df):
         logger.error(f"Error in plotting the graph: {e}")
     return plt
 
+
 # --- PDF generation ---
-def generate_pdf_report(df):
+def generate_pdf_report(df, output: str = PDF_REPORT):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
     try:
-        with PdfPages(PDF_REPORT) as pdf:
+        with PdfPages(output) as pdf:
             # Text information
             fig, ax = plt.subplots(figsize=(8.5, 5))
             ax.axis('off')
@@ -113,11 +305,66 @@ def generate_pdf_report(df):
     except Exception as e:
         logger.error(f"Error during PDF report generation: {e}")
 
+
+def generate_journal_report(batches: pd.DataFrame, throughput: pd.DataFrame, output: str = PDF_REPORT):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+    try:
+        with PdfPages(output) as pdf:
+            fig, ax = plt.subplots(figsize=(8.5, 5))
+            ax.axis('off')
+            ax.set_title("Batch telemetry report", fontsize=16, fontweight='bold', loc='center')
+
+            span = batches["finished_at"].max() - batches["started_at"].min()
+            quantiles = batches[list(STAGES)].quantile([0.5, 0.99])
+            stages = "\n".join(
+                f"            • {stage[:-2]}: p50 {quantiles.at[0.5, stage] * 1000:.1f} ms, "
+                f"p99 {quantiles.at[0.99, stage] * 1000:.1f} ms"
+                for stage in STAGES
+            )
+            text = f"""
+            • Period: {batches["started_at"].min():%Y-%m-%d %H:%M} - {batches["finished_at"].max():%Y-%m-%d %H:%M} UTC ({span})
+            • Batches: {len(batches)}, records: {int(batches["records"].sum())}, documents: {int(batches["documents"].sum())}
+            • Volume: {batches["bytes"].sum() / 1024 / 1024:.1f} MiB
+            • Retries: {int(batches["retries"].sum())}, failed documents: {int(batches["failed"].sum())}
+            • Peak intervals: {int(throughput["is_peak"].sum())}, drop intervals: {int(throughput["is_drop"].sum())}
+{stages}
+            """
+            ax.text(0.05, 0.95, text, fontsize=11, verticalalignment='top')
+            pdf.savefig(fig)
+            plt.close()
+
+            plot_speed_graph(throughput)
+            pdf.savefig()
+            plt.close()
+    except Exception as e:
+        logger.error(f"Error during PDF report generation: {e}")
+
+
 if __name__ == "__main__":
-    df = parse_logs(LOG_FILE)
-    if not df.empty:
-        enriched_df = enrich_dataframe(df)
-        generate_pdf_report(enriched_df)
-        logger.info(f"✅ The report is saved in {PDF_REPORT}")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", metavar="PATH", help="log files or globs, .gz allowed")
+    parser.add_argument("--output", default=PDF_REPORT)
+    parser.add_argument("--workers", type=int, default=None, help="parsing processes, defaults to the CPU count")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / 1024 / 1024)
+    parser.add_argument("--journal", action="store_true", help="read the telemetry journal instead of logs")
+    parser.add_argument("--freq", default="1min", help="throughput interval of the journal report")
+    args = parser.parse_args()
+
+    if args.journal:
+        if not args.paths:
+            parser.error("--journal needs the journal directory or files")
+        batches = load_journal(args.paths)
+        if not batches.empty:
+            generate_journal_report(batches, journal_throughput(batches, args.freq), args.output)
+            logger.info(f"✅ The report is saved in {args.output}")
+        else:
+            logger.warning("No data to process")
     else:
-        logger.warning("No data to process")
\ No newline at end of file
+        df = parse_logs(args.paths or [LOG_FILE], workers=args.workers, chunk_bytes=int(args.chunk_mb * 1024 * 1024))
+        if not df.empty:
+            enriched_df = enrich_dataframe(df)
+            generate_pdf_report(enriched_df, args.output)
+            logger.info(f"✅ The report is saved in {args.output}")
+        else:
+            logger.warning("No data to process")
@@ -1,26 +1,109 @@
 import asyncio
+import os
+import shutil
+import signal
 
 import metrics
-from config import KafkaSettings, ElasticSettings, get_settings
+from config import (
+    KafkaSettings, ElasticSettings, DeadLetterSettings, TransformSettings, ProfilingSettings, TelemetrySettings,
+    HealthSettings, application_settings, get_settings
+)
+from domain.transform import compile_transform, load_transform_spec
+from health import HealthReporter
 from logger import get_logger
+from profiling import attach_loop
 from ports.input.kafka_service import KafkaConsumerService
+from ports.output.dead_letter import DeadLetterService
 from ports.output.elastic_service import ElasticsearchClientService
+from ports.output.telemetry import TelemetryJournal
+from supervisor import MULTIPROC_DIR_ENV, Supervisor, prepare_multiprocess_metrics
 
 logger = get_logger(__name__)
 kafka_settings: KafkaSettings = get_settings(KafkaSettings)
 elastic_settings: ElasticSettings = get_settings(ElasticSettings)
+dead_letter_settings: DeadLetterSettings = get_settings(DeadLetterSettings)
+transform_settings: TransformSettings = get_settings(TransformSettings)
+profiling_settings: ProfilingSettings = get_settings(ProfilingSettings)
+telemetry_settings: TelemetrySettings = get_settings(TelemetrySettings)
+health_settings: HealthSettings = get_settings(HealthSettings)
 
 async def main():
-    elastic_client = ElasticsearchClientService(settings=elastic_settings)
-    kafka_consumer = KafkaConsumerService(elastic_client=elastic_client, settings=kafka_settings)
-    await kafka_consumer.connect()
-    await elastic_client.connect()
-    await kafka_consumer.start()
+    attach_loop(asyncio.get_running_loop())
+    dead_letters = DeadLetterService(settings=dead_letter_settings, bootstrap_servers=kafka_settings.bootstrap_servers)
+    elastic_client = ElasticsearchClientService(
+        settings=elastic_settings, dead_letters=dead_letters, in_flight=kafka_settings.max_in_flight)
+    journal = TelemetryJournal(telemetry_settings) if telemetry_settings.path else None
+    kafka_consumer = KafkaConsumerService(
+        elastic_client=elastic_client, settings=kafka_settings, dead_letters=dead_letters,
+        transform=compile_transform(load_transform_spec(transform_settings)), journal=journal)
+    health = HealthReporter({
+        "kafka": lambda: kafka_consumer.ready,
+        "elasticsearch": lambda: elastic_client.connected and elastic_client.available,
+    }, health_settings.interval_s)
+    health_task = asyncio.create_task(health.run())
+    try:
+        # Both dependencies are awaited together, a cold start waits for the slower one only
+        connecting = asyncio.gather(kafka_consumer.connect(), elastic_client.connect())
+        try:
+            await connecting
+        except BaseException:
+            connecting.cancel()
+            await asyncio.gather(connecting, return_exceptions=True)
+            await kafka_consumer.close()
+            raise
+        await dead_letters.start()
+        if journal:
+            await journal.start()
+        # Rollouts and scale-ins send SIGTERM: stop fetching, drain and commit, then leave the group
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, kafka_consumer.stop)
+        try:
+            await kafka_consumer.start()
+        finally:
+            await dead_letters.stop()
+            if journal:
+                await journal.stop()
+    finally:
+        health_task.cancel()
+        await asyncio.gather(health_task, return_exceptions=True)
 
 
-if __name__ == "__main__":
+def run_worker():
+    """ Entry point of a worker process """
+    # Ctrl+C reaches the whole process group, stopping the workers is left to the supervisor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
     try:
-        metrics.start_metrics_server()
         asyncio.run(main())
+        logger.info(f"Worker {os.getpid()} stopped")
+    except asyncio.CancelledError:
+        logger.warning(f"Worker {os.getpid()} stopped before its batches were drained")
+    except Exception as e:
+        logger.error(f"StreamingDataLoader worker error messages: {e}")
+        raise SystemExit(1)
+
+
+def supervise(workers: int):
+    """ Runs the consumers in `workers` processes behind a single aggregated metrics endpoint """
+    owned = not os.environ.get(MULTIPROC_DIR_ENV)
+    path = prepare_multiprocess_metrics()
+    try:
+        metrics.start_metrics_server(live_timeout_s=health_settings.live_timeout_s)
+        # Workers get their drain time plus a margin to leave the group before they are killed
+        Supervisor(run_worker, workers, shutdown_timeout_s=kafka_settings.drain_timeout_s + 5).run()
+    finally:
+        if owned:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    try:
+        if application_settings.workers > 1:
+            supervise(application_settings.workers)
+        else:
+            metrics.start_metrics_server(
+                profiling_token=profiling_settings.token, profiling_max_seconds=profiling_settings.max_seconds,
+                live_timeout_s=health_settings.live_timeout_s)
+            asyncio.run(main())
+    except asyncio.CancelledError:
+        logger.warning("StreamingDataLoader stopped before its batches were drained")
     except Exception as e:
         logger.error(f"StreamingDataLoader error messages: {e}")
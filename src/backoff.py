@@ -0,0 +1,7 @@
+import random
+
+
+def full_jitter(attempt: int, base_s: float, max_s: float) -> float:
+    """ Delay before retry `attempt` (from 1): uniform up to `base_s` doubled per attempt and capped at `max_s`,
+    so replicas starting together do not retry in lockstep """
+    return random.uniform(0, min(max_s, base_s * 2 ** (attempt - 1)))
@@ -0,0 +1,83 @@
+import json
+from typing import Any, Callable
+
+from logger import get_logger
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional dependency
+    msgspec = None
+
+logger = get_logger(__name__)
+
+
+class JsonCodec:
+    """ Standard library codec. Decodes straight from bytes and encodes to compact UTF-8 bytes """
+
+    name = "json"
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def dumps(self, data: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+        return json.dumps(data, default=default, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8", "surrogatepass")
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def loads(self, data: bytes) -> Any:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN and Infinity literals are only accepted by the standard library
+            return json.loads(data)
+
+    def dumps(self, data: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+        return orjson.dumps(data, default=default)
+
+
+class MsgspecCodec(JsonCodec):
+    name = "msgspec"
+
+    def __init__(self):
+        self._decoder = msgspec.json.Decoder()
+        self._encoder = msgspec.json.Encoder()
+
+    def loads(self, data: bytes) -> Any:
+        try:
+            return self._decoder.decode(data)
+        except msgspec.DecodeError:
+            # NaN and Infinity literals are only accepted by the standard library
+            return json.loads(data)
+
+    def dumps(self, data: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+        if default is None:
+            return self._encoder.encode(data)
+        return msgspec.json.encode(data, enc_hook=default)
+
+
+CODECS: dict[str, type[JsonCodec]] = {"json": JsonCodec}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec
+if msgspec is not None:
+    CODECS["msgspec"] = MsgspecCodec
+
+
+def get_codec(name: str = "auto") -> JsonCodec:
+    """ Returns the requested codec. `auto` picks the fastest installed library,
+    an unavailable one falls back to the standard library. orjson decodes integers beyond
+    64 bits as floats, `json` is the exact default """
+    if name == "auto":
+        name = next((candidate for candidate in ("orjson", "msgspec") if candidate in CODECS), "json")
+    codec = CODECS.get(name)
+    if codec is None:
+        logger.warning(f"JSON codec {name} is not installed, falling back to json")
+        codec = JsonCodec
+    return codec()
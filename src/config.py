@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import Type, TypeVar
+from typing import Literal, Type, TypeVar
 
 import dotenv
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -18,6 +18,7 @@ class ApplicationSettings(BaseSettings):
 
     pod_name: str = "streaming-data-loader"
     replicas: int = 0
+    workers: int = 1
 
 
 application_settings: ApplicationSettings = get_settings(ApplicationSettings)
@@ -31,6 +32,29 @@ class KafkaSettings(BaseSettings):
     consumer_group: str = "consumer_group_name"
     batch_size: int = 100
     timeout_ms: int = 5000
+    mode: Literal["serial", "pipelined", "partitioned"] = "serial"
+    max_in_flight: int = 4
+    partition_in_flight: int = 1
+    queue_size: int = 8
+    raw_bulk: bool = False
+    codec: Literal["auto", "json", "orjson", "msgspec"] = "json"
+    adaptive_batching: bool = False
+    min_batch_size: int = 10
+    max_batch_size: int = 5000
+    target_batch_bytes: int = 5 * 1024 * 1024
+    batch_latency_budget_ms: int = 2000
+    backpressure: bool = False
+    max_in_flight_bytes: int = 64 * 1024 * 1024
+    max_bulk_latency_ms: int = 10000
+    max_throttle_rate: float = 0.1
+    resume_ratio: float = 0.5
+    lag_interval_s: float = 15
+    drain_timeout_s: float = 25
+    commit_interval_ms: int = 0
+    commit_batches: int = 10
+    connect_attempts: int = 10
+    connect_backoff_ms: int = 200
+    connect_backoff_max_ms: int = 5000
 
 
 class ElasticSettings(BaseSettings):
@@ -40,7 +64,98 @@ class ElasticSettings(BaseSettings):
 
     url: str = "http://elasticsearch:9200"
     index: str = "index_name"
+    routing: str = ""
+    index_template_name: str = ""
+    index_template_file: str = ""
+    data_stream: bool = False
     retry: int = 3
+    sniff_on_start: bool = False
+    sniff_on_node_failure: bool = False
+    sniff_interval_s: float = 0
+    connections_per_node: int = 0
+    http_compress: bool = False
+    retry_backoff_ms: int = 500
+    retry_backoff_max_ms: int = 30000
+    breaker_failure_threshold: int = 5
+    breaker_reset_timeout_s: float = 30
+    hold_timeout_s: float = 600
+    id_strategy: Literal["none", "offset", "hash", "field"] = "none"
+    id_fields: str = ""
+    op_type: Literal["auto", "index", "create"] = "auto"
+    codec: Literal["auto", "json", "orjson", "msgspec"] = "json"
+    connect_attempts: int = 10
+    connect_backoff_ms: int = 200
+    connect_backoff_max_ms: int = 5000
+
+
+class DeadLetterSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        str_strip_whitespace=True, env_prefix="dead_letter_"
+    )
+
+    sink: Literal["log", "kafka", "file"] = "log"
+    topic: str = "dead_letters"
+    bootstrap_servers: str = ""
+    path: str = "dead_letters.ndjson"
+    max_bytes: int = 100 * 1024 * 1024
+    backup_count: int = 5
+    buffer_size: int = 10000
+    batch_size: int = 500
+    flush_interval_ms: int = 1000
+    stop_timeout_s: float = 10
+    connect_backoff_ms: int = 1000
+    connect_backoff_max_ms: int = 30000
+    codec: Literal["auto", "json", "orjson", "msgspec"] = "json"
+
+
+class TransformSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        str_strip_whitespace=True, env_prefix="transform_"
+    )
+
+    file: str = ""
+    spec: str = ""
+
+
+class TelemetrySettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        str_strip_whitespace=True, env_prefix="telemetry_"
+    )
+
+    path: str = ""
+    format: Literal["auto", "arrow", "jsonl"] = "auto"
+    max_bytes: int = 64 * 1024 * 1024
+    max_files: int = 168
+    buffer_size: int = 10000
+    flush_interval_ms: int = 5000
+
+
+class BackfillSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        str_strip_whitespace=True, env_prefix="backfill_"
+    )
+
+    group: str = ""
+    batch_size: int = 5000
+    max_in_flight: int = 16
+    queue_size: int = 32
+    progress_interval_s: float = 10
+    bulk_settings: bool = True
+
+
+class FileSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        str_strip_whitespace=True, env_prefix="file_"
+    )
+
+    batch_size: int = 5000
+    max_in_flight: int = 8
+    read_size: int = 1024 * 1024
+    codec: Literal["auto", "json", "orjson", "msgspec"] = "json"
+    checkpoint_path: str = ""
+    checkpoint_interval_s: float = 5
+    bulk_settings: bool = True
+    stdin_source: str = ""
 
 
 class PrometheusSettings(BaseSettings):
@@ -49,3 +164,21 @@ class PrometheusSettings(BaseSettings):
     )
 
     port: int = 9090
+
+
+class ProfilingSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        str_strip_whitespace=True, env_prefix="profiling_"
+    )
+
+    token: str = ""
+    max_seconds: float = 60
+
+
+class HealthSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        str_strip_whitespace=True, env_prefix="health_"
+    )
+
+    interval_s: float = 1
+    live_timeout_s: float = 30
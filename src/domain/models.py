@@ -13,3 +13,21 @@ class EventModel:
         """ Data transformation """
         self.event["timestamp"] = int(time.time())
         return self.event
+
+
+class Batch:
+    """ Events of a single fetch together with the offsets to commit once they are indexed.
+    `count` is the number of fetched records the batch was built from, rejected ones included.
+    `timings` holds the duration of every stage the batch went through, for the telemetry journal """
+
+    def __init__(self, events: list[dict], offsets: dict, ranges: dict | None = None, size: int = 0,
+                 sources: list | None = None, count: int = 0, started_at: float = 0.0):
+        self.events = events
+        self.offsets = offsets
+        self.ranges = ranges or {}
+        self.size = size
+        self.sources = sources or []
+        self.count = count
+        self.started_at = started_at
+        self.timings: dict[str, float] = {}
+        self.result = None
@@ -0,0 +1,182 @@
+import json
+from typing import Any, Callable
+
+from config import TransformSettings
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover - optional dependency
+    yaml = None
+
+# Default spec: the behaviour of EventModel, stamping every event with the batch time
+DEFAULT_SPEC = {"timestamp": "timestamp"}
+
+SPEC_KEYS = frozenset({"include", "exclude", "rename", "cast", "drop_if", "timestamp"})
+RULE_OPERATORS = ("equals", "not_equals", "in", "missing", "exists")
+_TRUE = frozenset({"true", "1", "yes", "y", "on"})
+_FALSE = frozenset({"false", "0", "no", "n", "off", ""})
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in _TRUE:
+            return True
+        if lowered in _FALSE:
+            return False
+        raise ValueError(f"Cannot cast {value!r} to bool")
+    return bool(value)
+
+
+def _to_int(value: Any) -> int:
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"Cannot cast {value!r} to int without losing precision")
+    return int(value)
+
+
+CASTS: dict[str, Callable[[Any], Any]] = {"int": _to_int, "float": float, "str": str, "bool": _to_bool}
+
+
+class TransformResult:
+    """ Events kept by a transform, the input position of each of them and the events that failed """
+
+    def __init__(self, events: list[dict], positions: list[int], failures: list[tuple[int, Exception]],
+                 dropped: int):
+        self.events = events
+        self.positions = positions
+        self.failures = failures
+        self.dropped = dropped
+
+
+class CompiledTransform:
+    """ Batch function compiled from a transform spec.
+
+    Steps run in this order on every event: `drop_if` rules on the incoming fields, `include`
+    projection, `exclude`, `rename`, `cast` on the renamed fields and the `timestamp` stamp.
+    Fields are top-level keys. An event a rule or a cast fails on is rejected, the others go on """
+
+    def __init__(self, spec: dict, function: Callable[[list[dict], int], TransformResult], source: str):
+        self.spec = spec
+        self.function = function
+        self.source = source
+
+    @property
+    def identity(self) -> bool:
+        """ True when the spec only stamps the default timestamp field, as raw bulk indexing does """
+        return self.spec == DEFAULT_SPEC
+
+    def __call__(self, events: list[dict], timestamp: int) -> TransformResult:
+        return self.function(events, timestamp)
+
+
+def compile_transform(spec: dict | None = None) -> CompiledTransform:
+    """ Validates a spec and generates a single loop over the batch with every step inlined """
+    spec = DEFAULT_SPEC if spec is None else spec
+    unknown = set(spec) - SPEC_KEYS
+    if unknown:
+        raise ValueError(f"Unknown transform keys: {', '.join(sorted(unknown))}")
+    _check_shapes(spec)
+
+    constants = {"TransformResult": TransformResult}
+
+    def constant(value) -> str:
+        name = f"_c{len(constants)}"
+        constants[name] = value
+        return name
+
+    lines = [
+        "def transform(events, timestamp):",
+        "    kept = []",
+        "    positions = []",
+        "    failures = []",
+        "    for position, event in enumerate(events):",
+    ]
+    lines.append("        try:")
+    body_start = len(lines)
+    for rule in spec.get("drop_if") or []:
+        lines.append(f"            if {_condition(rule, constant)}:")
+        lines.append("                continue")
+    include = spec.get("include")
+    if include:
+        lines.append(f"            event = {{key: event[key] for key in {constant(tuple(include))} if key in event}}")
+    for field in spec.get("exclude") or []:
+        lines.append(f"            event.pop({field!r}, None)")
+    for old, new in (spec.get("rename") or {}).items():
+        lines.append(f"            if {old!r} in event:")
+        lines.append(f"                event[{new!r}] = event.pop({old!r})")
+    for field, type_name in (spec.get("cast") or {}).items():
+        if type_name not in CASTS:
+            raise ValueError(f"Unknown cast type {type_name} for {field}, expected one of {', '.join(CASTS)}")
+        lines.append(f"            value = event.get({field!r})")
+        lines.append("            if value is not None:")
+        lines.append(f"                event[{field!r}] = {constant(CASTS[type_name])}(value)")
+    if len(lines) == body_start:
+        lines.append("            pass")
+    # An unhashable value tested by an `in` rule, a failed cast or an event that is not an object
+    lines.append("        except (AttributeError, TypeError, ValueError) as error:")
+    lines.append("            failures.append((position, error))")
+    lines.append("            continue")
+
+    timestamp_field = spec.get("timestamp")
+    if timestamp_field:
+        lines.append(f"        event[{timestamp_field!r}] = timestamp")
+    lines.append("        kept.append(event)")
+    lines.append("        positions.append(position)")
+    lines.append("    return TransformResult(kept, positions, failures, len(events) - len(kept) - len(failures))")
+
+    source = "\n".join(lines)
+    namespace = dict(constants)
+    exec(compile(source, "<transform>", "exec"), namespace)
+    return CompiledTransform(spec, namespace["transform"], source)
+
+
+def _check_shapes(spec: dict):
+    """ Refuses values of the wrong shape, a string `exclude` would otherwise drop one-letter fields """
+    for key in ("include", "exclude"):
+        value = spec.get(key)
+        if value is not None and not (isinstance(value, list) and all(isinstance(item, str) for item in value)):
+            raise ValueError(f"Transform key {key} must be a list of field names, got {value!r}")
+    for key in ("rename", "cast"):
+        value = spec.get(key)
+        if value is not None and not (isinstance(value, dict) and all(
+                isinstance(name, str) and isinstance(target, str) for name, target in value.items())):
+            raise ValueError(f"Transform key {key} must map field names to strings, got {value!r}")
+    rules = spec.get("drop_if")
+    if rules is not None and not (isinstance(rules, list) and all(isinstance(rule, dict) for rule in rules)):
+        raise ValueError(f"Transform key drop_if must be a list of rules, got {rules!r}")
+
+
+def _condition(rule: dict, constant: Callable[[Any], str]) -> str:
+    field = rule.get("field")
+    operators = [operator for operator in RULE_OPERATORS if operator in rule]
+    if not field or len(operators) != 1:
+        raise ValueError(f"A drop_if rule needs a field and one of {', '.join(RULE_OPERATORS)}: {rule}")
+    operator = operators[0]
+    value = rule[operator]
+    if operator == "equals":
+        return f"event.get({field!r}) == {constant(value)}"
+    if operator == "not_equals":
+        return f"event.get({field!r}) != {constant(value)}"
+    if operator == "in":
+        try:
+            values = frozenset(value)
+        except TypeError:
+            values = tuple(value)
+        return f"event.get({field!r}) in {constant(values)}"
+    if operator == "missing":
+        return f"({field!r} {'not in' if value else 'in'} event)"
+    return f"({field!r} {'in' if value else 'not in'} event)"
+
+
+def load_transform_spec(settings: TransformSettings) -> dict | None:
+    """ Spec given inline as JSON or in a YAML or JSON file, None when neither is set """
+    if settings.spec:
+        return json.loads(settings.spec)
+    if not settings.file:
+        return None
+    with open(settings.file, encoding="utf-8") as file:
+        if settings.file.endswith((".yml", ".yaml")):
+            if yaml is None:
+                raise RuntimeError("PyYAML is required for YAML transform specs, install the transform extra")
+            return yaml.safe_load(file) or {}
+        return json.load(file)
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from typing import Callable, Iterable
+
+from prometheus_client import CollectorRegistry
+
+from logger import get_logger
+from metrics import worker_heartbeat_seconds, worker_ready
+
+logger = get_logger(__name__)
+
+
+class HealthReporter:
+    """ Publishes the readiness and the liveness of a worker through gauges, so the probes served by the
+    metrics server answer for every worker process once their metrics are aggregated.
+
+    Every `interval_s` the event loop records a heartbeat and evaluates `checks`: the worker is ready
+    while all of them pass. A blocked or hung loop stops the heartbeat and fails /live, while a down
+    dependency or a draining consumer only fails /ready """
+
+    def __init__(self, checks: dict[str, Callable[[], bool]], interval_s: float = 1):
+        self.checks = checks
+        self.interval = interval_s
+        self._failing: list[str] | None = None
+
+    def report(self) -> bool:
+        failing = [name for name, check in self.checks.items() if not check()]
+        if failing != self._failing:
+            if failing:
+                logger.info(f"Not ready: waiting for {', '.join(failing)}")
+            else:
+                logger.info("Ready")
+            self._failing = failing
+        worker_ready.set(0 if failing else 1)
+        worker_heartbeat_seconds.set(time.time())
+        return not failing
+
+    async def run(self):
+        try:
+            while True:
+                self.report()
+                await asyncio.sleep(self.interval)
+        finally:
+            worker_ready.set(0)
+
+
+class HealthApp:
+    """ WSGI app answering the Kubernetes probes in front of the metrics app.
+
+    GET /ready   200 while every worker is ready, 503 otherwise or before any worker reported
+    GET /live    200 unless a worker missed its heartbeats for `live_timeout_s`, a worker that
+                 did not report yet is still starting and counts as alive """
+
+    def __init__(self, metrics_app: Callable, registry: CollectorRegistry, live_timeout_s: float = 30):
+        self.metrics_app = metrics_app
+        self.registry = registry
+        self.live_timeout = live_timeout_s
+
+    def __call__(self, environ: dict, start_response: Callable) -> Iterable[bytes]:
+        path = environ.get("PATH_INFO", "")
+        if path == "/ready":
+            return self._respond(start_response, self.ready(), "ready", "not ready")
+        if path == "/live":
+            return self._respond(start_response, self.live(), "alive", "heartbeat missed")
+        return self.metrics_app(environ, start_response)
+
+    def ready(self) -> bool:
+        return self.registry.get_sample_value("worker_ready") == 1
+
+    def live(self) -> bool:
+        heartbeat = self.registry.get_sample_value("worker_heartbeat_seconds")
+        return not heartbeat or time.time() - heartbeat < self.live_timeout
+
+    @staticmethod
+    def _respond(start_response: Callable, ok: bool, success: str, failure: str) -> Iterable[bytes]:
+        status, body = ("200 OK", success) if ok else ("503 Service Unavailable", failure)
+        start_response(status, [("Content-Type", "text/plain; charset=utf-8")])
+        return [f"{body}\n".encode()]
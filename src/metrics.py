@@ -1,6 +1,12 @@
-from prometheus_client import Counter, Summary, CollectorRegistry, start_http_server
+from prometheus_client import (
+    Counter, Gauge, Histogram, Summary, CollectorRegistry, REGISTRY, make_wsgi_app, multiprocess
+)
+from prometheus_client.exposition import ThreadingWSGIServer
 from typing import Callable, Optional, Coroutine, Any
+from wsgiref.simple_server import WSGIRequestHandler, make_server
 import functools
+import os
+import threading
 import time
 
 from logger import get_logger
@@ -12,21 +18,127 @@ registry = CollectorRegistry()
 # Counters
 messages_processed = Counter("messages_processed_total", "Total number of processed messages")
 errors_total = Counter("errors_total", "Total number of errors")
+bulk_item_errors_total = Counter(
+    "bulk_item_errors_total", "Documents rejected by a bulk request", ["reason", "action"]
+)
+bulk_duplicates_total = Counter(
+    "bulk_duplicates_total", "Replayed documents skipped because their id is already indexed"
+)
+events_filtered_total = Counter("events_filtered_total", "Events dropped by a drop_if rule of the transform")
+dead_letters_total = Counter("dead_letters_total", "Records sent to the dead-letter sink", ["reason"])
+dead_letters_dropped_total = Counter(
+    "dead_letters_dropped_total", "Dead letters lost because the buffer was full or the sink failed"
+)
+telemetry_dropped_total = Counter(
+    "telemetry_dropped_total", "Telemetry journal records lost because the buffer was full or the write failed"
+)
 
-# Runtime metrics
-consume_time_metric = Summary("consume_duration_seconds", "Time spent consuming messages")
-response_time_metric = Summary("response_duration_seconds", "Time spent to response")
-transform_time_metric = Summary("transform_duration_seconds", "Time spent transforming messages")
-batch_processing_time_metric = Summary("batch_processing_duration_seconds", "Time spent processing the entire batch")
+# Runtime metrics, observed once per batch with monotonic clocks
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BULK_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RECORD_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+BYTE_BUCKETS = tuple(1024 * 4 ** power for power in range(10))
 
+stage_time_metric = Histogram(
+    "pipeline_stage_duration_seconds", "Time a batch spends in a consumer stage: fetch, decode, transform or commit",
+    ["stage", "topic"], buckets=STAGE_BUCKETS
+)
+bulk_time_metric = Histogram(
+    "bulk_duration_seconds", "Time of a bulk insert including its retries", ["index"], buckets=BULK_BUCKETS
+)
+batch_processing_time_metric = Histogram(
+    "batch_processing_duration_seconds", "Time to index a batch and collect its result", ["topic"],
+    buckets=BULK_BUCKETS
+)
+batch_records_metric = Histogram("batch_records", "Records per indexed batch", ["topic"], buckets=RECORD_BUCKETS)
+batch_bytes_metric = Histogram("batch_bytes", "Kafka value bytes per indexed batch", ["topic"], buckets=BYTE_BUCKETS)
+es_node_request_time_metric = Histogram(
+    "elasticsearch_node_request_duration_seconds", "Time of a request to a single Elasticsearch node", ["node"]
+)
+es_node_errors_total = Counter("elasticsearch_node_errors_total", "Failed requests per Elasticsearch node", ["node"])
 
-def start_metrics_server(port: int = 8000):
+# Circuit breaker
+# Gauges are aggregated over the live worker processes in multiprocess mode
+circuit_breaker_state = Gauge(
+    "elasticsearch_circuit_state", "Elasticsearch circuit breaker state: 0 closed, 1 half-open, 2 open",
+    multiprocess_mode="livemax"
+)
+
+# Batching
+batch_target_records = Gauge(
+    "batch_target_records", "Current number of records requested per fetch", multiprocess_mode="liveall"
+)
+
+# Backpressure
+in_flight_bytes = Gauge(
+    "in_flight_bytes", "Bytes fetched from Kafka and not yet indexed", multiprocess_mode="livesum"
+)
+consumer_paused = Gauge(
+    "consumer_paused", "1 while fetching is paused because Elasticsearch falls behind", multiprocess_mode="livemax"
+)
+
+
+# Consumer lag, each consumer reports the partitions assigned to it
+consumer_partition_lag = Gauge(
+    "consumer_partition_lag", "Records between the committed and the end offset of an assigned partition",
+    ["topic", "partition"], multiprocess_mode="livesum"
+)
+consumer_lag = Gauge(
+    "consumer_lag", "Records between the committed and the end offsets of the assigned partitions",
+    ["topic"], multiprocess_mode="livesum"
+)
+
+
+# Background commits, their latency is the commit stage of pipeline_stage_duration_seconds
+commit_lag_seconds = Gauge(
+    "commit_lag_seconds", "Age of the oldest indexed offset that is not committed yet", multiprocess_mode="livemax"
+)
+commit_lag_records = Gauge(
+    "commit_lag_records", "Records indexed but not committed yet", multiprocess_mode="livesum"
+)
+replay_remaining_records = Gauge(
+    "replay_remaining_records", "Records of the replayed range not indexed and committed yet", multiprocess_mode="livesum"
+)
+
+# Health of the workers behind /ready and /live, the least healthy worker decides
+worker_ready = Gauge(
+    "worker_ready", "1 while both dependencies are connected and the consumer is fetching", multiprocess_mode="livemin"
+)
+worker_heartbeat_seconds = Gauge(
+    "worker_heartbeat_seconds", "Unix time of the last heartbeat of the worker event loop", multiprocess_mode="livemin"
+)
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = 8000, profiling_token: str = "", profiling_max_seconds: float = 60,
+                         live_timeout_s: float = 30):
+    """ Serves the metrics of this process, or the aggregate of all worker processes
+    when PROMETHEUS_MULTIPROC_DIR is set, together with the /ready and /live probes.
+    A profiling token adds the /debug endpoints """
     logger.info(f"Starting Prometheus metrics server on port {port}")
-    start_http_server(port)
+    collector_registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        collector_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector_registry)
+
+    from health import HealthApp
+    app = HealthApp(make_wsgi_app(collector_registry), collector_registry, live_timeout_s)
+    if profiling_token:
+        from profiling import ProfilingApp
+        app = ProfilingApp(app, profiling_token, profiling_max_seconds)
+    server = make_server("0.0.0.0", port, app, ThreadingWSGIServer, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    if profiling_token:
+        logger.info("Profiling endpoints enabled under /debug")
 
 
 def counter_metric_decorator(
-        metric: Optional[Summary] = None,
+        metric: Optional[Histogram | Summary] = None,
         catch_exception: bool = True
 ) -> Callable[[Callable[..., Coroutine[Any, Any, Any]]], Callable[..., Coroutine[Any, Any, Any]]]:
     """ Decorator for counting processed messages, errors and execution time """
@@ -34,7 +146,7 @@ def counter_metric_decorator(
     def decorator(func: Callable[..., Coroutine[Any, Any, Any]]) -> Callable[..., Coroutine[Any, Any, Any]]:
         @functools.wraps(func)
         async def async_wrapper(*args, **kwargs) -> Any:
-            start_time = time.time()
+            start_time = time.perf_counter()
             try:
                 result = await func(*args, **kwargs)
                 return result
@@ -46,7 +158,7 @@ def counter_metric_decorator(
                 raise e
             finally:
                 if metric:
-                    duration = time.time() - start_time
+                    duration = time.perf_counter() - start_time
                     metric.observe(duration)
 
         return async_wrapper
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from aiokafka import TopicPartition
+
+from config import KafkaSettings
+from logger import get_logger
+from metrics import commit_lag_records, commit_lag_seconds
+
+logger = get_logger(__name__)
+
+Commit = Callable[[dict[TopicPartition, int]], Awaitable[None]]
+
+
+class CommitScheduler:
+    """ Commits acknowledged offsets in the background instead of after every batch.
+
+    Offsets are acknowledged once their batch is indexed and committed every `commit_interval_ms`
+    or as soon as `commit_batches` batches were acknowledged, whichever comes first. Only indexed
+    offsets are ever committed, so a crash replays at most the acknowledged but uncommitted records
+    and delivery stays at least once. Shutdown and revocation flush the pending offsets themselves """
+
+    def __init__(self, settings: KafkaSettings):
+        self.interval = settings.commit_interval_ms / 1000
+        self.batches = max(settings.commit_batches, 1)
+        self._pending: dict[TopicPartition, int] = {}
+        self._committed: dict[TopicPartition, int] = {}
+        self._acknowledged = 0
+        self._oldest: float | None = None
+        self._due = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def ack(self, offsets: dict[TopicPartition, int]) -> None:
+        """ Next offsets to commit of an indexed batch """
+        for topic_partition, offset in offsets.items():
+            self._pending[topic_partition] = max(offset, self._pending.get(topic_partition, offset))
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self._acknowledged += 1
+        if self._acknowledged >= self.batches:
+            self._due.set()
+        self._export()
+
+    async def run(self, commit: Commit):
+        while True:
+            try:
+                await asyncio.wait_for(self._due.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush(commit)
+            except Exception as e:
+                # The offsets stay pending, the next round commits them together with the newer ones
+                logger.warning(f"Background commit failed: {e}")
+            self._export()
+
+    async def flush(self, commit: Commit, partitions: set[TopicPartition] | None = None):
+        """ Commits the pending offsets of `partitions`, or of every partition, and waits for the broker """
+        async with self._lock:
+            offsets = {
+                topic_partition: offset
+                for topic_partition, offset in self._pending.items()
+                if partitions is None or topic_partition in partitions
+            }
+            if partitions is None:
+                self._due.clear()
+                self._acknowledged = 0
+            if not offsets:
+                return
+            for topic_partition in offsets:
+                del self._pending[topic_partition]
+            try:
+                await commit(offsets)
+            except BaseException:
+                for topic_partition, offset in offsets.items():
+                    self._pending[topic_partition] = max(offset, self._pending.get(topic_partition, offset))
+                raise
+            self._committed.update(offsets)
+            if not self._pending:
+                self._oldest = None
+            self._export()
+
+    def forget(self, partitions: set[TopicPartition]) -> None:
+        """ Drops revoked partitions once they were flushed """
+        for topic_partition in partitions:
+            self._pending.pop(topic_partition, None)
+            self._committed.pop(topic_partition, None)
+        if not self._pending:
+            self._oldest = None
+        self._export()
+
+    def _export(self):
+        commit_lag_seconds.set(0 if self._oldest is None else time.monotonic() - self._oldest)
+        commit_lag_records.set(sum(
+            offset - self._committed[topic_partition]
+            for topic_partition, offset in self._pending.items() if topic_partition in self._committed
+        ))
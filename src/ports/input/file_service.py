@@ -0,0 +1,377 @@
+import asyncio
+import contextlib
+import gzip
+import itertools
+import json
+import mmap
+import os
+import sys
+import time
+from typing import BinaryIO, Iterator
+
+from codec import get_codec
+from config import FileSettings
+from domain.models import Batch
+from domain.transform import CompiledTransform
+from logger import get_logger
+from ports.output.circuit_breaker import CircuitOpenError
+from ports.output.dead_letter import DeadLetterService
+from ports.output.elastic_service import ElasticsearchClientService
+from ports.output.telemetry import TelemetryJournal
+from services.batch_steps import BatchSteps
+from services.event_service import HeldBatch, process_events
+from services.offset_tracker import OffsetTracker
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = get_logger(__name__)
+
+STDIN = "-"
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Byte offset of a line, offset of the line after it and the line itself without its newline
+Line = tuple[int, int, memoryview]
+
+
+class LineSource:
+    """ Origin of a document read from a file, in place of the Kafka message of consumed ones:
+    the resolved path of the file, or the source name given to stdin, as topic, partition 0 and the byte
+    offset of its line. Dead letters point at the line and the offset id strategy gives the same `_id`
+    to a line loaded twice, and distinct ones to files sharing a name in different directories """
+
+    __slots__ = ("topic", "partition", "offset")
+
+    def __init__(self, topic: str, offset: int):
+        self.topic = topic
+        self.partition = 0
+        self.offset = offset
+
+
+def mapped_lines(path: str, start: int = 0) -> Iterator[Line]:
+    """ Lines of an uncompressed file from byte `start` on, as views of a read-only memory map """
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if start >= size:
+            return
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, "madvise"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    view = memoryview(mapped)
+    try:
+        position = start
+        while position < size:
+            end = mapped.find(b"\n", position)
+            if end < 0:
+                end = size
+            yield position, min(end + 1, size), view[position:end]
+            position = end + 1
+    finally:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            # A line is still referenced, the map is unmapped once it is released
+            pass
+
+
+def stream_lines(stream: BinaryIO, start: int = 0, read_size: int = 1024 * 1024) -> Iterator[Line]:
+    """ Lines of a stream that cannot be mapped, as views of the chunks read from it. Offsets count
+    decompressed bytes and the lines before `start` are read and skipped, a stream cannot seek """
+    offset = 0
+    rest = b""
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            break
+        if rest:
+            chunk = rest + chunk
+        last = chunk.rfind(b"\n")
+        if last < 0:
+            rest = chunk
+            continue
+        rest = chunk[last + 1:]
+        view = memoryview(chunk)
+        position = 0
+        while position <= last:
+            end = chunk.find(b"\n", position)
+            if offset + position >= start:
+                yield offset + position, offset + end + 1, view[position:end]
+            position = end + 1
+        offset += last + 1
+    if rest and offset >= start:
+        yield offset, offset + len(rest), memoryview(rest)
+
+
+def _decompressed(stream: BinaryIO, head: bytes) -> BinaryIO:
+    if head.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("Reading zstd input requires the zstandard package (the `zstd` extra)")
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    return stream
+
+
+def input_size(path: str) -> int | None:
+    """ Size of a file read through a memory map, None for stdin and compressed files """
+    if path == STDIN:
+        return None
+    with open(path, "rb") as file:
+        if _decompressed(file, file.read(4)) is not file:
+            return None
+    return os.path.getsize(path)
+
+
+def open_lines(path: str, start: int = 0, read_size: int = 1024 * 1024) -> Iterator[Line]:
+    """ Lines of a file or of stdin (`-`). Gzip and zstd input is recognized by its magic bytes and
+    decompressed in chunks, plain files are memory-mapped """
+    if path == STDIN:
+        stdin = sys.stdin.buffer
+        yield from stream_lines(_decompressed(stdin, stdin.peek(4)[:4]), start, read_size)
+        return
+    with open(path, "rb") as file:
+        head = file.read(4)
+        file.seek(0)
+        stream = _decompressed(file, head)
+        if stream is not file:
+            with stream:
+                yield from stream_lines(stream, start, read_size)
+            return
+    yield from mapped_lines(path, start)
+
+
+class FileCheckpoint:
+    """ Byte offset up to which every file is indexed, in a JSON file replaced atomically on every save.
+    Only whole lines are counted, a resumed load starts at the first line not yet acknowledged """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                self.files = json.load(file)
+
+    def offset(self, key: str) -> int:
+        return self.files.get(key, {}).get("offset", 0)
+
+    def completed(self, key: str) -> bool:
+        return self.files.get(key, {}).get("complete", False)
+
+    def save(self, key: str, offset: int, complete: bool = False):
+        self.files[key] = {"offset": offset, "complete": complete, "updated_at": time.time()}
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.files, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+
+
+class FileLoaderService:
+    """ Bulk-loads NDJSON files, or NDJSON piped to stdin, through the transform and bulk path of the
+    Kafka consumer. Batches are read and decoded in a worker thread while up to `max_in_flight` bulks
+    are indexed, and the offset of the acknowledged lines is checkpointed so an interrupted load resumes """
+
+    def __init__(self, elastic_client: ElasticsearchClientService, settings: FileSettings,
+                 dead_letters: DeadLetterService | None = None, transform: CompiledTransform | None = None,
+                 journal: TelemetryJournal | None = None, checkpoint: FileCheckpoint | None = None):
+        self.es_client = elastic_client
+        self.settings = settings
+        self.checkpoint = checkpoint
+        self.steps = BatchSteps(transform, dead_letters, journal)
+        self.codec = get_codec(self.settings.codec)
+        # orjson and msgspec parse the views in place, the standard library only takes bytes
+        self._copy_lines = self.codec.name == "json"
+        self.loaded: list[str] = []
+        # Byte offset up to which every file is acknowledged
+        self.offsets: dict[str, int] = {}
+        self._tracker = OffsetTracker()
+        self._stopping = asyncio.Event()
+        self._failure: BaseException | None = None
+        self._saved = 0.0
+        logger.info(f"File loader initialized with {self.codec.name} codec.")
+
+    def stop(self):
+        if not self._stopping.is_set():
+            logger.info("Stopping the file load after the bulks in flight")
+        self._stopping.set()
+
+    async def load(self, paths: list[str]) -> bool:
+        """ Loads the files one after the other, True once all of them are indexed to their end """
+        if STDIN in paths and not self.settings.stdin_source:
+            raise ValueError("Reading stdin needs a source name (FILE_STDIN_SOURCE) to trace and identify its lines")
+        self.loaded = []
+        for path in paths:
+            if self._stopping.is_set():
+                break
+            if await self._load(path):
+                self.loaded.append(path)
+        return len(self.loaded) == len(paths)
+
+    async def _load(self, path: str) -> bool:
+        key = STDIN if path == STDIN else os.path.abspath(path)
+        name = self.settings.stdin_source if path == STDIN else os.path.realpath(path)
+        checkpoint = self.checkpoint if path != STDIN else None
+        size = input_size(path)
+        start = 0
+        if checkpoint:
+            if checkpoint.completed(key):
+                logger.info(f"{path} was loaded already, skipping it")
+                return True
+            start = checkpoint.offset(key)
+            if size is not None and start > size:
+                logger.warning(f"Checkpoint of {path} is past its end ({start} > {size} bytes), loading it again")
+                start = 0
+            elif start:
+                logger.info(f"Resuming {path} at byte {start}")
+        self.offsets[key] = start
+        lines = open_lines(path, start, self.settings.read_size)
+        slots = asyncio.Semaphore(self.settings.max_in_flight)
+        in_flight = set()
+        started = time.monotonic()
+        ended = False
+        try:
+            while not self._stopping.is_set() and self._failure is None:
+                read = await asyncio.to_thread(self._read_batch, lines, key, name)
+                if read is None:
+                    ended = True
+                    break
+                batch, rejected = read
+                for value, source, error in rejected:
+                    self.steps.reject(value, source, error)
+                self._transform(batch)
+                first, _ = batch.ranges[key]
+                self._tracker.track(key, *batch.ranges[key])
+                if not batch.events:
+                    self._tracker.ack(key, first)
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(self._index(batch, key))
+                in_flight.add(task)
+                task.add_done_callback(lambda done: self._done(done, in_flight, slots))
+            if in_flight:
+                await asyncio.wait(set(in_flight))
+            if self._failure is not None:
+                raise self._failure
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+            with contextlib.suppress(ValueError):
+                # Still running in the worker thread when the load was cancelled, it is closed once collected
+                lines.close()
+            offset = self._acknowledged(key)
+            complete = ended and self._failure is None
+            if checkpoint:
+                checkpoint.save(key, offset, complete)
+            self._report(name, offset - start, size, started, complete)
+        return complete
+
+    def _read_batch(self, lines: Iterator[Line], key: str, name: str) -> tuple[Batch, list] | None:
+        """ Decodes the next `batch_size` lines into a batch and the lines that could not be decoded,
+        None at the end of the file. Runs in a worker thread """
+        events = []
+        sources = []
+        rejected = []
+        first = next_offset = None
+        size = 0
+        count = 0
+        started_at = time.time()
+        started = time.perf_counter()
+        for offset, next_offset, line in itertools.islice(lines, self.settings.batch_size):
+            if first is None:
+                first = offset
+            count += 1
+            size += len(line)
+            if not line or line == b"\r":
+                continue
+            source = LineSource(name, offset)
+            try:
+                events.append(self._decode(line))
+            except Exception as e:
+                # Copied, a view would keep the map open while the dead letter waits to be written
+                rejected.append((bytes(line), source, e))
+                continue
+            sources.append(source)
+        if first is None:
+            return None
+        batch = Batch(events, {key: next_offset}, {key: (first, next_offset)}, size, sources, count, started_at)
+        batch.timings["decode_s"] = time.perf_counter() - started
+        return batch, rejected
+
+    def _decode(self, line: memoryview) -> dict:
+        event = self.codec.loads(bytes(line) if self._copy_lines else line)
+        if not isinstance(event, dict):
+            raise ValueError("Invalid message format")
+        return event
+
+    def _transform(self, batch: Batch):
+        """ Runs the compiled transform over the batch with a single timestamp """
+        if not batch.events:
+            return
+        started = time.perf_counter()
+        result = self.steps.apply_transform(batch.events, batch.sources)
+        if len(result.positions) < len(batch.sources):
+            batch.sources = [batch.sources[position] for position in result.positions]
+        batch.events = result.events
+        batch.timings["transform_s"] = time.perf_counter() - started
+
+    async def _index(self, batch: Batch, key: str):
+        """ Indexes a batch, holding it while the Elasticsearch circuit is open, and acknowledges its lines """
+        started = time.perf_counter()
+        held = HeldBatch(self.es_client, batch.events, batch.sources)
+        while True:
+            try:
+                result = held.settle(await process_events(self.es_client, held.events, sources=held.sources))
+                break
+            except CircuitOpenError as e:
+                # Not acknowledged, what the cluster did not settle is sent again once it is back
+                if not await held.hold(e):
+                    result = held.result
+                    break
+                started = time.perf_counter()
+        batch.result = result
+        batch.timings["index_s"] = time.perf_counter() - started
+        first, _ = batch.ranges[key]
+        self._tracker.ack(key, first)
+        started = time.perf_counter()
+        self._save(key)
+        self.steps.journal_batch(batch, list(batch.ranges), time.perf_counter() - started)
+
+    def _done(self, task: asyncio.Task, in_flight: set, slots: asyncio.Semaphore):
+        in_flight.discard(task)
+        slots.release()
+        if not task.cancelled() and task.exception() and self._failure is None:
+            self._failure = task.exception()
+
+    def _save(self, key: str):
+        """ Checkpoints the acknowledged offset at most every `checkpoint_interval_s` """
+        now = time.monotonic()
+        if now - self._saved < self.settings.checkpoint_interval_s:
+            return
+        self._saved = now
+        if key not in self._tracker.committable():
+            return
+        offset = self._acknowledged(key)
+        if self.checkpoint and key != STDIN:
+            self.checkpoint.save(key, offset)
+        logger.info(f"Indexed {os.path.basename(key)} up to byte {offset}")
+
+    def _acknowledged(self, key: str) -> int:
+        offset = self._tracker.committable().get(key)
+        if offset is not None:
+            self._tracker.mark_committed({key: offset})
+            self.offsets[key] = offset
+        return self.offsets[key]
+
+    @staticmethod
+    def _report(name: str, loaded: int, size: int | None, started: float, complete: bool):
+        elapsed = time.monotonic() - started
+        rate = loaded / elapsed / 1024 / 1024 if elapsed > 0 else 0
+        state = "Loaded" if complete else "Stopped loading"
+        of_total = f"/{size}" if size else ""
+        logger.info(f"{state} {name}: {loaded}{of_total} bytes in {elapsed:.1f}s ({rate:.1f} MB/s)")
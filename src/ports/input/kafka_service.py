@@ -1,75 +1,694 @@
 import asyncio
-import json
+import time
+from functools import partial
 
-from aiokafka import AIOKafkaConsumer, OffsetAndMetadata
+from aiokafka import AIOKafkaConsumer, ConsumerRebalanceListener, OffsetAndMetadata, TopicPartition
+from aiokafka.errors import CommitFailedError, IllegalStateError
 
+from backoff import full_jitter
+from codec import get_codec
 from config import KafkaSettings
-from domain.models import EventModel
+from domain.models import Batch
+from domain.transform import CompiledTransform
 from logger import get_logger
-from metrics import consume_time_metric, errors_total
+from metrics import batch_bytes_metric, batch_processing_time_metric, batch_records_metric, stage_time_metric
+from ports.input.commit_scheduler import CommitScheduler
+from ports.input.lag_collector import LagCollector
+from ports.input.replay import ReplayProgress, ReplayRange
+from ports.output.bulk_body import is_json_object
+from ports.output.circuit_breaker import CircuitOpenError
+from ports.output.dead_letter import DeadLetterService
 from ports.output.elastic_service import ElasticsearchClientService
-from services.event_service import process_events
+from ports.output.telemetry import TelemetryJournal
+from services.backpressure import BackpressureController
+from services.batch_steps import BatchSteps
+from services.batcher import AdaptiveBatcher
+from services.event_service import HeldBatch, process_events
+from services.offset_tracker import OffsetTracker
 
 logger = get_logger(__name__)
 
 
+class CommitOnRevoke(ConsumerRebalanceListener):
+    """ Flushes and commits revoked partitions before the group hands them to another consumer,
+    so their in-flight records are not indexed a second time by the new owner """
+
+    def __init__(self, service: "KafkaConsumerService", consumer: AIOKafkaConsumer):
+        self.service = service
+        self.consumer = consumer
+
+    async def on_partitions_revoked(self, revoked: set[TopicPartition]):
+        await self.service.drain(self.consumer, revoked)
+
+    async def on_partitions_assigned(self, assigned: set[TopicPartition]):
+        self.service.assigned(self.consumer, assigned)
+
+
 class KafkaConsumerService:
 
-    def __init__(self, elastic_client: ElasticsearchClientService, settings: KafkaSettings):
+    def __init__(self, elastic_client: ElasticsearchClientService, settings: KafkaSettings,
+                 dead_letters: DeadLetterService | None = None, transform: CompiledTransform | None = None,
+                 journal: TelemetryJournal | None = None, replay: ReplayRange | None = None):
         self.es_client = elastic_client
         self.settings = settings
-        logger.info("Kafka Consumer initialized.")
+        self.replay = replay
+        self.progress: ReplayProgress | None = None
+        self.steps = BatchSteps(transform, dead_letters, journal)
+        if self.settings.raw_bulk and not self.steps.transform.identity:
+            raise ValueError("KAFKA_RAW_BULK indexes values as they are and cannot be combined with a transform")
+        self.codec = get_codec(self.settings.codec)
+        self.batcher = AdaptiveBatcher(self.settings)
+        self.backpressure = BackpressureController(self.settings)
+        self.lag = LagCollector(self.settings)
+        self.commits = CommitScheduler(self.settings)
+        topic = self.settings.consumer_topics
+        self._stage_time = {
+            stage: stage_time_metric.labels(stage=stage, topic=topic)
+            for stage in ("fetch", "decode", "transform", "commit")
+        }
+        self._batch_time = batch_processing_time_metric.labels(topic=topic)
+        self._batch_records = batch_records_metric.labels(topic=topic)
+        self._batch_bytes = batch_bytes_metric.labels(topic=topic)
+        # Partitions paused because their worker falls behind, they stay paused when backpressure ends
+        self._queue_paused = set()
+        self._paused = False
+        # Polls with every partition paused while batches are held on an unavailable cluster
+        self._poll_lock = asyncio.Lock()
+        self._keep_alive: asyncio.Task | None = None
+        self._holders = 0
+        # End offsets of a replay and the partitions that reached them, paused until the replay stops
+        self._ends: dict[TopicPartition, int] = {}
+        self._finished: set[TopicPartition] = set()
+        # Fetched records not yet indexed or rejected, nothing is in flight while `_idle` is set
+        self._outstanding = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Next offset after the last fetched record and the last committed offset of every partition
+        self._positions: dict[TopicPartition, int] = {}
+        self._committed: dict[TopicPartition, int] = {}
+        # Partition queues of the partitioned mode, woken up to flush their buffer on revocation
+        self._queues: dict[TopicPartition, asyncio.Queue] = {}
+        self._flushing = False
+        self._stopping = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._consumer: AIOKafkaConsumer | None = None
+        self._running = False
+        self._deadline: asyncio.TimerHandle | None = None
+        logger.info(f"Kafka Consumer initialized with {self.codec.name} codec.")
+
+    def _create_consumer(self) -> AIOKafkaConsumer:
+        return AIOKafkaConsumer(
+            bootstrap_servers=self.settings.bootstrap_servers,
+            group_id=self.settings.consumer_group,
+            enable_auto_commit=False
+        )
 
     async def connect(self):
-        """ Connection to Kafka. Repeats 10 times every 3 seconds in case of failure """
-        for _ in range(10):
+        """ Starts the consumer `start` then subscribes, so the brokers are checked without a throwaway client.
+        Retries `connect_attempts` times with exponential backoff. Joining the group is left to `start` """
+        attempts = self.settings.connect_attempts
+        for attempt in range(1, attempts + 1):
+            consumer = None
             try:
-                consumer = AIOKafkaConsumer(
-                    self.settings.consumer_topics,
-                    bootstrap_servers=self.settings.bootstrap_servers
-                )
+                consumer = self._create_consumer()
                 await consumer.start()
-                await consumer.stop()
+                self._consumer = consumer
                 logger.info("Kafka is available!")
                 return
             except Exception as e:
-                logger.warning(f"Waiting for Kafka... {e}")
-                await asyncio.sleep(3)
+                error = e
+            finally:
+                if consumer is not None and self._consumer is not consumer:
+                    await self._close(consumer)
+            if attempt < attempts:
+                delay = full_jitter(
+                    attempt, self.settings.connect_backoff_ms / 1000, self.settings.connect_backoff_max_ms / 1000)
+                logger.warning(f"Waiting for Kafka, attempt {attempt}/{attempts} failed, "
+                               f"retrying in {delay:.2f}s... {error}")
+                await asyncio.sleep(delay)
         raise ConnectionError("Could not connect to Kafka")
 
-    @consume_time_metric.time()
+    async def close(self):
+        """ Stops a consumer that was connected but never started """
+        if self._consumer is not None and not self._running:
+            consumer, self._consumer = self._consumer, None
+            await self._close(consumer)
+
+    @staticmethod
+    async def _close(consumer: AIOKafkaConsumer):
+        try:
+            await consumer.stop()
+        except Exception as e:
+            logger.warning(f"Kafka consumer not stopped cleanly: {e}")
+
+    @property
+    def ready(self) -> bool:
+        """ True while the consumer is subscribed and fetching, false while it starts or drains """
+        return self._running and not self._stopping.is_set()
+
     async def start(self):
-        """ Asynchronous reading of messages from Kafka with a waiting """
-        consumer = AIOKafkaConsumer(
-            self.settings.consumer_topics,
-            bootstrap_servers=self.settings.bootstrap_servers,
-            group_id=self.settings.consumer_group,
-            value_deserializer=lambda v: json.loads(v.decode('utf-8')),
-            enable_auto_commit=False
-        )
-        await consumer.start()
+        """ Asynchronous reading of messages from Kafka with a waiting.
+        Returns once `stop` was called and everything fetched has been indexed and committed,
+        or once a replay reached the end of its range """
+        if self._consumer is None:
+            await self.connect()
+        consumer = self._consumer
+        self._task = asyncio.current_task()
+        self._running = True
+        commit = partial(self._commit, consumer)
+        tasks = set()
         try:
-            while True:
-                last_offsets = {}
-                events = []
-                messages = await consumer.getmany(
-                    timeout_ms=self.settings.timeout_ms,
-                    max_records=self.settings.batch_size)
-                for topic_partition, messages in messages.items():
-                    for message in messages:
-                        if isinstance(message.value, dict):
-                            event = EventModel(message.value)
-                            events.append(event.event_convert())
-                            last_offsets[topic_partition] = message.offset + 1
-                        else:
-                            errors_total.inc()
-                            logger.error(f"Invalid message format: {message.value}")
-                if events:
-                    await process_events(self.es_client, events)
-                    offsets = {
-                        topic_partition: OffsetAndMetadata(offset, "")
-                        for topic_partition, offset in last_offsets.items()
-                    }
-                    await consumer.commit(offsets)
+            if self.replay is not None:
+                await self._assign(consumer)
+                tasks.add(asyncio.create_task(self._report_progress()))
+            else:
+                # Subscribing after the start joins the group in the background while the first fetch waits for it
+                consumer.subscribe([self.settings.consumer_topics], listener=CommitOnRevoke(self, consumer))
+            if self.lag.enabled:
+                tasks.add(asyncio.create_task(self.lag.run(consumer)))
+            if self.commits.enabled:
+                tasks.add(asyncio.create_task(self.commits.run(commit)))
+            if self.settings.mode == "pipelined":
+                await self._run_pipelined(consumer)
+            elif self.settings.mode == "partitioned":
+                await self._run_partitioned(consumer)
+            else:
+                await self._run_serial(consumer)
+            await self.commits.flush(commit)
+            await self._commit_positions(consumer)
+            if self.progress:
+                logger.info(self.progress.report(self._committed))
+            logger.info("Kafka consumer drained, leaving the group")
         finally:
+            if self._deadline:
+                self._deadline.cancel()
+            await self._cancel(tasks)
+            await self._flush_commits(commit)
+            self._running = False
+            self._consumer = None
             await consumer.stop()
+
+    @property
+    def replay_complete(self) -> bool:
+        """ True once every record of the replay range is indexed and its offset committed """
+        return self.progress is not None and self.progress.done(self._committed) == self.progress.total
+
+    async def _assign(self, consumer: AIOKafkaConsumer):
+        """ Assigns the partitions of the replay range and seeks to its first offsets, no group is joined """
+        ranges = await self.replay.resolve(consumer)
+        self.progress = ReplayProgress(ranges)
+        self._ends = {topic_partition: end for topic_partition, (_, end) in ranges.items()}
+        if not ranges:
+            logger.info(f"Nothing to replay in {self.replay.topic}")
+            self._stopping.set()
+            return
+        consumer.assign(list(ranges))
+        for topic_partition, (start, _) in ranges.items():
+            consumer.seek(topic_partition, start)
+        logger.info(f"Replaying {self.progress.total} records from {len(ranges)} partitions of {self.replay.topic}")
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.replay.progress_interval)
+            logger.info(self.progress.report(self._committed))
+
+    async def _clip(self, consumer: AIOKafkaConsumer, messages: dict) -> dict:
+        """ Drops fetched records past the end of the replay and pauses the partitions that reached it.
+        Fetching stops once all of them did, what is in flight is still indexed and committed """
+        clipped = {}
+        for topic_partition, records in messages.items():
+            end = self._ends.get(topic_partition, 0)
+            if records and records[-1].offset >= end:
+                records = [message for message in records if message.offset < end]
+            if records:
+                clipped[topic_partition] = records
+        for topic_partition, end in self._ends.items():
+            # The position and not the last record, compaction and transaction markers leave gaps before the end
+            if topic_partition not in self._finished and await consumer.position(topic_partition) >= end:
+                self._finished.add(topic_partition)
+                consumer.pause(topic_partition)
+        if len(self._finished) == len(self._ends) and not self._stopping.is_set():
+            logger.info("End of the replay range reached, draining")
+            self._stopping.set()
+        return clipped
+
+    def stop(self):
+        """ Stops fetching. Buffered and in-flight batches are still indexed and committed before `start`
+        returns and the consumer leaves the group, unless that takes longer than `drain_timeout_s` """
+        if self._stopping.is_set():
+            return
+        logger.info(f"Stopping, draining in-flight batches for up to {self.settings.drain_timeout_s}s")
+        self._stopping.set()
+        if self._task and not self._task.done():
+            self._deadline = asyncio.get_running_loop().call_later(self.settings.drain_timeout_s, self._abort)
+
+    def _abort(self):
+        logger.warning(f"In-flight batches not drained within {self.settings.drain_timeout_s}s, "
+                       f"their records will be consumed again")
+        self._task.cancel()
+
+    async def drain(self, consumer: AIOKafkaConsumer, partitions: set[TopicPartition]):
+        """ Waits until every fetched record is indexed or rejected, then commits the fetch position of
+        `partitions`. aiokafka returns no records while a rebalance is in progress, so nothing new comes in """
+        if not partitions:
+            return
+        self._flushing = True
+        for queue in self._queues.values():
+            queue.put_nowait([])
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.settings.drain_timeout_s)
+            await self.commits.flush(partial(self._commit, consumer), partitions)
+            await self._commit_positions(consumer, partitions)
+        except asyncio.TimeoutError:
+            logger.warning(f"Revoked partitions not drained within {self.settings.drain_timeout_s}s, "
+                           f"their new owner will consume the uncommitted records again")
+        finally:
+            self._flushing = False
+            self.commits.forget(partitions)
+            for partition in partitions:
+                self._positions.pop(partition, None)
+                self._committed.pop(partition, None)
+
+    def assigned(self, consumer: AIOKafkaConsumer, partitions: set[TopicPartition]):
+        """ A new assignment starts unpaused, the backpressure pause carries over to it """
+        self._queue_paused.clear()
+        if self.settings.mode == "partitioned":
+            # Every partition runs its own bulks, the pool is sized from max_in_flight unless configured
+            self.es_client.check_pool(len(partitions) * self.settings.partition_in_flight)
+        if self._paused and partitions:
+            consumer.pause(*partitions)
+
+    def _hold(self, records: int):
+        if records:
+            self._outstanding += records
+            self._idle.clear()
+
+    def _settle(self, records: int):
+        self._outstanding = max(self._outstanding - records, 0)
+        if not self._outstanding:
+            self._idle.set()
+
+    async def _fetch(self, consumer: AIOKafkaConsumer) -> dict:
+        self._apply_backpressure(consumer)
+        started = time.perf_counter()
+        async with self._poll_lock:
+            messages = await consumer.getmany(
+                timeout_ms=self.settings.timeout_ms,
+                max_records=self.batcher.max_records)
+        self._stage_time["fetch"].observe(time.perf_counter() - started)
+        if self._ends:
+            messages = await self._clip(consumer, messages)
+        count = 0
+        for topic_partition, records in messages.items():
+            if records:
+                count += len(records)
+                self._positions[topic_partition] = records[-1].offset + 1
+        for topic_partition in self._finished:
+            # Nothing is left before the end of the replay, gaps included
+            self._positions[topic_partition] = self._ends[topic_partition]
+        self._hold(count)
+        if self.backpressure.enabled:
+            self.backpressure.acquire(sum(
+                message.serialized_value_size for records in messages.values() for message in records))
+        return messages
+
+    def _apply_backpressure(self, consumer: AIOKafkaConsumer):
+        """ Pauses every assigned partition while Elasticsearch falls behind or its circuit is open.
+        Polling goes on while paused, so the consumer keeps its group membership and no rebalance is triggered """
+        paused = self.backpressure.should_pause() or not self.es_client.available
+        if paused == self._paused:
+            return
+        self._paused = paused
+        if paused:
+            logger.warning(f"Elasticsearch falls behind, pausing consumption "
+                           f"({self.backpressure.in_flight_bytes} bytes in flight)")
+            consumer.pause(*consumer.assignment())
+        else:
+            logger.info("Elasticsearch caught up, resuming consumption")
+            consumer.resume(*(consumer.assignment() - self._queue_paused - self._finished))
+
+    async def _hold_batch(self, held: HeldBatch, error: CircuitOpenError) -> bool:
+        """ Holds a batch on an unavailable cluster, see `HeldBatch.hold`. The consumer keeps polling with every
+        partition paused meanwhile, so a hold longer than `max_poll_interval_ms` does not evict it from the group
+        even when the fetch stage is blocked on full queues """
+        consumer = self._consumer
+        if consumer is None:
+            return await held.hold(error)
+        self._holders += 1
+        if self._keep_alive is None:
+            self._keep_alive = asyncio.create_task(self._poll_paused(consumer))
+        try:
+            return await held.hold(error)
+        finally:
+            self._holders -= 1
+            if not self._holders and self._keep_alive is not None:
+                keep_alive, self._keep_alive = self._keep_alive, None
+                await self._cancel({keep_alive})
+
+    async def _poll_paused(self, consumer: AIOKafkaConsumer):
+        """ Polls with every assigned partition paused. Consumption resumes on the next fetch once the cluster
+        is back, records returned anyway are fetched again from their first offset """
+        while True:
+            if not self._paused:
+                logger.warning("Elasticsearch unavailable, pausing consumption while batches are held")
+                self._paused = True
+            consumer.pause(*consumer.assignment())
+            try:
+                async with self._poll_lock:
+                    messages = await consumer.getmany(timeout_ms=self.settings.timeout_ms)
+            except Exception as e:
+                logger.warning(f"Poll while batches are held failed: {e}")
+                await asyncio.sleep(self.settings.timeout_ms / 1000)
+                continue
+            for topic_partition, records in messages.items():
+                if records:
+                    consumer.seek(topic_partition, records[0].offset)
+
+    def _convert(self, value) -> dict | bytes:
+        """ Decoded event. Raw values are passed through untouched, malformed messages raise """
+        if self.settings.raw_bulk:
+            if value and is_json_object(value):
+                return value
+        else:
+            if isinstance(value, (bytes, bytearray)):
+                value = self.codec.loads(value)
+            if isinstance(value, dict):
+                return value
+        raise ValueError("Invalid message format")
+
+    def _build_batch(self, messages: dict) -> Batch:
+        """ Decodes and transforms fetched messages, remembering the next offset of every partition """
+        ranges = {}
+        events = []
+        sources = []
+        partitions = []
+        size = 0
+        count = 0
+        started_at = time.time()
+        started = time.perf_counter()
+        for topic_partition, records in messages.items():
+            count += len(records)
+            if records:
+                ranges[topic_partition] = (records[0].offset, records[-1].offset + 1)
+            for message in records:
+                size += message.serialized_value_size
+                try:
+                    event = self._convert(message.value)
+                except Exception as e:
+                    self.steps.reject(message.value, message, e)
+                    continue
+                events.append(event)
+                sources.append(message)
+                partitions.append(topic_partition)
+        decoded = time.perf_counter()
+        self._stage_time["decode"].observe(decoded - started)
+        if events and not self.settings.raw_bulk:
+            events, sources, partitions = self._transform(events, sources, partitions)
+        last_offsets = {}
+        for topic_partition, message in zip(partitions, sources):
+            last_offsets[topic_partition] = message.offset + 1
+        if not events:
+            self.backpressure.release(size)
+            self._settle(count)
+        batch = Batch(events, last_offsets, ranges, size, sources, count, started_at)
+        batch.timings["decode_s"] = decoded - started
+        batch.timings["transform_s"] = time.perf_counter() - decoded
+        return batch
+
+    def _transform(self, events: list[dict], sources: list, partitions: list) -> tuple[list, list, list]:
+        """ Runs the compiled transform over the batch, failed records are dead-lettered as fetched """
+        started = time.perf_counter()
+        result = self.steps.apply_transform(events, sources, lambda position: sources[position].value)
+        self._stage_time["transform"].observe(time.perf_counter() - started)
+        if len(result.positions) < len(sources):
+            sources = [sources[position] for position in result.positions]
+            partitions = [partitions[position] for position in result.positions]
+        return result.events, sources, partitions
+
+    async def _commit(self, consumer: AIOKafkaConsumer, last_offsets: dict):
+        offsets = {
+            topic_partition: OffsetAndMetadata(offset, "")
+            for topic_partition, offset in last_offsets.items()
+        }
+        started = time.perf_counter()
+        try:
+            await consumer.commit(offsets)
+        except (CommitFailedError, IllegalStateError) as e:
+            logger.warning(f"Offsets not committed, the partitions were reassigned: {e}")
+            return
+        self._stage_time["commit"].observe(time.perf_counter() - started)
+        self._committed.update(last_offsets)
+
+    async def _acknowledge(self, consumer: AIOKafkaConsumer, offsets: dict):
+        """ Offsets of indexed records, committed right away or handed to the background scheduler """
+        if self.commits.enabled:
+            self.commits.ack(offsets)
+        else:
+            await self._commit(consumer, offsets)
+
+    def _journal(self, batch: Batch, commit_time: float):
+        """ Journals the batch with its partitions as `topic:partition` """
+        partitions = [f"{topic_partition.topic}:{topic_partition.partition}" for topic_partition in batch.ranges]
+        self.steps.journal_batch(batch, partitions, commit_time)
+
+    async def _flush_commits(self, commit):
+        """ Commits the offsets already indexed when consumption stops on a failure """
+        try:
+            await self.commits.flush(commit)
+        except Exception as e:
+            logger.error(f"Could not commit indexed offsets on stop: {e}")
+
+    async def _commit_positions(self, consumer: AIOKafkaConsumer, partitions: set | None = None):
+        """ Commits the fetch positions once nothing is in flight, so rejected records at the end of a
+        partition are not consumed again either """
+        if not self._idle.is_set():
+            return
+        offsets = {
+            topic_partition: offset
+            for topic_partition, offset in self._positions.items()
+            if (partitions is None or topic_partition in partitions) and self._committed.get(topic_partition) != offset
+        }
+        if offsets:
+            await self._commit(consumer, offsets)
+
+    async def _run_serial(self, consumer: AIOKafkaConsumer):
+        """ Fetch, index and commit one batch at a time """
+        while not self._stopping.is_set():
+            batch = self._build_batch(await self._fetch(consumer))
+            if batch.events:
+                await self._index(batch)
+                started = time.perf_counter()
+                await self._acknowledge(consumer, batch.offsets)
+                self._journal(batch, time.perf_counter() - started)
+                self._settle(batch.count)
+
+    async def _run_pipelined(self, consumer: AIOKafkaConsumer):
+        """ Fetch, transform and index stages connected by bounded queues.
+        Up to `max_in_flight` bulk requests run concurrently, offsets are committed in fetch order """
+        fetched = asyncio.Queue(maxsize=self.settings.queue_size)
+        batches = asyncio.Queue(maxsize=self.settings.queue_size)
+        tracker = OffsetTracker()
+        failure = asyncio.get_running_loop().create_future()
+        await self._run_stages(failure, [
+            self._fetch_stage(consumer, fetched),
+            self._transform_stage(fetched, batches, tracker),
+            self._index_stage(consumer, batches, tracker, failure),
+        ])
+
+    async def _run_partitioned(self, consumer: AIOKafkaConsumer):
+        """ One worker per assigned partition with its own buffer and committed offset,
+        so a slow or failing partition does not hold up the others """
+        tracker = OffsetTracker()
+        failure = asyncio.get_running_loop().create_future()
+        await self._run_stages(failure, [self._dispatch_stage(consumer, tracker, failure)])
+
+    @staticmethod
+    async def _run_stages(failure: asyncio.Future, coroutines: list):
+        """ Runs the stages until all of them drained their input after `stop`, the first failure stops them all """
+        stages = [asyncio.create_task(coroutine) for coroutine in coroutines]
+        pending = {*stages, failure}
+        try:
+            while not all(stage.done() for stage in stages):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        finally:
+            for task in stages:
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            failure.cancel()
+
+    async def _fetch_stage(self, consumer: AIOKafkaConsumer, fetched: asyncio.Queue):
+        while not self._stopping.is_set():
+            messages = await self._fetch(consumer)
+            if messages:
+                await fetched.put(messages)
+        await fetched.put(None)
+
+    async def _transform_stage(self, fetched: asyncio.Queue, batches: asyncio.Queue, tracker: OffsetTracker):
+        while True:
+            messages = await fetched.get()
+            if messages is None:
+                break
+            batch = self._build_batch(messages)
+            if batch.events:
+                self._track(tracker, batch)
+                await batches.put(batch)
+        await batches.put(None)
+
+    async def _index_stage(self, consumer: AIOKafkaConsumer, batches: asyncio.Queue, tracker: OffsetTracker,
+                           failure: asyncio.Future):
+        slots = asyncio.Semaphore(self.settings.max_in_flight)
+        commit_lock = asyncio.Lock()
+        in_flight = set()
+        try:
+            while True:
+                batch = await batches.get()
+                if batch is None:
+                    break
+                await slots.acquire()
+                self._spawn(self._index_batch(consumer, batch, tracker, commit_lock), in_flight, slots, failure)
+            if in_flight:
+                await asyncio.wait(set(in_flight))
+        finally:
+            await self._cancel(in_flight)
+
+    async def _dispatch_stage(self, consumer: AIOKafkaConsumer, tracker: OffsetTracker, failure: asyncio.Future):
+        """ Routes fetched records to per-partition workers, pausing partitions whose worker falls behind """
+        commit_lock = asyncio.Lock()
+        queues = self._queues = {}
+        paused = self._queue_paused
+        workers = set()
+        try:
+            while not self._stopping.is_set():
+                messages = await self._fetch(consumer)
+                for topic_partition, records in messages.items():
+                    queue = queues.get(topic_partition)
+                    if queue is None:
+                        queue = queues[topic_partition] = asyncio.Queue()
+                        worker = self._partition_worker(
+                            consumer, topic_partition, queue, paused, tracker, commit_lock, failure)
+                        self._spawn(worker, workers, None, failure)
+                    queue.put_nowait(records)
+                    if queue.qsize() >= self.settings.queue_size and topic_partition not in paused:
+                        paused.add(topic_partition)
+                        consumer.pause(topic_partition)
+            for queue in queues.values():
+                queue.put_nowait(None)
+            if workers:
+                await asyncio.wait(set(workers))
+        finally:
+            await self._cancel(workers)
+
+    async def _partition_worker(self, consumer: AIOKafkaConsumer, topic_partition, queue: asyncio.Queue,
+                                paused: set, tracker: OffsetTracker, commit_lock: asyncio.Lock,
+                                failure: asyncio.Future):
+        """ Buffers records of one partition up to the batcher's size or `timeout_ms` and indexes them.
+        The buffer is flushed early while partitions are revoked and on stop, marked by a None record list """
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.settings.partition_in_flight)
+        in_flight = set()
+        buffer = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                try:
+                    records = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    records = []
+                last = records is None
+                if last:
+                    records = []
+                if topic_partition in paused and queue.qsize() < self.settings.queue_size:
+                    paused.discard(topic_partition)
+                    if not self._paused and topic_partition not in self._finished:
+                        consumer.resume(topic_partition)
+                if records and deadline is None:
+                    deadline = loop.time() + self.settings.timeout_ms / 1000
+                buffer.extend(records)
+                if buffer and (len(buffer) >= self.batcher.max_records or loop.time() >= deadline
+                               or self._flushing or last):
+                    batch = self._build_batch({topic_partition: buffer})
+                    buffer, deadline = [], None
+                    if batch.events:
+                        self._track(tracker, batch)
+                        await slots.acquire()
+                        self._spawn(self._index_batch(consumer, batch, tracker, commit_lock), in_flight, slots, failure)
+                if last:
+                    break
+            if in_flight:
+                await asyncio.wait(set(in_flight))
+        finally:
+            await self._cancel(in_flight)
+
+    async def _index_batch(self, consumer: AIOKafkaConsumer, batch: Batch, tracker: OffsetTracker,
+                           commit_lock: asyncio.Lock):
+        await self._index(batch)
+        for topic_partition, (first, _) in batch.ranges.items():
+            tracker.ack(topic_partition, first)
+        commit_time = 0.0
+        async with commit_lock:
+            # Only contiguous acknowledged ranges are committed, a slower earlier batch holds back later ones
+            offsets = tracker.committable()
+            if offsets:
+                started = time.perf_counter()
+                await self._acknowledge(consumer, offsets)
+                commit_time = time.perf_counter() - started
+                tracker.mark_committed(offsets)
+        self._journal(batch, commit_time)
+        self._settle(batch.count)
+
+    async def _index(self, batch: Batch):
+        """ Indexes a batch, holding it while the Elasticsearch circuit is open,
+        and feeds its size and latency back into the batcher and the backpressure """
+        started = time.perf_counter()
+        held = HeldBatch(self.es_client, batch.events, batch.sources)
+        try:
+            while True:
+                try:
+                    result = held.settle(await process_events(self.es_client, held.events, sources=held.sources))
+                    break
+                except CircuitOpenError as e:
+                    # Not committed, what the cluster did not settle is sent again once it is back
+                    if not await self._hold_batch(held, e):
+                        result = held.result
+                        break
+                    started = time.perf_counter()
+        finally:
+            self.backpressure.release(batch.size)
+        throttled = result.throttled if result else 0
+        latency = time.perf_counter() - started
+        batch.result = result
+        batch.timings["index_s"] = latency
+        self._batch_time.observe(latency)
+        self._batch_records.observe(len(batch.events))
+        self._batch_bytes.observe(batch.size)
+        self.batcher.observe(len(batch.events), batch.size, latency, throttled)
+        self.backpressure.observe(len(batch.events), latency, throttled)
+
+    @staticmethod
+    def _track(tracker: OffsetTracker, batch: Batch):
+        for topic_partition, (first, next_offset) in batch.ranges.items():
+            tracker.track(topic_partition, first, next_offset)
+
+    @staticmethod
+    def _spawn(coroutine, tasks: set, slots: asyncio.Semaphore | None, failure: asyncio.Future):
+        """ Runs a coroutine in the background, releasing its slot and reporting its failure when done """
+
+        def on_done(task: asyncio.Task):
+            tasks.discard(task)
+            if slots is not None:
+                slots.release()
+            if not task.cancelled() and task.exception() and not failure.done():
+                failure.set_exception(task.exception())
+
+        task = asyncio.create_task(coroutine)
+        tasks.add(task)
+        task.add_done_callback(on_done)
+
+    @staticmethod
+    async def _cancel(tasks: set):
+        for task in list(tasks):
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
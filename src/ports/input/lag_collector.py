@@ -0,0 +1,60 @@
+import asyncio
+
+from aiokafka import AIOKafkaConsumer, TopicPartition
+
+from config import KafkaSettings
+from logger import get_logger
+from metrics import consumer_lag, consumer_partition_lag
+
+logger = get_logger(__name__)
+
+
+class LagCollector:
+    """ Periodically compares the committed offsets of the assigned partitions with their end offsets.
+
+    Every consumer only reports the partitions assigned to it, so summing `consumer_lag` over all
+    pods and workers gives the lag of the whole group. Partitions taken away by a rebalance are
+    reported as 0 until their new owner reports them. A partition without a committed offset
+    lags from its beginning offset """
+
+    def __init__(self, settings: KafkaSettings):
+        self.interval = settings.lag_interval_s
+        self.lags: dict[TopicPartition, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    async def run(self, consumer: AIOKafkaConsumer):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.collect(consumer)
+            except Exception as e:
+                # Lag reporting never stops consumption, the next round tries again
+                logger.warning(f"Could not collect consumer lag: {e}")
+
+    async def collect(self, consumer: AIOKafkaConsumer) -> dict[TopicPartition, int]:
+        partitions = list(consumer.assignment())
+        lags = {}
+        if partitions:
+            end_offsets = await consumer.end_offsets(partitions)
+            committed = await asyncio.gather(*(consumer.committed(partition) for partition in partitions))
+            uncommitted = [partition for partition, offset in zip(partitions, committed) if offset is None]
+            beginning = await consumer.beginning_offsets(uncommitted) if uncommitted else {}
+            for partition, offset in zip(partitions, committed):
+                start = beginning[partition] if offset is None else offset
+                lags[partition] = max(end_offsets[partition] - start, 0)
+        self._export(lags)
+        self.lags = lags
+        return lags
+
+    def _export(self, lags: dict[TopicPartition, int]):
+        for partition in self.lags.keys() - lags.keys():
+            consumer_partition_lag.labels(topic=partition.topic, partition=str(partition.partition)).set(0)
+        totals = dict.fromkeys({partition.topic for partition in self.lags}, 0)
+        for partition, lag in lags.items():
+            consumer_partition_lag.labels(topic=partition.topic, partition=str(partition.partition)).set(lag)
+            totals[partition.topic] = totals.get(partition.topic, 0) + lag
+        for topic, total in totals.items():
+            consumer_lag.labels(topic=topic).set(total)
@@ -0,0 +1,92 @@
+import time
+
+from aiokafka import AIOKafkaConsumer, TopicPartition
+
+from logger import get_logger
+from metrics import replay_remaining_records
+
+logger = get_logger(__name__)
+
+
+class ReplayRange:
+    """ Part of a topic to consume again, bounded by offsets or by timestamps in milliseconds.
+
+    Each bound applies to every selected partition: a start time resolves to the first offset written at or
+    after it, an end time to the first offset written at or after it as well, so the range is [start, end).
+    Unset bounds default to the beginning and to the end offsets at the time the range is resolved,
+    records produced during the replay are left to the live consumer """
+
+    def __init__(self, topic: str, partitions: list[int] | None = None,
+                 start_offset: int | None = None, end_offset: int | None = None,
+                 start_time_ms: int | None = None, end_time_ms: int | None = None, progress_interval_s: float = 10):
+        if start_offset is not None and start_time_ms is not None:
+            raise ValueError("A replay starts either at an offset or at a time")
+        if end_offset is not None and end_time_ms is not None:
+            raise ValueError("A replay ends either at an offset or at a time")
+        self.topic = topic
+        self.partitions = partitions
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.start_time_ms = start_time_ms
+        self.end_time_ms = end_time_ms
+        self.progress_interval = progress_interval_s
+
+    async def resolve(self, consumer: AIOKafkaConsumer) -> dict[TopicPartition, tuple[int, int]]:
+        """ First and end offset of every partition with records in the range """
+        available = consumer.partitions_for_topic(self.topic)
+        if not available:
+            raise ValueError(f"Topic {self.topic} not found")
+        if self.partitions is not None:
+            missing = set(self.partitions) - available
+            if missing:
+                raise ValueError(f"Topic {self.topic} has no partitions {sorted(missing)}")
+            available = set(self.partitions)
+        topic_partitions = [TopicPartition(self.topic, partition) for partition in sorted(available)]
+        beginning = await consumer.beginning_offsets(topic_partitions)
+        end = await consumer.end_offsets(topic_partitions)
+        starts = await self._bound(consumer, topic_partitions, self.start_offset, self.start_time_ms, beginning, end)
+        ends = await self._bound(consumer, topic_partitions, self.end_offset, self.end_time_ms, end, end)
+        return {
+            topic_partition: (max(starts[topic_partition], beginning[topic_partition]), ends[topic_partition])
+            for topic_partition in topic_partitions
+            if max(starts[topic_partition], beginning[topic_partition]) < ends[topic_partition]
+        }
+
+    @staticmethod
+    async def _bound(consumer: AIOKafkaConsumer, topic_partitions: list, offset: int | None, time_ms: int | None,
+                     default: dict, end: dict) -> dict[TopicPartition, int]:
+        if time_ms is not None:
+            found = await consumer.offsets_for_times({topic_partition: time_ms for topic_partition in topic_partitions})
+            # No record at or after the time: the bound is the end of the partition
+            return {
+                topic_partition: found[topic_partition].offset if found.get(topic_partition) else end[topic_partition]
+                for topic_partition in topic_partitions
+            }
+        if offset is not None:
+            return {topic_partition: min(offset, end[topic_partition]) for topic_partition in topic_partitions}
+        return dict(default)
+
+
+class ReplayProgress:
+    """ Records of a replay indexed and committed so far, the rate since the start and the remaining time """
+
+    def __init__(self, ranges: dict[TopicPartition, tuple[int, int]]):
+        self.ranges = ranges
+        self.total = sum(end - start for start, end in ranges.values())
+        self.started = time.monotonic()
+
+    def done(self, committed: dict[TopicPartition, int]) -> int:
+        return sum(
+            min(max(committed.get(topic_partition, start), start), end) - start
+            for topic_partition, (start, end) in self.ranges.items()
+        )
+
+    def report(self, committed: dict[TopicPartition, int]) -> str:
+        done = self.done(committed)
+        remaining = self.total - done
+        replay_remaining_records.set(remaining)
+        elapsed = time.monotonic() - self.started
+        rate = done / elapsed if elapsed > 0 else 0
+        percent = done / self.total * 100 if self.total else 100
+        eta = f"{remaining / rate:.0f}s" if rate else "unknown"
+        return f"Replayed {done}/{self.total} records ({percent:.1f}%), {rate:.0f} records/s, ETA {eta}"
@@ -0,0 +1,88 @@
+from elasticsearch.serializer import JsonSerializer, NdjsonSerializer
+
+from codec import JsonCodec
+
+_WHITESPACE = b" \t\r\n"
+_TIMESTAMP_KEY = b'"timestamp"'
+
+
+class _CodecMixin:
+
+    def __init__(self, codec: JsonCodec | None = None):
+        self.codec = codec or JsonCodec()
+
+    def json_dumps(self, data) -> bytes:
+        return self.codec.dumps(data, default=self.default)
+
+    def json_loads(self, data: bytes):
+        return self.codec.loads(data)
+
+
+class CodecSerializer(_CodecMixin, JsonSerializer):
+    """ JSON serializer backed by the configured codec """
+
+
+class BulkBodySerializer(_CodecMixin, NdjsonSerializer):
+    """ NDJSON serializer backed by the configured codec that forwards prebuilt bulk bodies without copying them """
+
+    def dumps(self, data) -> bytes:
+        if isinstance(data, (bytearray, memoryview)):
+            return data
+        return super().dumps(data)
+
+
+def is_json_object(value: bytes) -> bool:
+    """ Cheap shape check of a raw message, the full validation is left to Elasticsearch """
+    if value[:1] == b"{" and value[-1:] == b"}":
+        return True
+    value = value.strip(_WHITESPACE) if value else b""
+    return value[:1] == b"{" and value[-1:] == b"}"
+
+
+def stamp_source(source: bytes, timestamp: int, codec: JsonCodec) -> tuple[bytes | memoryview, bytes]:
+    """ Splits a raw JSON object into a head and a tail that sets `timestamp` on it.
+    The object is only parsed when it already carries a timestamp key or spans several lines """
+    if _TIMESTAMP_KEY in source or b"\n" in source:
+        try:
+            event = codec.loads(source)
+        except ValueError:
+            # Left for Elasticsearch to reject as a single failed item
+            source = source.replace(b"\n", b" ")
+        else:
+            event["timestamp"] = timestamp
+            return codec.dumps(event), b"\n"
+
+    end = source.rfind(b"}")
+    head = memoryview(source)[:end]
+    last = source[end - 1]
+    if last in _WHITESPACE:
+        empty = source[:end].rstrip(_WHITESPACE).endswith(b"{")
+    else:
+        empty = last == ord("{")
+    tail = b'"timestamp":%d}\n' % timestamp
+    return head, tail if empty else b"," + tail
+
+
+def build_bulk_body(actions: list[bytes], sources: list[dict] | list[bytes], timestamp: int,
+                    codec: JsonCodec | None = None) -> bytearray:
+    """ Builds the NDJSON body of a bulk request into a single preallocated buffer.
+    Events are encoded with the codec, raw JSON sources are copied as they are with `timestamp` spliced in """
+    codec = codec or JsonCodec()
+    parts = []
+    size = 0
+    for action, source in zip(actions, sources):
+        if isinstance(source, dict):
+            head, tail = codec.dumps(source), b"\n"
+        else:
+            head, tail = stamp_source(source, timestamp, codec)
+        parts.append((action, head, tail))
+        size += len(action) + len(head) + len(tail)
+
+    body = bytearray(size)
+    position = 0
+    for action, head, tail in parts:
+        for chunk in (action, head, tail):
+            end = position + len(chunk)
+            body[position:end] = chunk
+            position = end
+    return body
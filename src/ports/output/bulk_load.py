@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+from elasticsearch import AsyncElasticsearch
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Every document is written once and no replica copies it while the indices are loaded
+BULK_SETTINGS = {"index.refresh_interval": "-1", "index.number_of_replicas": "0"}
+
+
+class BulkLoadSettings:
+    """ Async context manager switching the existing indices matching `pattern` to bulk-friendly settings
+    and restoring their previous values on exit, then refreshing them.
+
+    The previous values are logged before anything is changed, so they can be restored by hand should the
+    process be killed in between. Indices created while loading get the settings of their template """
+
+    def __init__(self, client: AsyncElasticsearch, pattern: str):
+        self.client = client
+        self.pattern = pattern
+        self.previous: dict[str, dict] = {}
+
+    async def __aenter__(self) -> "BulkLoadSettings":
+        response = await self.client.indices.get_settings(
+            index=self.pattern, name=list(BULK_SETTINGS), flat_settings=True,
+            allow_no_indices=True, ignore_unavailable=True, expand_wildcards="open")
+        # Settings absent from the response were never set, restoring them to null resets the default
+        self.previous = {
+            index: {name: body.get("settings", {}).get(name) for name in BULK_SETTINGS}
+            for index, body in response.items()
+        }
+        if not self.previous:
+            logger.warning(f"No index matches {self.pattern}, bulk load settings not applied")
+            return self
+        logger.info(f"Applying bulk load settings to {len(self.previous)} indices, "
+                    f"previous settings: {json.dumps(self.previous)}")
+        await self.client.indices.put_settings(index=",".join(self.previous), settings=BULK_SETTINGS)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if not self.previous:
+            return
+        groups: dict[str, list[str]] = {}
+        for index, settings in self.previous.items():
+            groups.setdefault(json.dumps(settings, sort_keys=True), []).append(index)
+        results = await asyncio.gather(*(
+            self.client.indices.put_settings(index=",".join(indices), settings=json.loads(settings))
+            for settings, indices in groups.items()
+        ), return_exceptions=True)
+        for (settings, indices), result in zip(groups.items(), results):
+            if isinstance(result, Exception):
+                logger.error(f"Could not restore {settings} on {','.join(indices)}: {result}")
+        try:
+            await self.client.indices.refresh(index=",".join(self.previous))
+        except Exception as e:
+            logger.warning(f"Could not refresh the loaded indices: {e}")
+        logger.info(f"Settings of {len(self.previous)} indices restored")
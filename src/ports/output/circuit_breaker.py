@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from logger import get_logger
+from metrics import circuit_breaker_state
+
+logger = get_logger(__name__)
+
+
+class CircuitOpenError(ConnectionError):
+    """ Raised instead of sending a request while the circuit is open, and by a bulk that exhausted its
+    retries on an unavailable cluster before enough failures opened it. `pending` holds the positions of
+    the documents the cluster did not settle, `result` the outcome of the others """
+
+    def __init__(self, message: str, pending: list[int] | None = None, result=None):
+        super().__init__(message)
+        self.pending = pending
+        self.result = result
+
+
+class CircuitBreaker:
+    """ Closed/open/half-open circuit breaker.
+
+    `failure_threshold` consecutive failed requests open the circuit. After `reset_timeout_s`
+    a single probe request is let through (half-open): its success closes the circuit,
+    its failure opens it for another timeout. A threshold of 0 disables the breaker """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_threshold: int, reset_timeout_s: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout_s
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._changed = asyncio.Event()
+        circuit_breaker_state.set(self.STATE_VALUES[self.state])
+
+    @property
+    def closed(self) -> bool:
+        return self.state == self.CLOSED
+
+    def allow(self) -> bool:
+        """ Whether a request may be sent now. Moves an expired open circuit to half-open,
+        the caller's request is then the probe """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.retry_in() == 0:
+            self._set_state(self.HALF_OPEN)
+            return True
+        return False
+
+    def retry_in(self) -> float:
+        """ Seconds until the open circuit lets a probe through """
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    async def wait(self, limit: float | None = None) -> None:
+        """ Waits until the open circuit lets a probe through, or until the probe sent by another request
+        settles the half-open circuit, at most `limit` seconds """
+        if self.state == self.CLOSED:
+            return
+        timeout = self.retry_in() if self.state == self.OPEN else self.reset_timeout or None
+        if limit is not None:
+            timeout = limit if timeout is None else min(timeout, limit)
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.state != self.CLOSED:
+            logger.info("Elasticsearch is available again, circuit closed")
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        if not self.failure_threshold:
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            logger.error(f"Elasticsearch is unavailable after {self.failures} failed requests, "
+                         f"circuit open for {self.reset_timeout}s")
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        circuit_breaker_state.set(self.STATE_VALUES[state])
+        # Wakes up the waiters and arms a new event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
@@ -0,0 +1,274 @@
+import asyncio
+import os
+import time
+
+from aiokafka import AIOKafkaProducer
+
+from backoff import full_jitter
+from codec import JsonCodec, get_codec
+from config import DeadLetterSettings
+from logger import get_logger
+from metrics import dead_letters_total, dead_letters_dropped_total
+
+logger = get_logger(__name__)
+
+
+class DeadLetter:
+    """ A message or document that could not be indexed, with the place it came from """
+
+    __slots__ = ("value", "topic", "partition", "offset", "reason", "error", "failed_at")
+
+    def __init__(self, value, reason: str, error: str = "", source=None):
+        self.value = value
+        self.topic = getattr(source, "topic", None)
+        self.partition = getattr(source, "partition", None)
+        self.offset = getattr(source, "offset", None)
+        self.reason = reason
+        self.error = error
+        self.failed_at = time.time()
+
+    def metadata(self) -> dict:
+        return {
+            "topic": self.topic,
+            "partition": self.partition,
+            "offset": self.offset,
+            "reason": self.reason,
+            "error": self.error,
+            "failed_at": self.failed_at,
+        }
+
+    def value_bytes(self, codec: JsonCodec) -> bytes:
+        if isinstance(self.value, (bytes, bytearray)):
+            return bytes(self.value)
+        return codec.dumps(self.value, default=str)
+
+
+class LogDeadLetterSink:
+    """ Logs every dead letter, used when no dead-letter destination is configured """
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def write(self, records: list[DeadLetter]):
+        for record in records:
+            logger.error(f"Failed document ({record.reason}): {record.value}")
+
+
+class KafkaDeadLetterSink:
+    """ Produces dead letters to a Kafka topic. The original value is kept as is, the error
+    metadata travels in the message headers. While the brokers are unreachable the producer is
+    started again in the background, dead letters written meanwhile are logged and counted as dropped """
+
+    def __init__(self, settings: DeadLetterSettings, bootstrap_servers: str, codec: JsonCodec):
+        self.settings = settings
+        self.codec = codec
+        self.bootstrap_servers = bootstrap_servers
+        self.producer = self._create_producer()
+        self.fallback = LogDeadLetterSink()
+        self._started = False
+        self._connecting: asyncio.Task | None = None
+
+    def _create_producer(self) -> AIOKafkaProducer:
+        return AIOKafkaProducer(bootstrap_servers=self.bootstrap_servers, linger_ms=50)
+
+    async def start(self):
+        """ Never raises, an unreachable broker does not keep the loader from starting """
+        if not await self._start_producer():
+            self._connecting = asyncio.create_task(self._reconnect())
+
+    async def _start_producer(self) -> bool:
+        try:
+            await self.producer.start()
+        except Exception as e:
+            logger.warning(f"Dead-letter producer not started, logging dead letters meanwhile: {e}")
+            await self._close()
+            self.producer = self._create_producer()
+            return False
+        self._started = True
+        return True
+
+    async def _reconnect(self):
+        attempt = 0
+        while not self._started:
+            attempt += 1
+            await asyncio.sleep(full_jitter(
+                attempt, self.settings.connect_backoff_ms / 1000, self.settings.connect_backoff_max_ms / 1000))
+            if await self._start_producer():
+                logger.info("Dead-letter producer started")
+
+    async def _close(self):
+        try:
+            await self.producer.stop()
+        except Exception as e:
+            logger.warning(f"Dead-letter producer not stopped cleanly: {e}")
+
+    async def stop(self):
+        if self._connecting:
+            self._connecting.cancel()
+            await asyncio.gather(self._connecting, return_exceptions=True)
+            self._connecting = None
+        if self._started:
+            self._started = False
+            await self._close()
+
+    async def write(self, records: list[DeadLetter]):
+        if not self._started:
+            dead_letters_dropped_total.inc(len(records))
+            await self.fallback.write(records)
+            return
+        deliveries = []
+        for record in records:
+            headers = [
+                (f"dlq.{key}", str(value).encode())
+                for key, value in record.metadata().items() if value is not None
+            ]
+            deliveries.append(await self.producer.send(
+                self.settings.topic, value=record.value_bytes(self.codec), headers=headers))
+        await asyncio.gather(*deliveries)
+
+
+class FileDeadLetterSink:
+    """ Appends dead letters as NDJSON to a local file rotated by size """
+
+    def __init__(self, settings: DeadLetterSettings, codec: JsonCodec):
+        self.settings = settings
+        self.codec = codec
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def write(self, records: list[DeadLetter]):
+        lines = bytearray()
+        for record in records:
+            line = record.metadata()
+            value = record.value
+            if isinstance(value, (bytes, bytearray)):
+                value = bytes(value).decode("utf-8", errors="replace")
+            line["value"] = value
+            lines += self.codec.dumps(line, default=str) + b"\n"
+        await asyncio.to_thread(self._append, bytes(lines))
+
+    def _append(self, data: bytes):
+        path = self.settings.path
+        if os.path.exists(path) and os.path.getsize(path) + len(data) > self.settings.max_bytes:
+            self._rotate(path)
+        with open(path, "ab") as file:
+            file.write(data)
+
+    def _rotate(self, path: str):
+        for index in range(self.settings.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}"):
+                os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+        if self.settings.backup_count:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+
+class DeadLetterService:
+    """ Dead-letter output port. Records are buffered in a bounded queue and written in
+    batches by a background task, so a slow or unavailable sink never blocks indexing:
+    when the buffer is full new records are dropped and counted """
+
+    def __init__(self, settings: DeadLetterSettings, bootstrap_servers: str = ""):
+        self.settings = settings
+        self.codec = get_codec(settings.codec)
+        self.sink = self._create_sink(bootstrap_servers)
+        self._queue: asyncio.Queue[DeadLetter] = asyncio.Queue(maxsize=settings.buffer_size)
+        self._task: asyncio.Task | None = None
+        # Records taken from the buffer by the flusher and its write in progress, both finished by `stop`
+        self._pending: list[DeadLetter] = []
+        self._writing: asyncio.Future | None = None
+        # Records handed to the sink and not written yet, dropped when the final flush times out
+        self._flushing = 0
+        logger.info(f"Dead-letter sink initialized: {self.settings.sink}.")
+
+    def _create_sink(self, bootstrap_servers: str):
+        if self.settings.sink == "kafka":
+            return KafkaDeadLetterSink(self.settings, self.settings.bootstrap_servers or bootstrap_servers, self.codec)
+        if self.settings.sink == "file":
+            return FileDeadLetterSink(self.settings, self.codec)
+        return LogDeadLetterSink()
+
+    async def start(self):
+        await self.sink.start()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """ Waits for the write in progress, flushes the records collected by the flusher and the buffer,
+        and closes the sink. Each step is bounded by `stop_timeout_s`, records not written by then are
+        counted as dropped """
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        timeout = self.settings.stop_timeout_s
+        try:
+            await asyncio.wait_for(self._finish(), timeout)
+        except asyncio.TimeoutError:
+            lost = self._flushing + len(self._pending) + self._queue.qsize()
+            dead_letters_dropped_total.inc(lost)
+            logger.error(f"Dead letters not written within {timeout}s on stop, {lost} dropped")
+        try:
+            await asyncio.wait_for(self.sink.stop(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dead-letter sink not closed within {timeout}s")
+
+    async def _finish(self):
+        if self._writing:
+            await self._writing
+            self._writing = None
+        records, self._pending = self._pending, []
+        await self._flush(records)
+        while not self._queue.empty():
+            await self._flush(self._drain())
+
+    def publish(self, record: DeadLetter) -> None:
+        dead_letters_total.labels(reason=record.reason).inc()
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            dead_letters_dropped_total.inc()
+
+    def _drain(self) -> list[DeadLetter]:
+        records = []
+        while not self._queue.empty() and len(records) < self.settings.batch_size:
+            records.append(self._queue.get_nowait())
+        return records
+
+    async def _run(self):
+        interval = self.settings.flush_interval_ms / 1000
+        while True:
+            self._pending.append(await self._queue.get())
+            deadline = asyncio.get_running_loop().time() + interval
+            while len(self._pending) < self.settings.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            records, self._pending = self._pending, []
+            # Shielded, a cancelled flusher leaves the write to complete and `stop` waits for it
+            self._writing = asyncio.ensure_future(self._flush(records))
+            await asyncio.shield(self._writing)
+            self._writing = None
+
+    async def _flush(self, records: list[DeadLetter]):
+        if not records:
+            return
+        self._flushing += len(records)
+        try:
+            await self.sink.write(records)
+        except Exception as e:
+            dead_letters_dropped_total.inc(len(records))
+            logger.error(f"Could not write {len(records)} dead letters: {e}")
+        # Left counted when cancelled, so a timed-out stop reports the batch as dropped
+        self._flushing -= len(records)
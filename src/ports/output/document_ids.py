@@ -0,0 +1,48 @@
+import hashlib
+import json
+
+from codec import JsonCodec
+from config import ElasticSettings
+
+
+class DocumentIds:
+    """ Deterministic `_id` of a document, so a redelivered message overwrites or collides
+    with its first copy instead of creating a duplicate.
+
+    offset - `<topic>-<partition>-<offset>` of the Kafka record
+    hash   - digest of the configured event fields, encoded canonically whatever the codec
+    field  - value of the configured event field as is
+    """
+
+    def __init__(self, settings: ElasticSettings, codec: JsonCodec):
+        self.strategy = settings.id_strategy
+        self.fields = [field.strip() for field in settings.id_fields.split(",") if field.strip()]
+        self.codec = codec
+        if self.strategy in ("hash", "field") and not self.fields:
+            raise ValueError(f"ELASTIC_ID_FIELDS is required for the {self.strategy} id strategy")
+        if settings.data_stream and settings.op_type == "index":
+            raise ValueError("Data streams only accept the create op type")
+        if settings.op_type == "auto":
+            replay_safe = self.strategy in ("offset", "hash")
+            self.op_type = "create" if replay_safe or settings.data_stream else "index"
+        else:
+            self.op_type = settings.op_type
+
+    @property
+    def enabled(self) -> bool:
+        return self.strategy != "none"
+
+    def document_id(self, event: dict | bytes, source=None) -> str | None:
+        if self.strategy == "offset":
+            if source is None:
+                return None
+            return f"{source.topic}-{source.partition}-{source.offset}"
+        if not isinstance(event, dict):
+            event = self.codec.loads(event)
+        if self.strategy == "field":
+            value = event.get(self.fields[0])
+            return None if value is None else str(value)
+        # Not the configured codec, its number formatting, key order and escaping would change every id
+        values = json.dumps([event.get(field) for field in self.fields], sort_keys=True, separators=(",", ":"),
+                            ensure_ascii=False, default=str)
+        return hashlib.blake2b(values.encode(), digest_size=16).hexdigest()
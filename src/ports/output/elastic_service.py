@@ -1,81 +1,290 @@
 import asyncio
-from time import time
+from time import monotonic, perf_counter, time
 from http import HTTPStatus
 
-from elasticsearch import AsyncElasticsearch, helpers
+from elastic_transport.client_utils import DEFAULT
+from elasticsearch import ApiError, AsyncElasticsearch, TransportError
 
+from backoff import full_jitter
+from codec import get_codec
 from config import ElasticSettings
 from logger import get_logger
-from metrics import response_time_metric, messages_processed, errors_total, batch_processing_time_metric
+from metrics import bulk_time_metric, errors_total, bulk_item_errors_total, bulk_duplicates_total
+from ports.output.bulk_body import BulkBodySerializer, CodecSerializer, build_bulk_body
+from ports.output.bulk_load import BulkLoadSettings
+from ports.output.circuit_breaker import CircuitBreaker, CircuitOpenError
+from ports.output.dead_letter import DeadLetter, DeadLetterService
+from ports.output.document_ids import DocumentIds
+from ports.output.index_router import IndexRouter
+from ports.output.instrumented_node import InstrumentedNode
 
 logger = get_logger(__name__)
 
+# Lean bulk responses: only the error flag and per-item status/error are sent back
+BULK_FILTER_PATH = "errors,items.*.status,items.*.error"
+
+# Rejections and server-side failures are transient, anything else (mapping, parsing) is final
+RETRYABLE_STATUSES = frozenset({
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+})
+
+
+class BulkResult:
+    """ Outcome of a single bulk_insert call """
+
+    def __init__(self):
+        self.indexed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.throttled = 0
+        self.retried = 0
+        self.attempts = 0
+
+    def merge(self, other: "BulkResult"):
+        """ Adds the outcome of another call made for the same batch """
+        self.indexed += other.indexed
+        self.failed += other.failed
+        self.duplicates += other.duplicates
+        self.throttled += other.throttled
+        self.retried += other.retried
+        self.attempts += other.attempts
+
 
 class ElasticsearchClientService:
 
-    def __init__(self, settings: ElasticSettings):
+    def __init__(self, settings: ElasticSettings, dead_letters: DeadLetterService | None = None, in_flight: int = 1):
         self.settings = settings
-        self.client = AsyncElasticsearch(hosts=self.settings.url)
+        self.dead_letters = dead_letters
+        self.codec = get_codec(self.settings.codec)
+        self.hosts = [host.strip() for host in self.settings.url.split(",") if host.strip()]
+        # One connection per concurrent bulk plus one for pings and sniffing
+        connections_per_node = self.connections_per_node = self.settings.connections_per_node or in_flight + 1
+        self.client = AsyncElasticsearch(
+            hosts=self.hosts,
+            node_class=InstrumentedNode,
+            connections_per_node=connections_per_node,
+            # Every retry is made by `bulk_insert` with backoff, the transport sends each request once
+            max_retries=0,
+            retry_on_status=(),
+            http_compress=self.settings.http_compress,
+            sniff_on_start=self.settings.sniff_on_start,
+            sniff_on_node_failure=self.settings.sniff_on_node_failure,
+            sniff_before_requests=self.settings.sniff_interval_s > 0,
+            min_delay_between_sniffing=self.settings.sniff_interval_s or DEFAULT,
+            serializers={
+                CodecSerializer.mimetype: CodecSerializer(self.codec),
+                BulkBodySerializer.mimetype: BulkBodySerializer(self.codec),
+            }
+        )
         self.index = self.settings.index
+        self._bulk_time = bulk_time_metric.labels(index=self.index)
         self.retry = self.settings.retry
-        logger.info("Elasticsearch client initialized.")
+        self.backoff = self.settings.retry_backoff_ms / 1000
+        self.backoff_max = self.settings.retry_backoff_max_ms / 1000
+        self.ids = DocumentIds(self.settings, self.codec)
+        self.router = IndexRouter(self.settings, self.codec, self.ids.op_type)
+        self.breaker = CircuitBreaker(self.settings.breaker_failure_threshold, self.settings.breaker_reset_timeout_s)
+        self._probe_lock = asyncio.Lock()
+        self.connected = False
+        logger.info(f"Elasticsearch client initialized for {len(self.hosts)} node(s) with {self.codec.name} codec.")
 
     async def connect(self):
-        """ Connection to Elasticsearch. Repeats 10 times every 3 seconds in case of failure """
-        for _ in range(10):
-            if await self.client.ping():
+        """ Connection to Elasticsearch. Pings `connect_attempts` times with exponential backoff
+        until the cluster answers, then installs the index template """
+        attempts = self.settings.connect_attempts
+        for attempt in range(1, attempts + 1):
+            try:
+                alive = await self.client.ping()
+            except Exception as e:
+                logger.debug(f"Elasticsearch ping failed: {e}")
+                alive = False
+            if alive:
                 logger.info("Elasticsearch is available!")
+                await self.router.bootstrap(self.client)
+                self.connected = True
                 return
-            logger.info("Waiting for Elasticsearch...")
-            await asyncio.sleep(3)
+            if attempt < attempts:
+                delay = full_jitter(
+                    attempt, self.settings.connect_backoff_ms / 1000, self.settings.connect_backoff_max_ms / 1000)
+                logger.info(f"Waiting for Elasticsearch, attempt {attempt}/{attempts}, retrying in {delay:.2f}s...")
+                await asyncio.sleep(delay)
         raise ConnectionError("Could not connect to Elasticsearch")
 
-    @response_time_metric.time()
-    async def bulk_insert(self, events: list):
-        """ Adds a stack of documents to Elasticsearch via Bulk API with retraces """
-        if not events:
-            return
+    def check_pool(self, in_flight: int):
+        """ Warns when more bulks can run at once than the pool has connections, the wait for a free one
+        would be measured as bulk latency and slow down the batcher and the backpressure """
+        if in_flight + 1 > self.connections_per_node:
+            logger.warning(f"Up to {in_flight} concurrent bulk requests for {self.connections_per_node} connections "
+                           f"per node, set ELASTIC_CONNECTIONS_PER_NODE to at least {in_flight + 1}")
 
-        start_time = time()
+    def bulk_load(self) -> BulkLoadSettings:
+        """ Bulk-friendly settings for the existing indices the configured index resolves to """
+        return BulkLoadSettings(self.client, self.router.index.pattern())
 
-        attempts = 0
-        try:
-            while attempts < self.retry and events:
-                operations = [
-                    {"_index": self.index, "_source": event}
-                    for event in events
-                ]
+    @property
+    def available(self) -> bool:
+        """ False while the circuit breaker keeps requests away from the cluster """
+        return self.breaker.closed
 
+    async def wait_until_available(self, timeout: float | None = None) -> bool:
+        """ Waits out an open circuit, probing the cluster with a ping whenever the breaker allows it.
+        False when the circuit is still open after `timeout` seconds """
+        deadline = None if timeout is None else monotonic() + timeout
+        async with self._probe_lock:
+            while not self.breaker.closed:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                await self.breaker.wait(remaining)
+                if self.breaker.closed or not self.breaker.allow():
+                    continue
                 try:
-                    success, failed_items = await helpers.async_bulk(self.client, operations, raise_on_error=False)
-                    failed_docs = []
-
-                    for i, item in enumerate(failed_items):
-                        if "index" in item and item["index"].get("status") not in (HTTPStatus.OK, HTTPStatus.CREATED):
-                            failed_docs.append(events[i])
-                        else:
-                            messages_processed.inc()
-
-                    if not failed_docs:
-                        logger.info(f"Successfully inserted {len(events)} documents.")
-                        return
-                    else:
-                        logger.warning(f"{len(failed_docs)} documents failed. Retrying...")
-                        events = failed_docs  # Keep only the failed documents
-                        attempts += 1
-                        batch_processing_time_metric.inc()
-                        await asyncio.sleep(2)
-
-                except Exception as e:
-                    logger.error(f"Bulk insert failed on attempt {attempts + 1}: {e}")
-                    await asyncio.sleep(2)
-
-            if events:
-                logger.error(f"Could not insert {len(events)} documents after {self.retry} attempts.")
-                for doc in events:
-                    errors_total.inc()
-                    logger.error(f"Failed document: {doc}")
+                    alive = await self.client.ping()
+                except Exception:
+                    alive = False
+                if alive:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+        return True
+
+    async def bulk_insert(self, events: list[dict] | list[bytes], sources: list | None = None) -> BulkResult:
+        """ Adds a stack of documents to Elasticsearch via Bulk API with retraces.
+        Every item is classified on its own: throttled and server errors are resent with
+        exponential backoff, other errors fail the document at once.
+        Failed documents go to the dead-letter port together with their `sources` records.
+        Raises CircuitOpenError while the circuit is open, and when the retries ran out on an unavailable
+        cluster, so the batch is held instead of dropped. The error carries the positions of the documents
+        still to send, the others are indexed or failed already """
+        result = BulkResult()
+        if not events:
+            return result
 
+        start_time = perf_counter()
+        timestamp = int(time())
+        pending = list(range(len(events)))
+        actions = self._actions(events, sources, timestamp)
+        try:
+            while pending and result.attempts < self.retry:
+                if result.attempts:
+                    await asyncio.sleep(full_jitter(result.attempts, self.backoff, self.backoff_max))
+                if not self.breaker.allow():
+                    raise CircuitOpenError("Elasticsearch circuit is open", pending, result)
+                result.attempts += 1
+                pending = await self._send(events, sources, actions, pending, timestamp, result)
+                if pending:
+                    result.retried += len(pending)
+                    logger.warning(f"{len(pending)} documents failed. Retrying...")
+
+            if pending and not self.breaker.closed:
+                raise CircuitOpenError("Elasticsearch circuit is open", pending, result)
+            if pending and self.breaker.failures:
+                # The last attempt failed on the cluster itself, retried by the caller until the circuit opens
+                raise CircuitOpenError(f"Elasticsearch unavailable after {self.retry} attempts", pending, result)
+            if pending:
+                logger.error(f"Could not insert {len(pending)} documents after {self.retry} attempts.")
+                self._fail(events, sources, pending, "retries_exhausted", result)
+            elif not result.failed:
+                logger.info(f"Successfully inserted {len(events)} documents.", extra={
+                    "documents": len(events), "duration_s": round(perf_counter() - start_time, 6)})
+            return result
         finally:
-            duration = time() - start_time
-            response_time_metric.observe(duration)
+            self._bulk_time.observe(perf_counter() - start_time)
+
+    def _actions(self, events: list, sources: list | None, timestamp: int) -> list[bytes]:
+        """ Action line of every document with its resolved index and routing,
+        and a deterministic `_id` when an id strategy is set """
+        heads = self.router.heads(events, timestamp)
+        if not self.ids.enabled:
+            if not self.router.dynamic:
+                return [heads[0] + b"}}\n"] * len(events)
+            return [head + b"}}\n" for head in heads]
+        actions = []
+        for position, (event, head) in enumerate(zip(events, heads)):
+            try:
+                document_id = self.ids.document_id(event, sources[position] if sources else None)
+            except Exception:
+                # Undecodable raw source, Elasticsearch rejects it as a single item
+                document_id = None
+            if document_id is None:
+                actions.append(head + b"}}\n")
+            else:
+                actions.append(head + b',"_id":' + self.codec.dumps(document_id) + b"}}\n")
+        return actions
+
+    async def _send(self, events: list, sources: list | None, actions: list[bytes], pending: list[int],
+                    timestamp: int, result: BulkResult) -> list[int]:
+        """ Sends the pending documents in one bulk request and returns the positions to retry """
+        body = build_bulk_body([actions[i] for i in pending], [events[i] for i in pending], timestamp, self.codec)
+        try:
+            response = await self.client.bulk(operations=body, filter_path=BULK_FILTER_PATH)
+        except ApiError as e:
+            logger.error(f"Bulk insert failed on attempt {result.attempts}: {e}")
+            if e.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+                # A throttling cluster is alive, backpressure deals with it
+                result.throttled += len(pending)
+                self.breaker.record_success()
+            elif e.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if e.status_code in RETRYABLE_STATUSES:
+                bulk_item_errors_total.labels(reason=f"http_{e.status_code}", action="retried").inc(len(pending))
+                return pending
+            self._fail(events, sources, pending, f"http_{e.status_code}", result, e.message)
+            return []
+        except TransportError as e:
+            logger.error(f"Bulk insert failed on attempt {result.attempts}: {e}")
+            self.breaker.record_failure()
+            bulk_item_errors_total.labels(reason="transport", action="retried").inc(len(pending))
+            return pending
+
+        self.breaker.record_success()
+        if not response.get("errors"):
+            result.indexed += len(pending)
+            return []
+
+        retry = []
+        for position, item in zip(pending, response["items"]):
+            details = next(iter(item.values()))
+            status = details.get("status", 0)
+            if status < HTTPStatus.MULTIPLE_CHOICES:
+                result.indexed += 1
+                continue
+            if status == HTTPStatus.CONFLICT and self.ids.op_type == "create":
+                # A replayed document that is already indexed
+                result.duplicates += 1
+                bulk_duplicates_total.inc()
+                continue
+            error = details.get("error", {})
+            reason = error.get("type", f"http_{status}")
+            if status == HTTPStatus.TOO_MANY_REQUESTS:
+                result.throttled += 1
+            if status in RETRYABLE_STATUSES:
+                bulk_item_errors_total.labels(reason=reason, action="retried").inc()
+                retry.append(position)
+            else:
+                self._fail(events, sources, [position], reason, result, error.get("reason", ""))
+        return retry
+
+    def fail(self, events: list, sources: list | None, positions: list[int], reason: str) -> BulkResult:
+        """ Fails documents without sending them, to the dead-letter port """
+        result = BulkResult()
+        self._fail(events, sources, positions, reason, result)
+        return result
+
+    def _fail(self, events: list, sources: list | None, positions: list[int], reason: str, result: BulkResult,
+              error: str = ""):
+        result.failed += len(positions)
+        errors_total.inc(len(positions))
+        bulk_item_errors_total.labels(reason=reason, action="dropped").inc(len(positions))
+        for position in positions:
+            if self.dead_letters is None:
+                logger.error(f"Failed document ({reason}): {events[position]}")
+                continue
+            source = sources[position] if sources else None
+            self.dead_letters.publish(DeadLetter(events[position], reason, error, source))
@@ -0,0 +1,149 @@
+import json
+from datetime import datetime, timezone
+from string import Formatter
+
+from elasticsearch import AsyncElasticsearch
+
+from codec import JsonCodec
+from config import ElasticSettings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Placeholder value of an event field that is missing or cannot be formatted
+MISSING = "unknown"
+_INVALID_INDEX_CHARS = str.maketrans({char: "-" for char in '\\/*?"<>| ,#:'})
+
+
+class RouteTemplate:
+    """ A `str.format` style template over event fields, e.g. `logs-{tenant}-{timestamp:%Y.%m.%d}`.
+    Dotted names address nested fields, a format spec with `%` formats the field as a UTC date
+    (epoch seconds or milliseconds, or an ISO 8601 string). Missing fields, objects, arrays and values
+    the format spec does not apply to render as `MISSING` """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.parts = [
+            (literal, tuple(field.split(".")) if field else None, spec or "")
+            for literal, field, spec, _ in Formatter().parse(template)
+        ]
+        self.fields = [field for _, field, _ in self.parts if field]
+
+    @property
+    def static(self) -> bool:
+        return not self.fields
+
+    def values(self, event: dict) -> tuple:
+        return tuple(_lookup(event, field) for field in self.fields)
+
+    def render(self, values: tuple) -> str:
+        rendered = []
+        values = iter(values)
+        for literal, field, spec in self.parts:
+            rendered.append(literal)
+            if field:
+                rendered.append(_format(next(values), spec))
+        return "".join(rendered)
+
+    def pattern(self) -> str:
+        """ Wildcard pattern matching every index the template renders """
+        return "".join(literal + ("*" if field else "") for literal, field, _ in self.parts)
+
+
+def _lookup(event: dict, field: tuple):
+    value = event
+    for key in field:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    # Objects and arrays cannot name an index, nor key the per-batch cache
+    return None if isinstance(value, (dict, list)) else value
+
+
+def _format(value, spec: str) -> str:
+    if value is None:
+        return MISSING
+    try:
+        if "%" not in spec:
+            return format(value, spec) if spec else str(value)
+        if isinstance(value, str):
+            try:
+                value = float(value)
+            except ValueError:
+                return datetime.fromisoformat(value.replace("Z", "+00:00")).strftime(spec)
+        if value > 1e11:
+            value /= 1000
+        return datetime.fromtimestamp(value, timezone.utc).strftime(spec)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return MISSING
+
+
+class IndexRouter:
+    """ Resolves the target index and optional routing of every document and renders its bulk action line.
+
+    Lines are cached per distinct target within a batch, so a batch spread over a few indices
+    formats each of them once. Raw events are decoded only when a template needs a field
+    other than `timestamp`, which is the batch timestamp stamped into them """
+
+    def __init__(self, settings: ElasticSettings, codec: JsonCodec, op_type: str):
+        self.settings = settings
+        self.codec = codec
+        self.op_type = op_type
+        self.index = RouteTemplate(settings.index)
+        self.routing = RouteTemplate(settings.routing) if settings.routing else None
+        self.templates = [template for template in (self.index, self.routing) if template is not None]
+        self.dynamic = any(not template.static for template in self.templates)
+        self._decode_raw = any(field != ("timestamp",) for template in self.templates for field in template.fields)
+        self._static_head = self._head(settings.index, None)
+
+    def heads(self, events: list, timestamp: int) -> list[bytes]:
+        """ Action line of every event without its closing braces, so an `_id` can be appended """
+        if not self.dynamic:
+            return [self._static_head] * len(events)
+        cache = {}
+        heads = []
+        for event in events:
+            key = tuple(template.values(self._fields(event, timestamp)) for template in self.templates)
+            head = cache.get(key)
+            if head is None:
+                index = self.index.render(key[0]).lower().translate(_INVALID_INDEX_CHARS)
+                # A document without its routing field keeps the default, id based routing
+                routing = self.routing.render(key[1]) if self.routing and None not in key[1] else None
+                head = cache[key] = self._head(index, routing)
+            heads.append(head)
+        return heads
+
+    def _fields(self, event: dict | bytes, timestamp: int) -> dict:
+        if isinstance(event, dict):
+            return event
+        fields = {}
+        if self._decode_raw:
+            try:
+                fields = self.codec.loads(event)
+            except ValueError:
+                pass
+            if not isinstance(fields, dict):
+                fields = {}
+        fields["timestamp"] = timestamp
+        return fields
+
+    def _head(self, index: str, routing: str | None) -> bytes:
+        metadata = {"_index": index}
+        if routing is not None:
+            metadata["routing"] = routing
+        return self.codec.dumps({self.op_type: metadata})[:-len(b"}}")]
+
+    async def bootstrap(self, client: AsyncElasticsearch):
+        """ Installs the configured index template, covering every index the router can resolve """
+        name = self.settings.index_template_name
+        if not name:
+            return
+        body = {}
+        if self.settings.index_template_file:
+            with open(self.settings.index_template_file, encoding="utf-8") as file:
+                body = json.load(file)
+        body.setdefault("index_patterns", [self.index.pattern()])
+        if self.settings.data_stream:
+            body.setdefault("data_stream", {})
+        await client.indices.put_index_template(name=name, **body)
+        logger.info(f"Index template {name} installed for {body['index_patterns']}")
@@ -0,0 +1,20 @@
+import time
+
+from elastic_transport import AiohttpHttpNode
+
+from metrics import es_node_request_time_metric, es_node_errors_total
+
+
+class InstrumentedNode(AiohttpHttpNode):
+    """ HTTP node that records the latency of every request per Elasticsearch node,
+    to spot overloaded coordinating nodes """
+
+    async def perform_request(self, method, target, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return await super().perform_request(method, target, *args, **kwargs)
+        except Exception:
+            es_node_errors_total.labels(node=self.base_url).inc()
+            raise
+        finally:
+            es_node_request_time_metric.labels(node=self.base_url).observe(time.perf_counter() - start_time)
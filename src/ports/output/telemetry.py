@@ -0,0 +1,185 @@
+import asyncio
+import glob
+import os
+import threading
+import time
+
+from codec import get_codec
+from config import TelemetrySettings
+from logger import get_logger
+from metrics import telemetry_dropped_total
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+logger = get_logger(__name__)
+
+# Column name and type of every journal record, one record per indexed batch
+FIELDS = {
+    "started_at": "float64",
+    "finished_at": "float64",
+    "partitions": "list<string>",
+    "records": "int64",
+    "documents": "int64",
+    "bytes": "int64",
+    "decode_s": "float64",
+    "transform_s": "float64",
+    "index_s": "float64",
+    "commit_s": "float64",
+    "attempts": "int64",
+    "retries": "int64",
+    "failed": "int64",
+    "throttled": "int64",
+}
+FILE_PREFIX = "batches-"
+
+
+def arrow_schema():
+    return pa.schema([
+        (name, pa.list_(pa.string()) if kind == "list<string>" else pa.type_for_alias(kind))
+        for name, kind in FIELDS.items()
+    ])
+
+
+class ArrowJournalWriter:
+    """ Arrow IPC stream, readable up to the last complete batch even when the process died mid-file """
+
+    extension = ".arrow"
+
+    def __init__(self, path: str):
+        self.schema = arrow_schema()
+        self.sink = pa.OSFile(path, "wb")
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def write(self, columns: dict[str, list]) -> int:
+        self.writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=self.schema))
+        return self.sink.tell()
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+class JsonLinesJournalWriter:
+    """ One JSON object per line, used when pyarrow is not installed """
+
+    extension = ".jsonl"
+
+    def __init__(self, path: str):
+        self.codec = get_codec("auto")
+        self.file = open(path, "ab")
+
+    def write(self, columns: dict[str, list]) -> int:
+        names = list(columns)
+        self.file.write(b"".join(
+            self.codec.dumps(dict(zip(names, row))) + b"\n" for row in zip(*columns.values())))
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class TelemetryJournal:
+    """ Appends one compact record per indexed batch to rotating files in a local directory.
+
+    Records are buffered in columns and written by a background task every `flush_interval_ms`,
+    so the consumer never waits on the disk. When the buffer is full new records are dropped and
+    counted. Every process writes its own files, rotated at `max_bytes`, and only the newest
+    `max_files` files of the directory are kept """
+
+    def __init__(self, settings: TelemetrySettings):
+        self.settings = settings
+        self.directory = settings.path
+        use_arrow = settings.format == "arrow" or (settings.format == "auto" and pa is not None)
+        if use_arrow and pa is None:
+            raise RuntimeError("pyarrow is required for the arrow telemetry format, install the telemetry extra")
+        self.writer_class = ArrowJournalWriter if use_arrow else JsonLinesJournalWriter
+        self._columns = self._empty()
+        self._rows = 0
+        self._writer = None
+        self._path = None
+        self._size = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        logger.info(f"Telemetry journal initialized in {self.directory} ({self.writer_class.extension[1:]}).")
+
+    @staticmethod
+    def _empty() -> dict[str, list]:
+        return {name: [] for name in FIELDS}
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """ Writes the buffered records and closes the current file """
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._flush()
+        await asyncio.to_thread(self._close)
+
+    def record(self, **values) -> None:
+        if self._rows >= self.settings.buffer_size:
+            telemetry_dropped_total.inc()
+            return
+        for name, column in self._columns.items():
+            column.append(values.get(name))
+        self._rows += 1
+
+    async def _run(self):
+        interval = self.settings.flush_interval_ms / 1000
+        while True:
+            await asyncio.sleep(interval)
+            await self._flush()
+
+    async def _flush(self):
+        if not self._rows:
+            return
+        columns, rows = self._columns, self._rows
+        self._columns, self._rows = self._empty(), 0
+        try:
+            await asyncio.to_thread(self._write, columns)
+        except Exception as e:
+            telemetry_dropped_total.inc(rows)
+            logger.error(f"Could not write {rows} telemetry records: {e}")
+
+    def _write(self, columns: dict[str, list]):
+        with self._lock:
+            if self._writer is None or self._size >= self.settings.max_bytes:
+                self._rotate()
+            self._size = self._writer.write(columns)
+
+    def _rotate(self):
+        self._close_writer()
+        self._sequence += 1
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        name = f"{FILE_PREFIX}{stamp}-{os.getpid()}-{self._sequence:04d}{self.writer_class.extension}"
+        self._path = os.path.join(self.directory, name)
+        self._writer = self.writer_class(self._path)
+        self._size = 0
+        self._prune()
+
+    def _prune(self):
+        files = sorted(glob.glob(os.path.join(self.directory, f"{FILE_PREFIX}*")), key=os.path.getmtime)
+        for path in files[:max(len(files) - self.settings.max_files, 0)]:
+            if path != self._path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Another worker pruned it first
+                    pass
+
+    def _close(self):
+        with self._lock:
+            self._close_writer()
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,281 @@
+import asyncio
+import concurrent.futures
+import hmac
+import json
+import linecache
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Iterable
+from urllib.parse import parse_qs
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Event loop of the consumer, registered by the application once it runs
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def attach_loop(loop: asyncio.AbstractEventLoop):
+    global _loop
+    _loop = loop
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float) -> Counter:
+    """ Samples the stacks of every other thread for `seconds`, counting identical stacks.
+    Stacks are root first and prefixed with the thread name """
+    own = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapsed(stacks: Counter) -> str:
+    """ Brendan Gregg's folded format read by flamegraph.pl and speedscope """
+    return "".join(f"{';'.join(frame.replace(';', ':') for frame in stack)} {count}\n"
+                   for stack, count in stacks.most_common())
+
+
+def speedscope(stacks: Counter, name: str, weight: float, unit: str) -> dict:
+    """ Sampled profile in the speedscope file format, each count weighs `weight` `unit` """
+    frames = {}
+    samples = []
+    weights = []
+    for stack, count in stacks.items():
+        samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+        weights.append(count * weight)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": [{"name": frame} for frame in frames]},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": unit,
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+
+
+def memory_snapshot(seconds: float, frames: int) -> tracemalloc.Snapshot:
+    """ Traces allocations for `seconds` unless tracing is already on, tracing stops afterwards """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    try:
+        time.sleep(seconds)
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+def top_allocations(snapshot: tracemalloc.Snapshot, top: int) -> str:
+    lines = []
+    for stat in snapshot.statistics("lineno")[:top]:
+        frame = stat.traceback[0]
+        source = linecache.getline(frame.filename, frame.lineno).strip()
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}  {source}")
+    return "\n".join(lines) + "\n"
+
+
+def allocation_stacks(snapshot: tracemalloc.Snapshot) -> Counter:
+    """ Live bytes per allocation traceback, in the shape of sampled stacks """
+    stacks = Counter()
+    for stat in snapshot.statistics("traceback"):
+        stacks[tuple(f"{frame.filename}:{frame.lineno}" for frame in stat.traceback)] += stat.size
+    return stacks
+
+
+def _describe_tasks(loop: asyncio.AbstractEventLoop) -> str:
+    lines = []
+    for task in sorted(asyncio.all_tasks(loop), key=lambda task: task.get_name()):
+        coroutine = task.get_coro()
+        lines.append(f"{task.get_name()}: {getattr(coroutine, '__qualname__', coroutine)} "
+                     f"{'done' if task.done() else 'pending'}")
+        for frame in task.get_stack():
+            lines.append(f"    {frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}")
+    return "\n".join(lines) + "\n"
+
+
+def dump_tasks(loop: asyncio.AbstractEventLoop, timeout: float = 2.0) -> str:
+    """ Stacks of every task of the loop. A loop that does not answer within `timeout` is blocked:
+    its tasks are then read from this thread together with the stack the loop is stuck in """
+
+    future = concurrent.futures.Future()
+
+    def describe():
+        if future.set_running_or_notify_cancel():
+            future.set_result(_describe_tasks(loop))
+
+    loop.call_soon_threadsafe(describe)
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+    stuck = []
+    loop_thread = getattr(loop, "_thread_id", None)
+    frame = sys._current_frames().get(loop_thread)
+    while frame is not None:
+        stuck.append(f"    {frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}")
+        frame = frame.f_back
+    return (f"Event loop blocked for more than {timeout}s, currently in:\n" + "\n".join(stuck) + "\n\n"
+            + _describe_tasks(loop))
+
+
+def loop_lag(loop: asyncio.AbstractEventLoop, samples: int, interval: float, timeout: float = 10.0) -> list[float]:
+    """ Delays between scheduling a callback on the loop from this thread and the loop running it """
+    lags = []
+    for _ in range(samples):
+        ran = threading.Event()
+        scheduled = time.perf_counter()
+        delays = []
+        loop.call_soon_threadsafe(lambda: (delays.append(time.perf_counter() - scheduled), ran.set()))
+        lags.append(delays[0] if ran.wait(timeout) else timeout)
+        time.sleep(interval)
+    return lags
+
+
+class ProfilingApp:
+    """ WSGI app serving the metrics app plus on-demand profiling endpoints behind a bearer token.
+
+    GET /debug/profile?seconds=10&interval_ms=5&format=collapsed|speedscope   sampling CPU profile
+    GET /debug/memory?seconds=10&top=25&format=text|collapsed|speedscope     tracemalloc snapshot
+    GET /debug/tasks                                                         asyncio task stacks
+    GET /debug/loop?samples=5                                                event loop lag
+
+    Nothing runs between requests: the sampler, tracemalloc and the lag probes only live for
+    the duration of the request that asked for them """
+
+    def __init__(self, metrics_app: Callable, token: str, max_seconds: float = 60):
+        self.metrics_app = metrics_app
+        self.token = token.encode()
+        self.max_seconds = max_seconds
+        self._busy = threading.Lock()
+        self.routes = {
+            "/debug/profile": self.profile,
+            "/debug/memory": self.memory,
+            "/debug/tasks": self.tasks,
+            "/debug/loop": self.loop,
+        }
+
+    def __call__(self, environ: dict, start_response: Callable) -> Iterable[bytes]:
+        handler = self.routes.get(environ.get("PATH_INFO", ""))
+        if handler is None:
+            return self.metrics_app(environ, start_response)
+        query = {key: values[-1] for key, values in parse_qs(environ.get("QUERY_STRING", "")).items()}
+        if not self._authorized(environ, query):
+            return self._respond(start_response, "401 Unauthorized", "Unauthorized\n")
+        try:
+            return handler(start_response, query)
+        except ValueError as e:
+            return self._respond(start_response, "400 Bad Request", f"{e}\n")
+
+    def _authorized(self, environ: dict, query: dict) -> bool:
+        header = environ.get("HTTP_AUTHORIZATION", "")
+        token = header[len("Bearer "):] if header.startswith("Bearer ") else query.get("token", "")
+        return hmac.compare_digest(token.encode(), self.token)
+
+    def _seconds(self, query: dict, default: float) -> float:
+        seconds = float(query.get("seconds", default))
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"seconds must be within (0, {self.max_seconds}]")
+        return seconds
+
+    @staticmethod
+    def _interval(query: dict, default: float, seconds: float) -> float:
+        """ Sampling interval within the profiling window, a longer one would hold the profiler past it """
+        interval_ms = float(query.get("interval_ms", default))
+        if not 0 < interval_ms <= seconds * 1000:
+            raise ValueError(f"interval_ms must be within (0, {seconds * 1000:g}]")
+        return interval_ms / 1000
+
+    @staticmethod
+    def _count(query: dict, key: str, default: int, maximum: int) -> int:
+        count = int(query.get(key, default))
+        if not 1 <= count <= maximum:
+            raise ValueError(f"{key} must be within [1, {maximum}]")
+        return count
+
+    def profile(self, start_response: Callable, query: dict) -> Iterable[bytes]:
+        seconds = self._seconds(query, 10)
+        interval = self._interval(query, 5, seconds)
+        if not self._busy.acquire(blocking=False):
+            return self._respond(start_response, "409 Conflict", "Another profile is running\n")
+        try:
+            logger.info(f"CPU profiling for {seconds}s")
+            stacks = sample_stacks(seconds, interval)
+        finally:
+            self._busy.release()
+        return self._stacks(start_response, query, stacks, "cpu", interval, "seconds")
+
+    def memory(self, start_response: Callable, query: dict) -> Iterable[bytes]:
+        seconds = self._seconds(query, 10)
+        top = self._count(query, "top", 25, 1000)
+        frames = self._count(query, "frames", 25, 100)
+        if not self._busy.acquire(blocking=False):
+            return self._respond(start_response, "409 Conflict", "Another profile is running\n")
+        try:
+            logger.info(f"Tracing allocations for {seconds}s")
+            snapshot = memory_snapshot(seconds, frames)
+        finally:
+            self._busy.release()
+        if query.get("format", "text") == "text":
+            return self._respond(start_response, "200 OK", top_allocations(snapshot, top))
+        return self._stacks(start_response, query, allocation_stacks(snapshot), "memory", 1, "bytes")
+
+    def tasks(self, start_response: Callable, query: dict) -> Iterable[bytes]:
+        if _loop is None:
+            return self._respond(start_response, "503 Service Unavailable", "No event loop attached\n")
+        return self._respond(start_response, "200 OK", dump_tasks(_loop))
+
+    def loop(self, start_response: Callable, query: dict) -> Iterable[bytes]:
+        samples = self._count(query, "samples", 5, 100)
+        if _loop is None:
+            return self._respond(start_response, "503 Service Unavailable", "No event loop attached\n")
+        lags = loop_lag(_loop, samples, 0.1)
+        report = {
+            "samples_ms": [round(lag * 1000, 3) for lag in lags],
+            "mean_ms": round(sum(lags) / len(lags) * 1000, 3),
+            "max_ms": round(max(lags) * 1000, 3),
+            "tasks": len(asyncio.all_tasks(_loop)),
+        }
+        return self._respond(start_response, "200 OK", json.dumps(report), "application/json")
+
+    def _stacks(self, start_response: Callable, query: dict, stacks: Counter, name: str,
+                weight: float, unit: str) -> Iterable[bytes]:
+        if query.get("format", "collapsed") == "speedscope":
+            body = json.dumps(speedscope(stacks, name, weight, unit))
+            return self._respond(start_response, "200 OK", body, "application/json")
+        return self._respond(start_response, "200 OK", collapsed(stacks))
+
+    @staticmethod
+    def _respond(start_response: Callable, status: str, body: str,
+                 content_type: str = "text/plain; charset=utf-8") -> Iterable[bytes]:
+        data = body.encode()
+        start_response(status, [("Content-Type", content_type), ("Content-Length", str(len(data)))])
+        return [data]
@@ -0,0 +1,69 @@
+from config import KafkaSettings
+from metrics import consumer_paused, in_flight_bytes
+
+
+class BackpressureController:
+    """ Decides when fetching has to stop because Elasticsearch falls behind.
+
+    Fetching pauses when the bytes fetched but not yet indexed, the smoothed bulk latency or
+    the smoothed 429 rate crosses its limit, and resumes only once every signal dropped below
+    `resume_ratio` of its limit (or everything in flight has been indexed), so the consumer
+    does not flap between the two states """
+
+    SMOOTHING = 0.3
+
+    def __init__(self, settings: KafkaSettings):
+        self.enabled = settings.backpressure
+        self.max_bytes = settings.max_in_flight_bytes
+        self.max_latency = settings.max_bulk_latency_ms / 1000
+        self.max_throttle_rate = settings.max_throttle_rate
+        self.resume_ratio = settings.resume_ratio
+        self.in_flight_bytes = 0
+        self.latency: float | None = None
+        self.throttle_rate: float | None = None
+        self.paused = False
+
+    def acquire(self, size: int) -> None:
+        """ Bytes of a fetched batch that is waiting to be indexed """
+        if not self.enabled:
+            return
+        self.in_flight_bytes += size
+        in_flight_bytes.set(self.in_flight_bytes)
+
+    def release(self, size: int) -> None:
+        if not self.enabled:
+            return
+        self.in_flight_bytes = max(0, self.in_flight_bytes - size)
+        in_flight_bytes.set(self.in_flight_bytes)
+
+    def observe(self, records: int, latency: float, throttled: int = 0) -> None:
+        if not records:
+            return
+        self.latency = self._smooth(self.latency, latency)
+        self.throttle_rate = self._smooth(self.throttle_rate, throttled / records)
+
+    def should_pause(self) -> bool:
+        """ Re-evaluates the state and returns True while fetching has to stay paused """
+        if not self.enabled:
+            return False
+        if self.paused:
+            if self._below(self.resume_ratio) or not self.in_flight_bytes:
+                self.paused = False
+                # Signals of a drained pipeline are stale, the next bulks start them afresh
+                self.latency = self.throttle_rate = None
+        elif not self._below(1.0):
+            self.paused = True
+        consumer_paused.set(int(self.paused))
+        return self.paused
+
+    def _below(self, ratio: float) -> bool:
+        return (
+            self.in_flight_bytes <= self.max_bytes * ratio
+            and (self.latency or 0) <= self.max_latency * ratio
+            and (self.throttle_rate or 0) <= self.max_throttle_rate * ratio
+        )
+
+    def _smooth(self, current: float | None, value: float) -> float:
+        if current is None:
+            return value
+        return self.SMOOTHING * value + (1 - self.SMOOTHING) * current
@@ -0,0 +1,64 @@
+import time
+from typing import Any, Callable
+
+from domain.models import Batch
+from domain.transform import CompiledTransform, TransformResult, compile_transform
+from logger import get_logger
+from metrics import errors_total, events_filtered_total
+from ports.output.dead_letter import DeadLetter, DeadLetterService
+from ports.output.telemetry import TelemetryJournal
+
+logger = get_logger(__name__)
+
+
+class BatchSteps:
+    """ Transform, dead-letter and telemetry steps shared by the Kafka consumer and the file loader.
+    A source is a Kafka record or a file line, anything with a `topic`, a `partition` and an `offset` """
+
+    def __init__(self, transform: CompiledTransform | None = None, dead_letters: DeadLetterService | None = None,
+                 journal: TelemetryJournal | None = None):
+        self.transform = transform or compile_transform()
+        self.dead_letters = dead_letters
+        self.journal = journal
+
+    def apply_transform(self, events: list[dict], sources: list,
+                        rejected_value: Callable[[int], Any] | None = None) -> TransformResult:
+        """ Runs the compiled transform over a batch with a single timestamp and rejects the events it failed on,
+        as `rejected_value` gives them from their position, by default as decoded """
+        result = self.transform(events, int(time.time()))
+        for position, error in result.failures:
+            value = rejected_value(position) if rejected_value else events[position]
+            self.reject(value, sources[position], error)
+        if result.dropped:
+            events_filtered_total.inc(result.dropped)
+        return result
+
+    def reject(self, value, source, error: Exception):
+        """ Dead-letters an event that could not be decoded or transformed, or logs it without dead letters """
+        errors_total.inc()
+        if self.dead_letters is None:
+            logger.error(f"Invalid message at offset {source.offset} of {source.topic}: {value}")
+            return
+        self.dead_letters.publish(DeadLetter(value, "invalid_message", str(error), source))
+
+    def journal_batch(self, batch: Batch, partitions: list[str], commit_time: float):
+        """ Appends the telemetry record of an indexed and acknowledged batch """
+        if self.journal is None:
+            return
+        result = batch.result
+        self.journal.record(
+            started_at=batch.started_at,
+            finished_at=time.time(),
+            partitions=partitions,
+            records=batch.count,
+            documents=len(batch.events),
+            bytes=batch.size,
+            decode_s=batch.timings.get("decode_s", 0.0),
+            transform_s=batch.timings.get("transform_s", 0.0),
+            index_s=batch.timings.get("index_s", 0.0),
+            commit_s=commit_time,
+            attempts=result.attempts if result else 0,
+            retries=result.retried if result else 0,
+            failed=result.failed if result else 0,
+            throttled=result.throttled if result else 0,
+        )
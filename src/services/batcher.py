@@ -0,0 +1,51 @@
+from config import KafkaSettings
+from metrics import batch_target_records
+
+
+class AdaptiveBatcher:
+    """ AIMD control of the number of records fetched per batch.
+    The record count grows additively while bulks stay within the latency budget and
+    halves on a slow or throttled bulk. It is further capped so that a batch stays
+    close to `target_batch_bytes` at the observed average record size """
+
+    DECREASE_FACTOR = 0.5
+    SIZE_SMOOTHING = 0.2
+
+    def __init__(self, settings: KafkaSettings):
+        self.enabled = settings.adaptive_batching
+        self.min_records = settings.min_batch_size
+        self.max_records_limit = settings.max_batch_size
+        self.target_bytes = settings.target_batch_bytes
+        self.latency_budget = settings.batch_latency_budget_ms / 1000
+        self.records = settings.batch_size
+        self.record_bytes = 0.0
+        batch_target_records.set(self.max_records)
+
+    @property
+    def max_records(self) -> int:
+        """ Records to request from the next fetch """
+        if not self.enabled:
+            return self.records
+        return min(self.records, self._limit())
+
+    def _limit(self) -> int:
+        if not self.record_bytes:
+            return self.max_records_limit
+        by_bytes = max(self.min_records, int(self.target_bytes / self.record_bytes))
+        return min(self.max_records_limit, by_bytes)
+
+    def observe(self, records: int, size: int, latency: float, throttled: int = 0) -> None:
+        """ Adjusts the target after a bulk of `records` records and `size` bytes took `latency` seconds """
+        if not self.enabled or not records:
+            return
+        record_bytes = size / records
+        if self.record_bytes:
+            record_bytes = self.SIZE_SMOOTHING * record_bytes + (1 - self.SIZE_SMOOTHING) * self.record_bytes
+        full = records >= self.max_records
+        self.record_bytes = record_bytes
+
+        if throttled or latency > self.latency_budget:
+            self.records = max(self.min_records, int(self.records * self.DECREASE_FACTOR))
+        elif full:
+            self.records = min(self._limit(), self.records + self.min_records)
+        batch_target_records.set(self.max_records)
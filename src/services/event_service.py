@@ -1,18 +1,81 @@
+import time
+
 from logger import get_logger
-from metrics import batch_processing_time_metric, messages_processed, errors_total
-from ports.output.elastic_service import ElasticsearchClientService
+from metrics import messages_processed, errors_total
+from ports.output.circuit_breaker import CircuitOpenError
+from ports.output.elastic_service import BulkResult, ElasticsearchClientService
 
 logger = get_logger(__name__)
 
 
-@batch_processing_time_metric.time()
-async def process_events(elastic_client: ElasticsearchClientService, events: list[dict]) -> None:
+async def process_events(elastic_client: ElasticsearchClientService, events: list[dict],
+                         sources: list | None = None) -> BulkResult | None:
     if not events:
-        return
+        return None
     try:
-        await elastic_client.bulk_insert(events)
+        result = await elastic_client.bulk_insert(events, sources)
+    except CircuitOpenError:
+        # Nothing was dropped, the caller holds the batch until the cluster is back
+        raise
     except Exception as e:
         logger.exception("Bulk insert failed")
         errors_total.inc()
-    else:
-        messages_processed.inc(len(events))
+        return None
+    messages_processed.inc(len(events))
+    return result
+
+
+class HeldBatch:
+    """ Documents of a batch held while Elasticsearch is unavailable. Only those the cluster did not settle
+    are sent again once it is back, and those still unsettled after `hold_timeout_s` are dead-lettered """
+
+    def __init__(self, elastic_client: ElasticsearchClientService, events: list, sources: list | None = None):
+        self.elastic_client = elastic_client
+        self.all_events = events
+        self.all_sources = sources
+        # Positions still to send, None while nothing was sent
+        self.positions: list[int] | None = None
+        self.result = BulkResult()
+        timeout = elastic_client.settings.hold_timeout_s
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    @property
+    def events(self) -> list:
+        if self.positions is None:
+            return self.all_events
+        return [self.all_events[position] for position in self.positions]
+
+    @property
+    def sources(self) -> list | None:
+        if self.positions is None or self.all_sources is None:
+            return self.all_sources
+        return [self.all_sources[position] for position in self.positions]
+
+    def settle(self, result: BulkResult | None) -> BulkResult | None:
+        """ Outcome of the whole batch once its last send went through """
+        if self.positions is None:
+            return result
+        if result is not None:
+            self.result.merge(result)
+        return self.result
+
+    async def hold(self, error: CircuitOpenError) -> bool:
+        """ Narrows the batch to the documents `error` left unsettled and waits for the cluster.
+        False once the hold timed out and those documents were dead-lettered, `result` is then final """
+        if error.result is not None:
+            self.result.merge(error.result)
+        positions = self.positions if self.positions is not None else range(len(self.all_events))
+        if error.pending is not None:
+            positions = [positions[position] for position in error.pending]
+        self.positions = list(positions)
+        if self.deadline is None:
+            return await self.elastic_client.wait_until_available()
+        remaining = self.deadline - time.monotonic()
+        if remaining > 0 and await self.elastic_client.wait_until_available(remaining):
+            return True
+        logger.error(f"Held {len(self.positions)} documents for {self.elastic_client.settings.hold_timeout_s}s "
+                     f"without indexing them, failing them")
+        self.result.merge(
+            self.elastic_client.fail(self.events, self.sources, list(range(len(self.positions))), "hold_timeout"))
+        self.positions = []
+        return False
@@ -0,0 +1,38 @@
+from collections import deque
+
+
+class OffsetTracker:
+    """ Tracks in-flight offset ranges per partition. Ranges may complete in any order,
+    but only the contiguous completed prefix of every partition becomes committable """
+
+    def __init__(self):
+        self._pending: dict = {}
+        self._watermarks: dict = {}
+        self._committed: dict = {}
+
+    def track(self, topic_partition, first: int, next_offset: int) -> None:
+        """ Registers the range [first, next_offset) in fetch order """
+        self._pending.setdefault(topic_partition, deque()).append([first, next_offset, False])
+
+    def ack(self, topic_partition, first: int) -> None:
+        """ Marks the range starting at `first` as indexed and advances the watermark """
+        ranges = self._pending.get(topic_partition)
+        if not ranges:
+            return
+        for offset_range in ranges:
+            if offset_range[0] == first:
+                offset_range[2] = True
+                break
+        while ranges and ranges[0][2]:
+            self._watermarks[topic_partition] = ranges.popleft()[1]
+
+    def committable(self) -> dict:
+        """ Watermarks that moved since the last commit """
+        return {
+            topic_partition: offset
+            for topic_partition, offset in self._watermarks.items()
+            if self._committed.get(topic_partition) != offset
+        }
+
+    def mark_committed(self, offsets: dict) -> None:
+        self._committed.update(offsets)
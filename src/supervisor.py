@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from typing import Callable
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+
+def prepare_multiprocess_metrics() -> str:
+    """ Points prometheus_client of the worker processes at a shared, empty directory.
+    Has to run before the workers are spawned, they import prometheus_client afresh """
+    path = os.environ.get(MULTIPROC_DIR_ENV)
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".db"):
+                os.remove(os.path.join(path, name))
+    else:
+        path = os.environ[MULTIPROC_DIR_ENV] = tempfile.mkdtemp(prefix="prometheus-")
+    return path
+
+
+class Supervisor:
+    """ Runs `workers` copies of `target` in spawned processes of the same consumer group.
+    A crashed worker is restarted after `restart_delay_s`, doubled for every crash in a row up to a minute.
+    SIGTERM or SIGINT stops all workers with SIGTERM and kills those still running after `shutdown_timeout_s` """
+
+    MAX_RESTART_DELAY_S = 60
+    # A worker that ran this long is considered healthy again
+    STABLE_AFTER_S = 60
+    POLL_INTERVAL_S = 0.5
+
+    def __init__(self, target: Callable[[], None], workers: int, restart_delay_s: float = 1,
+                 shutdown_timeout_s: float = 30):
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay_s
+        self.shutdown_timeout = shutdown_timeout_s
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: list[multiprocessing.Process | None] = [None] * workers
+        self._started_at = [0.0] * workers
+        self._crashes = [0] * workers
+        self._restart_at = [0.0] * workers
+        self._stopping = threading.Event()
+
+    def run(self):
+        """ Supervises the workers until a termination signal arrives """
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self.stop())
+        self.start()
+        try:
+            self.supervise()
+        finally:
+            self.shutdown()
+
+    def start(self):
+        logger.info(f"Starting {self.workers} workers")
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+    def supervise(self):
+        while not self._stopping.is_set():
+            for slot, process in enumerate(self._processes):
+                if process is None:
+                    if time.monotonic() >= self._restart_at[slot]:
+                        self._spawn(slot)
+                elif not process.is_alive():
+                    self._reap(slot, process)
+            self._stopping.wait(self.POLL_INTERVAL_S)
+
+    def stop(self):
+        self._stopping.set()
+
+    def shutdown(self):
+        processes = [process for process in self._processes if process is not None]
+        logger.info(f"Stopping {len(processes)} workers")
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {process.pid} did not stop in {self.shutdown_timeout}s, killing it")
+                process.kill()
+                process.join()
+            self._mark_dead(process.pid)
+        self._processes = [None] * self.workers
+
+    def _spawn(self, slot: int):
+        process = self._context.Process(target=self.target, name=f"worker-{slot}", daemon=True)
+        process.start()
+        self._processes[slot] = process
+        self._started_at[slot] = time.monotonic()
+        logger.info(f"Worker {slot} started with pid {process.pid}")
+
+    def _reap(self, slot: int, process: multiprocessing.Process):
+        self._processes[slot] = None
+        self._mark_dead(process.pid)
+        if time.monotonic() - self._started_at[slot] >= self.STABLE_AFTER_S:
+            self._crashes[slot] = 0
+        delay = min(self.MAX_RESTART_DELAY_S, self.restart_delay * 2 ** self._crashes[slot])
+        self._crashes[slot] += 1
+        self._restart_at[slot] = time.monotonic() + delay
+        self.restarts += 1
+        logger.error(f"Worker {slot} (pid {process.pid}) exited with code {process.exitcode}, restarting in {delay}s")
+
+    @staticmethod
+    def _mark_dead(pid: int):
+        """ Drops the live gauges of a finished worker from the aggregated metrics """
+        if os.environ.get(MULTIPROC_DIR_ENV):
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid)
+
@@ -0,0 +1,132 @@
+"""
+test_backpressure_disabled_never_pauses: controller is inert when backpressure is off
+test_backpressure_pauses_on_in_flight_bytes: too many unindexed bytes pause fetching
+test_backpressure_pauses_on_slow_bulk: bulk latency over the limit pauses fetching
+test_backpressure_pauses_on_throttling: a high 429 rate pauses fetching
+test_backpressure_resumes_with_hysteresis: fetching resumes only below the resume ratio
+test_backpressure_resumes_when_drained: stale latency does not keep a drained consumer paused
+test_backpressure_exports_state: paused state and in-flight bytes are exported as gauges
+test_consumer_pauses_and_resumes_assignment: consumer pauses all assigned partitions and keeps polling
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from aiokafka import TopicPartition
+
+from config import KafkaSettings
+from metrics import consumer_paused, in_flight_bytes
+from ports.input.kafka_service import KafkaConsumerService
+from services.backpressure import BackpressureController
+
+
+def _controller(**overrides) -> BackpressureController:
+    settings = {
+        "backpressure": True,
+        "max_in_flight_bytes": 1000,
+        "max_bulk_latency_ms": 1000,
+        "max_throttle_rate": 0.1,
+        "resume_ratio": 0.5,
+    }
+    settings.update(overrides)
+    return BackpressureController(KafkaSettings(**settings))
+
+
+def test_backpressure_disabled_never_pauses():
+    controller = _controller(backpressure=False)
+    controller.acquire(10_000)
+    controller.observe(100, 60.0, throttled=100)
+    assert not controller.should_pause()
+    assert controller.in_flight_bytes == 0
+
+
+def test_backpressure_pauses_on_in_flight_bytes():
+    controller = _controller()
+    controller.acquire(800)
+    assert not controller.should_pause()
+    controller.acquire(300)
+    assert controller.should_pause()
+
+
+def test_backpressure_pauses_on_slow_bulk():
+    controller = _controller()
+    controller.acquire(100)
+    controller.observe(100, 2.0)
+    assert controller.should_pause()
+
+
+def test_backpressure_pauses_on_throttling():
+    controller = _controller()
+    controller.acquire(100)
+    controller.observe(100, 0.1, throttled=50)
+    assert controller.should_pause()
+
+
+def test_backpressure_resumes_with_hysteresis():
+    controller = _controller()
+    controller.acquire(1100)
+    assert controller.should_pause()
+    controller.release(400)
+    assert controller.should_pause()
+    controller.release(300)
+    assert not controller.should_pause()
+
+
+def test_backpressure_resumes_when_drained():
+    controller = _controller()
+    controller.acquire(100)
+    controller.observe(100, 5.0)
+    assert controller.should_pause()
+    controller.release(100)
+    assert not controller.should_pause()
+    assert controller.latency is None
+
+
+def test_backpressure_exports_state():
+    controller = _controller()
+    controller.acquire(2000)
+    controller.should_pause()
+    assert consumer_paused._value.get() == 1
+    assert in_flight_bytes._value.get() == 2000
+    controller.release(2000)
+    controller.should_pause()
+    assert consumer_paused._value.get() == 0
+
+
+@pytest.mark.asyncio
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+@patch("ports.input.kafka_service.AIOKafkaConsumer")
+async def test_consumer_pauses_and_resumes_assignment(mock_consumer_cls, mock_process):
+    tp = TopicPartition("test-topic", 0)
+    message = MagicMock()
+    message.offset = 0
+    message.value = {"field": 0}
+    message.serialized_value_size = 5000
+
+    consumer_mock = AsyncMock()
+    consumer_mock.subscribe = MagicMock()
+    consumer_mock.pause = MagicMock()
+    consumer_mock.resume = MagicMock()
+    consumer_mock.assignment = MagicMock(return_value={tp})
+    consumer_mock.getmany.side_effect = [{tp: [message]}, asyncio.CancelledError()]
+    mock_consumer_cls.return_value = consumer_mock
+
+    settings = KafkaSettings(
+        bootstrap_servers="localhost:9092", consumer_topics="test-topic", consumer_group="test-group",
+        backpressure=True, max_in_flight_bytes=1000)
+    service = KafkaConsumerService(MagicMock(), settings)
+
+    async def slow_bulk(client, events, **kwargs):
+        # The next poll happens while the batch is still being indexed
+        service._apply_backpressure(consumer_mock)
+        consumer_mock.pause.assert_called_once_with(tp)
+        return None
+
+    mock_process.side_effect = slow_bulk
+
+    with pytest.raises(asyncio.CancelledError):
+        await service.start()
+
+    consumer_mock.resume.assert_called_once_with(tp)
+    assert consumer_mock.getmany.await_count == 2
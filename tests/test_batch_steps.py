@@ -0,0 +1,56 @@
+"""
+test_apply_transform_rejects_failures: failed events are dead-lettered with their source, drops are counted
+test_reject_without_dead_letters_logs: without a dead letter service the rejected value is logged and counted
+test_journal_batch_records_stages: an indexed batch is journaled with its partitions and stage durations, if journaling
+"""
+
+from unittest.mock import MagicMock
+
+from domain.models import Batch
+from domain.transform import compile_transform
+from metrics import errors_total, events_filtered_total
+from ports.input.file_service import LineSource
+from ports.output.elastic_service import BulkResult
+from services.batch_steps import BatchSteps
+
+
+def test_apply_transform_rejects_failures():
+    dead_letters = MagicMock()
+    steps = BatchSteps(
+        compile_transform({"cast": {"n": "int"}, "drop_if": [{"field": "skip", "exists": True}]}), dead_letters)
+    sources = [LineSource("/data/events.ndjson", offset) for offset in (0, 10, 20)]
+    filtered = events_filtered_total._value.get()
+
+    result = steps.apply_transform([{"n": "1"}, {"n": "x"}, {"skip": 1}], sources, lambda position: b"raw")
+
+    assert result.events == [{"n": 1}]
+    assert result.positions == [0]
+    record = dead_letters.publish.call_args.args[0]
+    assert (record.value, record.topic, record.offset) == (b"raw", "/data/events.ndjson", 10)
+    assert events_filtered_total._value.get() == filtered + 1
+
+
+def test_reject_without_dead_letters_logs():
+    steps = BatchSteps()
+    errors = errors_total._value.get()
+
+    steps.reject({"n": "x"}, LineSource("stdin-export", 5), ValueError("bad"))
+
+    assert errors_total._value.get() == errors + 1
+
+
+def test_journal_batch_records_stages():
+    journal = MagicMock()
+    batch = Batch([{"id": 1}, {"id": 2}], {}, {}, 20, [], 3, 1700000000.0)
+    batch.timings.update(decode_s=0.1, index_s=0.3)
+    batch.result = BulkResult()
+    batch.result.attempts = 2
+
+    BatchSteps(journal=journal).journal_batch(batch, ["events:0"], 0.05)
+
+    record = journal.record.call_args.kwargs
+    assert record["partitions"] == ["events:0"]
+    assert (record["records"], record["documents"], record["bytes"]) == (3, 2, 20)
+    assert (record["decode_s"], record["transform_s"], record["index_s"], record["commit_s"]) == (0.1, 0.0, 0.3, 0.05)
+    assert record["attempts"] == 2
+    BatchSteps().journal_batch(batch, ["events:0"], 0.05)
@@ -0,0 +1,86 @@
+"""
+test_batcher_disabled_keeps_static_batch_size: fixed batch_size when adaptive batching is off
+test_batcher_grows_additively_within_budget: full fast batches grow the target
+test_batcher_does_not_grow_on_partial_batches: partial batches leave the target alone
+test_batcher_halves_on_slow_bulk: latency over budget halves the target
+test_batcher_halves_on_throttling: 429 responses halve the target
+test_batcher_caps_by_target_bytes: average record size caps the target
+test_batcher_respects_bounds: target stays within min/max batch size
+test_batcher_exports_target: current target is exported as a gauge
+"""
+
+from config import KafkaSettings
+from metrics import batch_target_records
+from services.batcher import AdaptiveBatcher
+
+
+def _batcher(**overrides) -> AdaptiveBatcher:
+    settings = {
+        "adaptive_batching": True,
+        "batch_size": 100,
+        "min_batch_size": 10,
+        "max_batch_size": 1000,
+        "target_batch_bytes": 1_000_000,
+        "batch_latency_budget_ms": 1000,
+    }
+    settings.update(overrides)
+    return AdaptiveBatcher(KafkaSettings(**settings))
+
+
+def test_batcher_disabled_keeps_static_batch_size():
+    batcher = _batcher(adaptive_batching=False)
+    batcher.observe(100, 100_000, 10.0, throttled=5)
+    assert batcher.max_records == 100
+
+
+def test_batcher_grows_additively_within_budget():
+    batcher = _batcher()
+    batcher.observe(100, 10_000, 0.1)
+    assert batcher.max_records == 110
+    batcher.observe(110, 11_000, 0.1)
+    assert batcher.max_records == 120
+
+
+def test_batcher_does_not_grow_on_partial_batches():
+    batcher = _batcher()
+    batcher.observe(40, 4_000, 0.1)
+    assert batcher.max_records == 100
+
+
+def test_batcher_halves_on_slow_bulk():
+    batcher = _batcher()
+    batcher.observe(100, 10_000, 1.5)
+    assert batcher.max_records == 50
+
+
+def test_batcher_halves_on_throttling():
+    batcher = _batcher()
+    batcher.observe(100, 10_000, 0.1, throttled=1)
+    assert batcher.max_records == 50
+
+
+def test_batcher_caps_by_target_bytes():
+    batcher = _batcher(batch_size=1000, target_batch_bytes=50_000)
+    batcher.observe(100, 100_000, 0.1)
+    assert batcher.max_records == 50
+
+    for _ in range(10):
+        batcher.observe(batcher.max_records, batcher.max_records * 1000, 0.1)
+    assert batcher.max_records == 50
+
+
+def test_batcher_respects_bounds():
+    batcher = _batcher(batch_size=20)
+    for _ in range(5):
+        batcher.observe(batcher.max_records, 1000, 5.0)
+    assert batcher.max_records == 10
+
+    batcher = _batcher(batch_size=995)
+    batcher.observe(995, 1000, 0.1)
+    assert batcher.max_records == 1000
+
+
+def test_batcher_exports_target():
+    batcher = _batcher()
+    batcher.observe(100, 10_000, 5.0)
+    assert batch_target_records._value.get() == 50
@@ -0,0 +1,65 @@
+"""
+test_build_bulk_body_splices_timestamp: timestamp is appended to every raw source
+test_build_bulk_body_handles_empty_object: no leading comma for empty objects
+test_build_bulk_body_overwrites_existing_timestamp: existing timestamp is replaced
+test_build_bulk_body_is_valid_ndjson: every line of the body is valid JSON
+test_is_json_object: shape check of raw values
+test_serializer_forwards_prebuilt_body: prebuilt buffers are not copied
+"""
+
+import json
+
+import pytest
+
+from ports.output.bulk_body import BulkBodySerializer, build_bulk_body, is_json_object
+
+ACTION = b'{"index":{"_index":"events"}}\n'
+
+
+def _lines(body: bytearray) -> list[dict]:
+    return [json.loads(line) for line in bytes(body).splitlines()]
+
+
+def test_build_bulk_body_splices_timestamp():
+    body = build_bulk_body([ACTION, ACTION], [b'{"a":1}', b'{"b":{"c":[1,2]}}'], 42)
+
+    assert bytes(body) == (
+        ACTION + b'{"a":1,"timestamp":42}\n' + ACTION + b'{"b":{"c":[1,2]},"timestamp":42}\n'
+    )
+
+
+@pytest.mark.parametrize("source", [b"{}", b"{ }", b"{\n}"])
+def test_build_bulk_body_handles_empty_object(source):
+    body = build_bulk_body([ACTION], [source], 42)
+    assert _lines(body)[1] == {"timestamp": 42}
+
+
+def test_build_bulk_body_overwrites_existing_timestamp():
+    body = build_bulk_body([ACTION], [b'{"timestamp": 1, "a": "x"}'], 42)
+    assert _lines(body)[1] == {"timestamp": 42, "a": "x"}
+
+
+def test_build_bulk_body_is_valid_ndjson():
+    sources = [json.dumps({"i": i, "s": "v" * i}).encode() for i in range(50)]
+    lines = _lines(build_bulk_body([ACTION] * len(sources), sources, 7))
+
+    assert len(lines) == 100
+    assert all(line == {"index": {"_index": "events"}} for line in lines[::2])
+    assert [line["i"] for line in lines[1::2]] == list(range(50))
+
+
+@pytest.mark.parametrize("value, expected", [
+    (b'{"a":1}', True),
+    (b' {"a":1}\n', True),
+    (b'[1,2]', False),
+    (b'"text"', False),
+    (b'', False),
+])
+def test_is_json_object(value, expected):
+    assert is_json_object(value) is expected
+
+
+def test_serializer_forwards_prebuilt_body():
+    body = bytearray(b'{"index":{}}\n{}\n')
+    assert BulkBodySerializer().dumps(body) is body
+    assert BulkBodySerializer().dumps([{"index": {}}, {}]) == b'{"index":{}}\n{}\n'
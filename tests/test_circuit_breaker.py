@@ -0,0 +1,314 @@
+"""
+test_breaker_opens_after_consecutive_failures: threshold consecutive failures open the circuit
+test_breaker_success_resets_failures: a success in between keeps the circuit closed
+test_breaker_half_open_lets_one_probe_through: an expired open circuit allows a single probe
+test_breaker_probe_result_closes_or_reopens: probe success closes, probe failure reopens
+test_breaker_disabled_with_zero_threshold: threshold 0 never opens
+test_breaker_exports_state: state is exported as a gauge
+test_bulk_insert_raises_when_circuit_opens: an unavailable cluster opens the circuit, nothing is dropped
+test_bulk_insert_holds_batch_before_circuit_opens: retries exhausted on a down cluster hold the batch
+test_bulk_insert_rejected_while_open: no request is sent while the circuit is open
+test_wait_until_available_probes_with_ping: the client pings until the cluster answers
+test_wait_until_available_waits_for_probe_in_flight: a half-open circuit is waited on, not polled
+test_consumer_holds_batch_while_circuit_open: the batch is indexed again once the circuit closes
+test_consumer_polls_paused_while_batch_held: a held batch keeps the consumer polling with its partitions paused
+test_held_batch_resends_only_unsettled_documents: documents settled before the circuit opened are not resent
+test_held_batch_dead_letters_after_hold_timeout: documents held past the timeout are failed
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from aiokafka import TopicPartition
+from elasticsearch import ConnectionError as ESConnectionError
+
+from config import ElasticSettings, KafkaSettings
+from metrics import circuit_breaker_state
+from ports.input.kafka_service import KafkaConsumerService
+from ports.output.circuit_breaker import CircuitBreaker, CircuitOpenError
+from ports.output.elastic_service import BulkResult, ElasticsearchClientService
+from services.event_service import HeldBatch
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    with patch("ports.output.elastic_service.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+        yield mock_sleep
+
+
+def _open(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(3, 30)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_in() <= 30
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker(2, 30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.closed
+
+
+def test_breaker_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(1, 0)
+    _open(breaker)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_probe_result_closes_or_reopens():
+    breaker = CircuitBreaker(1, 0)
+    _open(breaker)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.closed
+
+
+def test_breaker_disabled_with_zero_threshold():
+    breaker = CircuitBreaker(0, 30)
+    for _ in range(100):
+        breaker.record_failure()
+    assert breaker.closed
+
+
+def test_breaker_exports_state():
+    breaker = CircuitBreaker(1, 0)
+    assert circuit_breaker_state._value.get() == 0
+    _open(breaker)
+    assert circuit_breaker_state._value.get() == 2
+    breaker.allow()
+    assert circuit_breaker_state._value.get() == 1
+    breaker.record_success()
+    assert circuit_breaker_state._value.get() == 0
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_raises_when_circuit_opens():
+    service = ElasticsearchClientService(ElasticSettings(retry=5, breaker_failure_threshold=2))
+    service.dead_letters = MagicMock()
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.side_effect = ESConnectionError("down")
+        with pytest.raises(CircuitOpenError):
+            await service.bulk_insert([{"doc": "value"}])
+
+    assert mock_bulk.await_count == 2
+    assert not service.available
+    service.dead_letters.publish.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_holds_batch_before_circuit_opens():
+    service = ElasticsearchClientService(ElasticSettings(retry=3, breaker_failure_threshold=5))
+    service.dead_letters = MagicMock()
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.side_effect = ESConnectionError("down")
+        with pytest.raises(CircuitOpenError):
+            await service.bulk_insert([{"doc": "value"}])
+        assert service.available
+        with pytest.raises(CircuitOpenError):
+            await service.bulk_insert([{"doc": "value"}])
+
+    assert mock_bulk.await_count == 5
+    assert not service.available
+    service.dead_letters.publish.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_bulk_insert_rejected_while_open():
+    service = ElasticsearchClientService(ElasticSettings(breaker_failure_threshold=1, breaker_reset_timeout_s=60))
+    service.breaker.record_failure()
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        with pytest.raises(CircuitOpenError):
+            await service.bulk_insert([{"doc": "value"}])
+        mock_bulk.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_wait_until_available_probes_with_ping():
+    service = ElasticsearchClientService(ElasticSettings(breaker_failure_threshold=1, breaker_reset_timeout_s=0))
+    service.breaker.record_failure()
+
+    with patch.object(service.client, "ping", new_callable=AsyncMock) as mock_ping:
+        mock_ping.side_effect = [False, ESConnectionError("down"), True]
+        await service.wait_until_available()
+
+    assert mock_ping.await_count == 3
+    assert service.available
+
+
+@pytest.mark.asyncio
+async def test_wait_until_available_waits_for_probe_in_flight():
+    service = ElasticsearchClientService(ElasticSettings(breaker_failure_threshold=1, breaker_reset_timeout_s=0))
+    service.breaker.record_failure()
+    # A bulk request took the probe, the circuit is half-open until it settles
+    assert service.breaker.allow()
+
+    with patch.object(service.client, "ping", new_callable=AsyncMock) as mock_ping, \
+            patch.object(service.breaker, "allow", wraps=service.breaker.allow) as allow:
+        waiter = asyncio.create_task(service.wait_until_available())
+        # asyncio.sleep is patched in this module, the waiter gets the loop through asyncio.wait
+        done, _ = await asyncio.wait({waiter}, timeout=0.05)
+        assert not done
+        service.breaker.record_success()
+        await asyncio.wait_for(waiter, 1)
+
+    assert allow.call_count == 0
+    mock_ping.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+@patch("ports.input.kafka_service.AIOKafkaConsumer")
+async def test_consumer_holds_batch_while_circuit_open(mock_consumer_cls, mock_process):
+    tp = TopicPartition("test-topic", 0)
+    message = MagicMock()
+    message.serialized_value_size = 16
+    message.offset = 0
+    message.value = {"field": 0}
+
+    consumer_mock = AsyncMock()
+    consumer_mock.subscribe = MagicMock()
+    consumer_mock.getmany.side_effect = [{tp: [message]}, asyncio.CancelledError()]
+    mock_consumer_cls.return_value = consumer_mock
+
+    es_client = MagicMock()
+    es_client.settings = ElasticSettings()
+    es_client.wait_until_available = AsyncMock()
+    mock_process.side_effect = [CircuitOpenError("open"), None]
+
+    settings = KafkaSettings(bootstrap_servers="localhost:9092", consumer_topics="test-topic",
+                             consumer_group="test-group", lag_interval_s=0)
+    service = KafkaConsumerService(es_client, settings)
+
+    with pytest.raises(asyncio.CancelledError):
+        await service.start()
+
+    es_client.wait_until_available.assert_awaited_once()
+    assert mock_process.await_count == 2
+    consumer_mock.commit.assert_awaited_once()
+
+
+
+@pytest.mark.asyncio
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+@patch("ports.input.kafka_service.AIOKafkaConsumer")
+async def test_consumer_polls_paused_while_batch_held(mock_consumer_cls, mock_process):
+    tp = TopicPartition("test-topic", 0)
+    message = MagicMock()
+    message.serialized_value_size = 16
+    message.offset = 0
+    message.value = {"field": 0}
+    loop = asyncio.get_running_loop()
+    holding = False
+    held_polls = 0
+    polled = asyncio.Event()
+
+    async def getmany(**kwargs):
+        nonlocal held_polls
+        # asyncio.sleep is patched in this module, every poll yields the loop through a future
+        tick = loop.create_future()
+        loop.call_soon(tick.set_result, None)
+        await tick
+        if not holding:
+            if consumer_mock.commit.await_count:
+                raise asyncio.CancelledError()
+            return {tp: [message]}
+        held_polls += 1
+        if held_polls >= 3:
+            polled.set()
+        # A record fetched before the pause is sought back to
+        return {tp: [message]} if held_polls == 1 else {}
+
+    consumer_mock = AsyncMock()
+    consumer_mock.subscribe = MagicMock()
+    consumer_mock.getmany.side_effect = getmany
+    consumer_mock.assignment = MagicMock(return_value={tp})
+    consumer_mock.pause = MagicMock()
+    consumer_mock.resume = MagicMock()
+    consumer_mock.seek = MagicMock()
+    mock_consumer_cls.return_value = consumer_mock
+
+    async def wait_until_available(timeout=None):
+        nonlocal holding
+        holding = True
+        # Held across several poll intervals
+        await asyncio.wait_for(polled.wait(), 1)
+        holding = False
+        return True
+
+    es_client = MagicMock()
+    es_client.settings = ElasticSettings()
+    es_client.available = True
+    es_client.wait_until_available = wait_until_available
+    mock_process.side_effect = [CircuitOpenError("open"), None]
+
+    settings = KafkaSettings(bootstrap_servers="localhost:9092", consumer_topics="test-topic",
+                             consumer_group="test-group", timeout_ms=10,
+                             lag_interval_s=0)
+    service = KafkaConsumerService(es_client, settings)
+
+    with pytest.raises(asyncio.CancelledError):
+        await service.start()
+
+    assert held_polls >= 3
+    consumer_mock.pause.assert_called_with(tp)
+    consumer_mock.seek.assert_called_once_with(tp, 0)
+    consumer_mock.resume.assert_called_once_with(tp)
+    assert mock_process.await_count == 2
+    consumer_mock.commit.assert_awaited_once()
+    assert service._keep_alive is None
+
+@pytest.mark.asyncio
+async def test_held_batch_resends_only_unsettled_documents():
+    es_client = MagicMock()
+    es_client.settings = ElasticSettings()
+    es_client.wait_until_available = AsyncMock(return_value=True)
+    events = [{"doc": n} for n in range(4)]
+    held = HeldBatch(es_client, events, ["s0", "s1", "s2", "s3"])
+
+    settled = BulkResult()
+    settled.indexed = 2
+    assert await held.hold(CircuitOpenError("open", [1, 3], settled))
+    assert held.events == [{"doc": 1}, {"doc": 3}]
+    assert held.sources == ["s1", "s3"]
+
+    assert await held.hold(CircuitOpenError("open", [1]))
+    assert held.events == [{"doc": 3}]
+
+    resent = BulkResult()
+    resent.indexed = 1
+    result = held.settle(resent)
+    assert result.indexed == 3
+
+
+@pytest.mark.asyncio
+async def test_held_batch_dead_letters_after_hold_timeout():
+    service = ElasticsearchClientService(ElasticSettings(breaker_failure_threshold=1, hold_timeout_s=0.01))
+    service.breaker.record_failure()
+    events = [{"doc": n} for n in range(3)]
+    held = HeldBatch(service, events, ["s0", "s1", "s2"])
+
+    with patch.object(service, "fail", wraps=service.fail) as mock_fail:
+        assert not await held.hold(CircuitOpenError("open", [0, 2]))
+
+    mock_fail.assert_called_once_with([{"doc": 0}, {"doc": 2}], ["s0", "s2"], [0, 1], "hold_timeout")
+    assert held.result.failed == 2
+    assert held.events == []
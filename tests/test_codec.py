@@ -0,0 +1,70 @@
+"""
+test_codec_roundtrip: every installed codec decodes bytes and encodes compact bytes
+test_codec_uses_default_hook: unknown types go through the default hook
+test_codec_accepts_non_finite_literals: NaN and Infinity decode with every codec, as with the standard library
+test_default_codec_keeps_big_integers: the default codec decodes integers beyond 64 bits exactly
+test_get_codec_auto_prefers_fast_library: auto picks an installed fast codec
+test_get_codec_falls_back_to_stdlib: missing library falls back to json
+test_codec_serializer_uses_codec: Elasticsearch serializers delegate to the codec
+"""
+
+import math
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+
+import codec as codec_module
+from codec import CODECS, JsonCodec, get_codec
+from config import DeadLetterSettings, ElasticSettings, FileSettings, KafkaSettings
+from ports.output.bulk_body import BulkBodySerializer, CodecSerializer
+
+EVENT = {"message": "Привет", "level": "INFO", "values": [1, 2.5, None, True], "nested": {"k": "v"}}
+
+
+@pytest.mark.parametrize("name", sorted(CODECS))
+def test_codec_roundtrip(name):
+    codec = get_codec(name)
+    encoded = codec.dumps(EVENT)
+
+    assert isinstance(encoded, bytes)
+    assert b" " not in encoded.replace("Привет".encode(), b"")
+    assert codec.loads(encoded) == EVENT
+
+
+@pytest.mark.parametrize("name", sorted(CODECS))
+def test_codec_uses_default_hook(name):
+    encoded = get_codec(name).dumps({"day": date(2024, 1, 2)}, default=lambda value: value.isoformat())
+    assert JsonCodec().loads(encoded) == {"day": "2024-01-02"}
+
+
+@pytest.mark.parametrize("name", sorted(CODECS))
+def test_codec_accepts_non_finite_literals(name):
+    decoded = get_codec(name).loads(b'{"a": NaN, "b": Infinity, "c": -Infinity}')
+    assert math.isnan(decoded["a"])
+    assert decoded["b"] == math.inf and decoded["c"] == -math.inf
+
+
+@pytest.mark.parametrize("settings", [KafkaSettings, ElasticSettings, FileSettings, DeadLetterSettings])
+def test_default_codec_keeps_big_integers(settings):
+    codec = get_codec(settings.model_fields["codec"].default)
+    assert codec.loads(b'{"id": 123456789012345678901234567890}') == {"id": 123456789012345678901234567890}
+
+
+def test_get_codec_auto_prefers_fast_library():
+    expected = next((name for name in ("orjson", "msgspec") if name in CODECS), "json")
+    assert get_codec("auto").name == expected
+
+
+def test_get_codec_falls_back_to_stdlib(caplog):
+    with patch.dict(codec_module.CODECS, {"json": JsonCodec}, clear=True):
+        assert get_codec("orjson").name == "json"
+        assert get_codec("auto").name == "json"
+    assert "falling back to json" in caplog.text
+
+
+def test_codec_serializer_uses_codec():
+    codec = get_codec("json")
+    assert CodecSerializer(codec).dumps({"a": 1}) == b'{"a":1}'
+    assert CodecSerializer(codec).loads(b'{"a":1}') == {"a": 1}
+    assert BulkBodySerializer(codec).dumps([{"index": {}}, {"a": 1}]) == b'{"index":{}}\n{"a":1}\n'
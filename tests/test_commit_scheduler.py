@@ -0,0 +1,178 @@
+"""
+test_commit_scheduler_disabled_by_default: without an interval every batch is committed right away
+test_commit_scheduler_commits_on_batch_count: acknowledging commit_batches batches triggers a commit
+test_commit_scheduler_commits_on_interval: pending offsets are committed once the interval elapses
+test_commit_scheduler_keeps_offsets_of_failed_commit: a failed commit is retried with the newer offsets
+test_commit_scheduler_flushes_partitions: flushing revoked partitions leaves the others pending
+test_commit_scheduler_exports_commit_lag: records and age of uncommitted offsets are exported
+test_consumer_commits_in_background: batches are not committed one by one and the last offsets are committed on stop
+test_consumer_flushes_revoked_partitions: revocation commits the pending offsets of the revoked partitions
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from aiokafka import TopicPartition
+
+from config import KafkaSettings
+from metrics import commit_lag_records, commit_lag_seconds
+from ports.input.commit_scheduler import CommitScheduler
+from ports.input.kafka_service import KafkaConsumerService
+
+TP0 = TopicPartition("test-topic", 0)
+TP1 = TopicPartition("test-topic", 1)
+
+
+def _scheduler(**settings) -> CommitScheduler:
+    return CommitScheduler(KafkaSettings(**settings))
+
+
+async def _run(scheduler: CommitScheduler, commit: AsyncMock, seconds: float):
+    task = asyncio.create_task(scheduler.run(commit))
+    await asyncio.sleep(seconds)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_commit_scheduler_disabled_by_default():
+    assert not _scheduler().enabled
+    assert _scheduler(commit_interval_ms=100).enabled
+
+
+async def test_commit_scheduler_commits_on_batch_count():
+    scheduler = _scheduler(commit_interval_ms=60_000, commit_batches=3)
+    commit = AsyncMock()
+    task = asyncio.create_task(scheduler.run(commit))
+
+    scheduler.ack({TP0: 10})
+    scheduler.ack({TP0: 20})
+    await asyncio.sleep(0.01)
+    commit.assert_not_awaited()
+
+    scheduler.ack({TP0: 30, TP1: 5})
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    commit.assert_awaited_once_with({TP0: 30, TP1: 5})
+
+
+async def test_commit_scheduler_commits_on_interval():
+    scheduler = _scheduler(commit_interval_ms=20, commit_batches=100)
+    commit = AsyncMock()
+    scheduler.ack({TP0: 10})
+
+    await _run(scheduler, commit, 0.1)
+
+    commit.assert_awaited_once_with({TP0: 10})
+
+
+async def test_commit_scheduler_keeps_offsets_of_failed_commit():
+    scheduler = _scheduler(commit_interval_ms=20)
+    commit = AsyncMock(side_effect=[RuntimeError("coordinator not available"), None])
+    scheduler.ack({TP0: 10, TP1: 3})
+
+    task = asyncio.create_task(scheduler.run(commit))
+    await asyncio.sleep(0.03)
+    scheduler.ack({TP0: 15})
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert commit.await_args_list[1].args[0] == {TP0: 15, TP1: 3}
+
+
+async def test_commit_scheduler_flushes_partitions():
+    scheduler = _scheduler(commit_interval_ms=60_000)
+    commit = AsyncMock()
+    scheduler.ack({TP0: 10, TP1: 3})
+
+    await scheduler.flush(commit, {TP0})
+    commit.assert_awaited_once_with({TP0: 10})
+
+    await scheduler.flush(commit)
+    assert commit.await_args.args[0] == {TP1: 3}
+
+
+async def test_commit_scheduler_exports_commit_lag():
+    scheduler = _scheduler(commit_interval_ms=60_000)
+    commit = AsyncMock()
+    scheduler.ack({TP0: 10})
+    await scheduler.flush(commit)
+    assert commit_lag_seconds._value.get() == 0
+
+    scheduler.ack({TP0: 25})
+    await asyncio.sleep(0.02)
+    scheduler.ack({TP0: 40})
+
+    assert commit_lag_records._value.get() == 30
+    assert commit_lag_seconds._value.get() >= 0.02
+
+    await scheduler.flush(commit)
+    assert commit_lag_records._value.get() == 0
+    assert commit_lag_seconds._value.get() == 0
+
+
+def _consumer(batches: int) -> AsyncMock:
+    consumer = AsyncMock()
+    consumer.subscribe = MagicMock()
+    consumer.assignment = MagicMock(return_value={TP0})
+    offsets = iter(range(batches))
+
+    async def getmany(**kwargs):
+        offset = next(offsets, None)
+        if offset is None:
+            await asyncio.sleep(0.01)
+            return {}
+        message = MagicMock()
+        message.offset = offset
+        message.value = {"offset": offset}
+        message.serialized_value_size = 16
+        return {TP0: [message]}
+
+    consumer.getmany.side_effect = getmany
+    return consumer
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_consumer_commits_in_background(mock_process):
+    consumer = _consumer(5)
+    service = KafkaConsumerService(MagicMock(), KafkaSettings(
+        commit_interval_ms=60_000, commit_batches=100, timeout_ms=10, lag_interval_s=0))
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        task = asyncio.create_task(service.start())
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if mock_process.await_count == 5:
+                break
+        consumer.commit.assert_not_awaited()
+        service.stop()
+        await asyncio.wait_for(task, 1)
+
+    assert mock_process.await_count == 5
+    consumer.commit.assert_awaited_once()
+    (offsets,), _ = consumer.commit.await_args
+    assert offsets[TP0].offset == 5
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_consumer_flushes_revoked_partitions(mock_process):
+    consumer = _consumer(2)
+    service = KafkaConsumerService(MagicMock(), KafkaSettings(
+        commit_interval_ms=60_000, commit_batches=100, timeout_ms=10, lag_interval_s=0))
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        task = asyncio.create_task(service.start())
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if mock_process.await_count == 2:
+                break
+        await service.drain(consumer, {TP0})
+        (offsets,), _ = consumer.commit.await_args
+        assert offsets[TP0].offset == 2
+
+        service.stop()
+        await asyncio.wait_for(task, 1)
+
+    consumer.commit.assert_awaited_once()
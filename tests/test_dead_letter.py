@@ -0,0 +1,206 @@
+"""
+test_file_sink_writes_ndjson_with_metadata: records land in the file with their origin
+test_file_sink_rotates_by_size: the file is rotated once it exceeds max_bytes
+test_full_buffer_drops_instead_of_blocking: publish never blocks on a full buffer
+test_sink_failure_is_counted: a failing sink drops the batch without raising
+test_stop_keeps_records_taken_by_the_flusher: records being collected or written when stopping are not lost
+test_kafka_sink_keeps_value_and_sets_headers: original value with error metadata in headers
+test_kafka_sink_survives_unreachable_broker: a failed producer start logs dead letters and retries in the background
+test_stop_is_bounded_by_timeout: a hanging sink does not hang shutdown, its records are counted as dropped
+test_bulk_failure_goes_to_dead_letters: permanently failed documents are dead-lettered
+test_invalid_message_goes_to_dead_letters: malformed Kafka values are dead-lettered
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from aiokafka.structs import TopicPartition
+
+from config import DeadLetterSettings, ElasticSettings, KafkaSettings
+from metrics import dead_letters_dropped_total
+from ports.input.kafka_service import KafkaConsumerService
+from ports.output.dead_letter import DeadLetter, DeadLetterService
+from ports.output.elastic_service import ElasticsearchClientService
+
+SOURCE = SimpleNamespace(topic="events", partition=3, offset=42)
+
+
+@pytest.mark.asyncio
+async def test_file_sink_writes_ndjson_with_metadata(tmp_path):
+    path = tmp_path / "dlq.ndjson"
+    service = DeadLetterService(DeadLetterSettings(sink="file", path=str(path), codec="json"))
+    await service.start()
+    service.publish(DeadLetter(b'{"broken"', "invalid_message", "Expecting ':'", SOURCE))
+    service.publish(DeadLetter({"a": 1}, "mapper_parsing_exception", "failed to parse"))
+    await service.stop()
+
+    first, second = [json.loads(line) for line in path.read_text().splitlines()]
+    assert first["value"] == '{"broken"'
+    assert (first["topic"], first["partition"], first["offset"]) == ("events", 3, 42)
+    assert first["reason"] == "invalid_message"
+    assert second["value"] == {"a": 1}
+    assert second["error"] == "failed to parse"
+
+
+@pytest.mark.asyncio
+async def test_file_sink_rotates_by_size(tmp_path):
+    path = tmp_path / "dlq.ndjson"
+    settings = DeadLetterSettings(sink="file", path=str(path), max_bytes=200, backup_count=2, batch_size=1)
+    service = DeadLetterService(settings)
+    for i in range(6):
+        service.publish(DeadLetter({"i": i}, "test"))
+    await service.stop()
+
+    assert path.exists()
+    assert (tmp_path / "dlq.ndjson.1").exists()
+    assert (tmp_path / "dlq.ndjson.2").exists()
+    assert not (tmp_path / "dlq.ndjson.3").exists()
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_drops_instead_of_blocking():
+    service = DeadLetterService(DeadLetterSettings(buffer_size=2))
+    before = dead_letters_dropped_total._value.get()
+    for i in range(5):
+        service.publish(DeadLetter({"i": i}, "test"))
+    assert dead_letters_dropped_total._value.get() == before + 3
+
+
+@pytest.mark.asyncio
+async def test_sink_failure_is_counted():
+    service = DeadLetterService(DeadLetterSettings())
+    service.sink = MagicMock(write=AsyncMock(side_effect=OSError("disk full")), stop=AsyncMock())
+    before = dead_letters_dropped_total._value.get()
+    service.publish(DeadLetter({"a": 1}, "test"))
+    await service.stop()
+    assert dead_letters_dropped_total._value.get() == before + 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("published", [1, 2])
+async def test_stop_keeps_records_taken_by_the_flusher(published):
+    written = []
+
+    async def write(records):
+        await asyncio.sleep(0.05)
+        written.extend(record.value for record in records)
+
+    service = DeadLetterService(DeadLetterSettings(batch_size=2, flush_interval_ms=60000))
+    service.sink = MagicMock(write=AsyncMock(side_effect=write), start=AsyncMock(), stop=AsyncMock())
+    await service.start()
+    for i in range(published):
+        service.publish(DeadLetter({"i": i}, "test"))
+    await asyncio.sleep(0.01)
+    # A single record waits in the flusher for a full batch, a full batch is being written
+    assert service._queue.empty()
+    await service.stop()
+
+    assert written == [{"i": i} for i in range(published)]
+
+@pytest.mark.asyncio
+async def test_kafka_sink_keeps_value_and_sets_headers():
+    producer = MagicMock(start=AsyncMock(), stop=AsyncMock())
+    delivered = asyncio.get_running_loop().create_future()
+    delivered.set_result(None)
+    producer.send = AsyncMock(return_value=delivered)
+
+    with patch("ports.output.dead_letter.AIOKafkaProducer", return_value=producer):
+        service = DeadLetterService(DeadLetterSettings(sink="kafka", topic="dlq"), bootstrap_servers="kafka:9092")
+        await service.start()
+        service.publish(DeadLetter(b"raw", "invalid_message", "bad", SOURCE))
+        await service.stop()
+
+    (topic,), kwargs = producer.send.await_args
+    assert topic == "dlq"
+    assert kwargs["value"] == b"raw"
+    headers = dict(kwargs["headers"])
+    assert headers["dlq.topic"] == b"events"
+    assert headers["dlq.offset"] == b"42"
+    assert headers["dlq.reason"] == b"invalid_message"
+
+
+
+@pytest.mark.asyncio
+async def test_kafka_sink_survives_unreachable_broker():
+    unreachable = MagicMock(start=AsyncMock(side_effect=ConnectionError("no brokers")), stop=AsyncMock())
+    producer = MagicMock(start=AsyncMock(), stop=AsyncMock())
+    delivered = asyncio.get_running_loop().create_future()
+    delivered.set_result(None)
+    producer.send = AsyncMock(return_value=delivered)
+    settings = DeadLetterSettings(sink="kafka", flush_interval_ms=0, connect_backoff_ms=10)
+
+    with patch("ports.output.dead_letter.AIOKafkaProducer", side_effect=[unreachable, unreachable, producer]):
+        service = DeadLetterService(settings, bootstrap_servers="kafka:9092")
+        before = dead_letters_dropped_total._value.get()
+        await service.start()
+        service.publish(DeadLetter({"a": 1}, "test"))
+        await asyncio.wait_for(service.sink._connecting, 1)
+        service.publish(DeadLetter({"b": 2}, "test"))
+        await service.stop()
+
+    assert dead_letters_dropped_total._value.get() == before + 1
+    assert unreachable.start.await_count == 2
+    (_,), kwargs = producer.send.await_args
+    assert json.loads(kwargs["value"]) == {"b": 2}
+    producer.stop.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_stop_is_bounded_by_timeout():
+    async def hang(*args):
+        await asyncio.Event().wait()
+
+    service = DeadLetterService(DeadLetterSettings(stop_timeout_s=0.05))
+    service.sink = MagicMock(write=AsyncMock(side_effect=hang), stop=AsyncMock(side_effect=hang))
+    before = dead_letters_dropped_total._value.get()
+    for i in range(3):
+        service.publish(DeadLetter({"i": i}, "test"))
+    await asyncio.wait_for(service.stop(), 1)
+
+    assert dead_letters_dropped_total._value.get() == before + 3
+
+@pytest.mark.asyncio
+async def test_bulk_failure_goes_to_dead_letters():
+    dead_letters = MagicMock()
+    service = ElasticsearchClientService(ElasticSettings(), dead_letters=dead_letters)
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.return_value = {"errors": True, "items": [
+            {"index": {"status": 201}},
+            {"index": {"status": 400, "error": {"type": "mapper_parsing_exception", "reason": "bad field"}}},
+        ]}
+        await service.bulk_insert([{"a": 1}, {"b": 2}], sources=[None, SOURCE])
+
+    (record,), _ = dead_letters.publish.call_args
+    assert record.value == {"b": 2}
+    assert record.reason == "mapper_parsing_exception"
+    assert record.error == "bad field"
+    assert (record.topic, record.offset) == ("events", 42)
+
+
+@pytest.mark.asyncio
+async def test_invalid_message_goes_to_dead_letters():
+    tp = TopicPartition("events", 0)
+    messages = []
+    for offset, value in enumerate([b'{"a":1}', b'{"broken"', b'[1, 2]']):
+        messages.append(MagicMock(topic="events", partition=0, offset=offset, value=value,
+                                  serialized_value_size=len(value)))
+    consumer_mock = AsyncMock()
+    consumer_mock.getmany.side_effect = [{tp: messages}, asyncio.CancelledError()]
+    dead_letters = MagicMock()
+
+    consumer_mock.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
+        with patch("ports.input.kafka_service.process_events", new_callable=AsyncMock) as process_events_mock:
+            service = KafkaConsumerService(MagicMock(), KafkaSettings(), dead_letters=dead_letters)
+            with pytest.raises(asyncio.CancelledError):
+                await service.start()
+
+    (_, events), kwargs = process_events_mock.await_args
+    assert [event["a"] for event in events] == [1]
+    assert kwargs["sources"] == [messages[0]]
+    rejected = [call.args[0] for call in dead_letters.publish.call_args_list]
+    assert [(record.offset, record.reason) for record in rejected] == [(1, "invalid_message"), (2, "invalid_message")]
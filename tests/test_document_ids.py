@@ -0,0 +1,108 @@
+"""
+test_offset_strategy_uses_record_coordinates: topic-partition-offset composite
+test_hash_strategy_is_stable_and_field_sensitive: same fields give the same id
+test_hash_strategy_decodes_raw_sources: raw bytes hash like the decoded event
+test_hash_strategy_is_codec_independent: every codec gives the same id for the same values
+test_field_strategy_uses_value_as_is: id taken from the event field
+test_op_type_follows_strategy: create for replay-safe ids, index otherwise
+test_fields_required: hash and field strategies need ELASTIC_ID_FIELDS
+test_bulk_actions_carry_ids: action lines contain `_id` and the op type
+test_conflict_on_create_is_a_duplicate: 409 on create is not a failure
+"""
+
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from codec import CODECS, get_codec
+from config import ElasticSettings
+from ports.output.document_ids import DocumentIds
+from ports.output.elastic_service import ElasticsearchClientService
+
+CODEC = get_codec("json")
+SOURCE = SimpleNamespace(topic="events", partition=2, offset=17)
+
+
+def _ids(**settings) -> DocumentIds:
+    return DocumentIds(ElasticSettings(**settings), CODEC)
+
+
+def test_offset_strategy_uses_record_coordinates():
+    ids = _ids(id_strategy="offset")
+    assert ids.document_id({"a": 1}, SOURCE) == "events-2-17"
+    assert ids.document_id({"a": 1}) is None
+
+
+def test_hash_strategy_is_stable_and_field_sensitive():
+    ids = _ids(id_strategy="hash", id_fields="user, seq")
+    first = ids.document_id({"user": "u1", "seq": 1, "noise": 1})
+    assert first == ids.document_id({"user": "u1", "seq": 1, "noise": 2})
+    assert first != ids.document_id({"user": "u1", "seq": 2})
+
+
+def test_hash_strategy_decodes_raw_sources():
+    ids = _ids(id_strategy="hash", id_fields="user")
+    assert ids.document_id(b'{"user": "u1"}') == ids.document_id({"user": "u1"})
+
+
+@pytest.mark.parametrize("codec", sorted(CODECS))
+def test_hash_strategy_is_codec_independent(codec):
+    event = {"user": "ü1", "amount": 1e16, "tags": {"b": 1, "a": [1.5, None]}}
+    expected = _ids(id_strategy="hash", id_fields="user, amount, tags").document_id(event)
+    ids = DocumentIds(ElasticSettings(id_strategy="hash", id_fields="user, amount, tags"), get_codec(codec))
+    assert ids.document_id(event) == expected
+    assert ids.document_id(get_codec(codec).dumps(event)) == expected
+    assert ids.document_id({"user": "ü1", "amount": 1e16, "tags": {"a": [1.5, None], "b": 1}}) == expected
+
+
+def test_field_strategy_uses_value_as_is():
+    ids = _ids(id_strategy="field", id_fields="event_id")
+    assert ids.document_id({"event_id": 123}) == "123"
+    assert ids.document_id({"other": 1}) is None
+
+
+@pytest.mark.parametrize("strategy, op_type, expected", [
+    ("none", "auto", "index"),
+    ("offset", "auto", "create"),
+    ("hash", "auto", "create"),
+    ("field", "auto", "index"),
+    ("offset", "index", "index"),
+])
+def test_op_type_follows_strategy(strategy, op_type, expected):
+    assert _ids(id_strategy=strategy, id_fields="f", op_type=op_type).op_type == expected
+
+
+@pytest.mark.parametrize("strategy", ["hash", "field"])
+def test_fields_required(strategy):
+    with pytest.raises(ValueError):
+        _ids(id_strategy=strategy)
+
+
+@pytest.mark.asyncio
+async def test_bulk_actions_carry_ids():
+    service = ElasticsearchClientService(ElasticSettings(index="events", id_strategy="offset"))
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.return_value = {"errors": False}
+        await service.bulk_insert([{"a": 1}], sources=[SOURCE])
+
+    action = bytes(mock_bulk.await_args.kwargs["operations"]).splitlines()[0]
+    assert CODEC.loads(action) == {"create": {"_index": "events", "_id": "events-2-17"}}
+
+
+@pytest.mark.asyncio
+async def test_conflict_on_create_is_a_duplicate():
+    service = ElasticsearchClientService(ElasticSettings(id_strategy="offset"))
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.return_value = {"errors": True, "items": [
+            {"create": {"status": 201}},
+            {"create": {"status": 409, "error": {"type": "version_conflict_engine_exception"}}},
+        ]}
+        result = await service.bulk_insert([{"a": 1}, {"a": 2}], sources=[SOURCE, SOURCE])
+
+    mock_bulk.assert_awaited_once()
+    assert result.indexed == 1
+    assert result.duplicates == 1
+    assert result.failed == 0
@@ -1,17 +1,52 @@
 """
 test_bulk_insert_success: All events inserted successfully
 test_bulk_insert_empty_events: No events to insert
-test_bulk_insert_partial_fail_then_success: At first attempt some events failed - repeat
+test_bulk_insert_partial_fail_then_success: Only the failed events are resent
+test_bulk_insert_mapping_error_not_retried: Non-retryable item errors fail at once
 test_bulk_insert_exceeds_retries_logs_error: All attempts failed - errors are logged
+test_bulk_insert_transport_error_counts_attempts: Connection errors consume attempts
+test_bulk_insert_retryable_request_error: Whole-request 429 is retried, 400 is not
+test_bulk_insert_backoff_grows_exponentially: Retry delays grow with jitter and a cap
+test_bulk_insert_counts_failure_reasons: Failures are counted per reason
+test_bulk_insert_sends_one_request_per_attempt: The transport does not retry on its own
+test_client_uses_all_configured_nodes: Comma-separated URL becomes a node pool
+test_client_pool_sized_to_in_flight: Connections per node follow the in-flight bulk count
+test_client_pool_check_warns_when_too_small: More concurrent bulks than connections are reported
+test_client_sniff_interval: Periodic sniffing is off by default and keeps a valid sniffing delay
+test_node_latency_is_recorded_per_node: Request latency and errors are labelled by node
 test_connect_success: Connection to ES is successful
 test_connect_failure: Connection to ES is unsuccessful
 """
 
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from aiohttp import web
+from elasticsearch import ApiError, ConnectionError as ESConnectionError
 
 from config import ElasticSettings
+from metrics import bulk_item_errors_total, es_node_errors_total, es_node_request_time_metric
+from ports.output.circuit_breaker import CircuitOpenError
 from ports.output.elastic_service import ElasticsearchClientService
+from ports.output.instrumented_node import InstrumentedNode
+
+
+def _sources(mock_bulk) -> list[bytes]:
+    """ Document lines of every bulk request sent """
+    return [
+        bytes(call.kwargs["operations"]).splitlines()[1::2]
+        for call in mock_bulk.await_args_list
+    ]
+
+
+def _api_error(status: int) -> ApiError:
+    return ApiError("error", meta=MagicMock(status=status), body={})
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    with patch("ports.output.elastic_service.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+        yield mock_sleep
 
 
 @pytest.mark.asyncio
@@ -19,18 +54,19 @@ async def test_bulk_insert_success():
     service = ElasticsearchClientService(ElasticSettings())
     events = [{"doc": "value"}]
 
-    with patch("ports.output.elastic_service.helpers.async_bulk", new_callable=AsyncMock) as mock_bulk:
-        mock_bulk.return_value = (1, [])
-        await service.bulk_insert(events)
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.return_value = {"errors": False}
+        result = await service.bulk_insert(events)
         mock_bulk.assert_awaited_once()
-        args, _ = mock_bulk.await_args
-        assert args[1][0]["_source"] == {"doc": "value"}
+        assert _sources(mock_bulk) == [[b'{"doc":"value"}']]
+        assert result.indexed == 1
+        assert result.failed == 0
 
 
 @pytest.mark.asyncio
 async def test_bulk_insert_empty_events():
     service = ElasticsearchClientService(ElasticSettings())
-    with patch("ports.output.elastic_service.helpers.async_bulk", new_callable=AsyncMock) as mock_bulk:
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
         await service.bulk_insert([])
         mock_bulk.assert_not_awaited()
 
@@ -38,21 +74,41 @@ async def test_bulk_insert_empty_events():
 @pytest.mark.asyncio
 async def test_bulk_insert_partial_fail_then_success():
     service = ElasticsearchClientService(ElasticSettings())
-    events = [{"doc": f"value{i}"} for i in range(2)]
-
-    failed_items = [
-        {"index": {"status": 500}},
-        {"index": {"status": 201}},  # one succeeds
-    ]
+    events = [{"doc": f"value{i}"} for i in range(3)]
 
-    with patch("ports.output.elastic_service.helpers.async_bulk", new_callable=AsyncMock) as mock_bulk:
-        # 1st call fails one doc, 2nd succeeds
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        # 1st call fails the last doc, 2nd succeeds
         mock_bulk.side_effect = [
-            (1, failed_items),
-            (1, []),
+            {"errors": True, "items": [
+                {"index": {"status": 201}},
+                {"index": {"status": 201}},
+                {"index": {"status": 503, "error": {"type": "unavailable_shards_exception"}}},
+            ]},
+            {"errors": False},
         ]
-        await service.bulk_insert(events)
+        result = await service.bulk_insert(events)
         assert mock_bulk.await_count == 2
+        assert _sources(mock_bulk)[1] == [b'{"doc":"value2"}']
+        assert result.indexed == 3
+        assert result.retried == 1
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_mapping_error_not_retried(caplog):
+    service = ElasticsearchClientService(ElasticSettings())
+    events = [{"doc": "bad"}, {"doc": "good"}]
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.return_value = {"errors": True, "items": [
+            {"index": {"status": 400, "error": {"type": "document_parsing_exception"}}},
+            {"index": {"status": 201}},
+        ]}
+        result = await service.bulk_insert(events)
+
+        mock_bulk.assert_awaited_once()
+        assert result.failed == 1
+        assert result.indexed == 1
+        assert "document_parsing_exception" in caplog.text
 
 
 @pytest.mark.asyncio
@@ -60,17 +116,105 @@ async def test_bulk_insert_exceeds_retries_logs_error(caplog):
     service = ElasticsearchClientService(ElasticSettings(retry=2))
     events = [{"doc": "value"}]
 
-    failed_items = [{"index": {"status": 500}}]
-
-    with patch("ports.output.elastic_service.helpers.async_bulk", new_callable=AsyncMock) as mock_bulk:
-        mock_bulk.return_value = (0, failed_items)
-        await service.bulk_insert(events)
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.return_value = {"errors": True, "items": [{"index": {"status": 429}}]}
+        result = await service.bulk_insert(events)
 
         assert "Could not insert" in caplog.text
         assert "Failed document" in caplog.text
         assert mock_bulk.await_count == 2
+        assert result.throttled == 2
+        assert result.failed == 1
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_transport_error_counts_attempts():
+    service = ElasticsearchClientService(ElasticSettings(retry=3, breaker_failure_threshold=0))
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.side_effect = ESConnectionError("down")
+        result = await service.bulk_insert([{"doc": "value"}])
+
+        assert mock_bulk.await_count == 3
+        assert result.attempts == 3
+        assert result.failed == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status, expected_calls, throttled", [(429, 2, 1), (400, 1, 0)])
+async def test_bulk_insert_retryable_request_error(status, expected_calls, throttled):
+    service = ElasticsearchClientService(ElasticSettings())
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.side_effect = [_api_error(status), {"errors": False}]
+        result = await service.bulk_insert([{"doc": "value"}])
+
+        assert mock_bulk.await_count == expected_calls
+        assert result.throttled == throttled
 
 
+@pytest.mark.asyncio
+async def test_bulk_insert_backoff_grows_exponentially(no_sleep):
+    settings = ElasticSettings(retry=5, retry_backoff_ms=100, retry_backoff_max_ms=300,
+                               breaker_failure_threshold=0)
+    service = ElasticsearchClientService(settings)
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk, \
+            patch("backoff.random.uniform", side_effect=lambda low, high: high):
+        mock_bulk.side_effect = ESConnectionError("down")
+        await service.bulk_insert([{"doc": "value"}])
+
+    assert [call.args[0] for call in no_sleep.await_args_list] == [0.1, 0.2, 0.3, 0.3]
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_counts_failure_reasons():
+    service = ElasticsearchClientService(ElasticSettings(retry=1))
+    dropped = bulk_item_errors_total.labels(reason="mapper_parsing_exception", action="dropped")
+    retried = bulk_item_errors_total.labels(reason="es_rejected_execution_exception", action="retried")
+    dropped_before, retried_before = dropped._value.get(), retried._value.get()
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.return_value = {"errors": True, "items": [
+            {"index": {"status": 400, "error": {"type": "mapper_parsing_exception"}}},
+            {"index": {"status": 429, "error": {"type": "es_rejected_execution_exception"}}},
+        ]}
+        await service.bulk_insert([{"a": 1}, {"b": 2}])
+
+    assert dropped._value.get() == dropped_before + 1
+    assert retried._value.get() == retried_before + 1
+
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_sends_one_request_per_attempt():
+    requests = []
+
+    async def bulk(request: web.Request) -> web.Response:
+        requests.append(request.path)
+        return web.json_response({"error": "throttled", "status": 429}, status=429,
+                                 headers={"X-Elastic-Product": "Elasticsearch"})
+
+    app = web.Application()
+    app.router.add_route("*", "/_bulk", bulk)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    service = ElasticsearchClientService(ElasticSettings(url=f"http://127.0.0.1:{port}", retry=2))
+    try:
+        try:
+            result = await service.bulk_insert([{"doc": 1}])
+        except CircuitOpenError as e:
+            result = e.result
+    finally:
+        await service.client.close()
+        await runner.cleanup()
+
+    assert len(requests) == 2
+    assert result.attempts == 2
+
 @pytest.mark.asyncio
 async def test_connect_success():
     service = ElasticsearchClientService(ElasticSettings())
@@ -82,9 +226,93 @@ async def test_connect_success():
 
 @pytest.mark.asyncio
 async def test_connect_failure():
-    service = ElasticsearchClientService(ElasticSettings())
+    service = ElasticsearchClientService(ElasticSettings(connect_backoff_ms=1))
 
     with patch.object(service.client, "ping", new_callable=AsyncMock) as mock_ping:
         mock_ping.return_value = False
         with pytest.raises(ConnectionError):
             await service.connect()
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_raw_sends_prebuilt_body():
+    service = ElasticsearchClientService(ElasticSettings(index="events"))
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.return_value = {"errors": False}
+        await service.bulk_insert([b'{"a":1}', b'{"b":2}'])
+
+        mock_bulk.assert_awaited_once()
+        _, kwargs = mock_bulk.await_args
+        lines = bytes(kwargs["operations"]).splitlines()
+        assert lines[0] == b'{"index":{"_index":"events"}}'
+        assert lines[1].startswith(b'{"a":1,"timestamp":')
+        assert kwargs["filter_path"] == "errors,items.*.status,items.*.error"
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_raw_retries_only_failed_sources():
+    service = ElasticsearchClientService(ElasticSettings())
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk, \
+            patch("ports.output.elastic_service.asyncio.sleep", new_callable=AsyncMock):
+        mock_bulk.side_effect = [
+            {"errors": True, "items": [{"index": {"status": 201}}, {"index": {"status": 503}}]},
+            {"errors": False},
+        ]
+        await service.bulk_insert([b'{"a":1}', b'{"b":2}'])
+
+        assert mock_bulk.await_count == 2
+        _, kwargs = mock_bulk.await_args
+        lines = bytes(kwargs["operations"]).splitlines()
+        assert len(lines) == 2
+        assert lines[1].startswith(b'{"b":2,')
+
+
+def test_client_uses_all_configured_nodes():
+    service = ElasticsearchClientService(ElasticSettings(url="http://es-1:9200, http://es-2:9200", http_compress=True))
+    nodes = service.client.transport.node_pool.all()
+
+    assert sorted(node.base_url for node in nodes) == ["http://es-1:9200", "http://es-2:9200"]
+    assert all(isinstance(node, InstrumentedNode) for node in nodes)
+    assert all(node.config.http_compress for node in nodes)
+
+
+@pytest.mark.parametrize("configured, in_flight, expected", [(0, 4, 5), (0, 1, 2), (16, 4, 16)])
+def test_client_pool_sized_to_in_flight(configured, in_flight, expected):
+    service = ElasticsearchClientService(ElasticSettings(connections_per_node=configured), in_flight=in_flight)
+    node = service.client.transport.node_pool.all()[0]
+    assert node.config.connections_per_node == expected
+
+
+@pytest.mark.parametrize("in_flight, warned", [(4, False), (5, True)])
+def test_client_pool_check_warns_when_too_small(caplog, in_flight, warned):
+    service = ElasticsearchClientService(ElasticSettings(), in_flight=4)
+    service.check_pool(in_flight)
+    assert ("ELASTIC_CONNECTIONS_PER_NODE" in caplog.text) is warned
+
+
+@pytest.mark.parametrize("interval, before_requests, delay", [(0, False, 10.0), (30, True, 30)])
+def test_client_sniff_interval(interval, before_requests, delay):
+    service = ElasticsearchClientService(ElasticSettings(sniff_interval_s=interval))
+    transport = service.client.transport
+    assert transport._sniff_before_requests is before_requests
+    assert transport._min_delay_between_sniffing == delay
+
+
+@pytest.mark.asyncio
+async def test_node_latency_is_recorded_per_node():
+    service = ElasticsearchClientService(ElasticSettings(url="http://es-latency:9200"))
+    node = service.client.transport.node_pool.all()[0]
+    histogram = es_node_request_time_metric.labels(node="http://es-latency:9200")
+    errors = es_node_errors_total.labels(node="http://es-latency:9200")
+
+    with patch("elastic_transport.AiohttpHttpNode.perform_request", new_callable=AsyncMock) as perform:
+        await node.perform_request("POST", "/_bulk")
+        perform.side_effect = OSError("reset")
+        with pytest.raises(OSError):
+            await node.perform_request("POST", "/_bulk")
+
+    assert histogram._sum.get() > 0
+    assert sum(bucket.get() for bucket in histogram._buckets) == 2
+    assert errors._value.get() == 1
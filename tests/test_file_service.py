@@ -0,0 +1,200 @@
+"""
+test_mapped_lines: lines are views of the mapped file with their offsets, a resumed read starts at its offset
+test_stream_lines_across_chunks: lines split over chunk boundaries are joined, skipped lines are not yielded
+test_open_lines_decompresses: gzip and zstd input is recognized by its magic bytes
+test_loader_indexes_files: lines are decoded, transformed and bulk-indexed, invalid ones are dead-lettered
+test_loader_resumes_from_checkpoint: a stopped load saves its acknowledged offset and the next run loads the rest
+test_loader_checkpoint_waits_for_earlier_batches: a batch acknowledged early does not move the checkpoint
+test_loader_restarts_past_end: a checkpoint past the end of a replaced file loads it from the start
+test_loader_names_sources_by_path: files sharing a name in different directories get distinct sources
+test_loader_stdin_needs_source_name: stdin is only read under the configured source name
+test_loader_settings: the command line overrides the file settings
+"""
+
+import asyncio
+import gzip
+import importlib.util
+import io
+import json
+import os
+import time
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from config import FileSettings
+from domain.transform import compile_transform
+from ports.input.file_service import FileCheckpoint, FileLoaderService, mapped_lines, open_lines, stream_lines
+
+LINES = [b'{"id": 1}', b'{"id": 2}', b"", b'{"id": 3}']
+
+
+def _write(path: Path, lines: list[bytes], newline: bool = True) -> Path:
+    path.write_bytes(b"\n".join(lines) + (b"\n" if newline else b""))
+    return path
+
+
+def _collect(lines) -> list[tuple[int, int, bytes]]:
+    return [(offset, end, bytes(line)) for offset, end, line in lines]
+
+
+def _indexed(mock_process: AsyncMock) -> list:
+    return [event["id"] for call in mock_process.await_args_list for event in call.args[1]]
+
+
+def test_mapped_lines(tmp_path):
+    path = _write(tmp_path / "events.ndjson", LINES, newline=False)
+
+    lines = list(mapped_lines(str(path)))
+
+    assert all(isinstance(line, memoryview) for _, _, line in lines)
+    assert _collect(lines) == [(0, 10, b'{"id": 1}'), (10, 20, b'{"id": 2}'), (20, 21, b""), (21, 30, b'{"id": 3}')]
+    assert _collect(mapped_lines(str(path), 20)) == [(20, 21, b""), (21, 30, b'{"id": 3}')]
+    assert list(mapped_lines(str(path), 30)) == []
+    del lines
+
+
+def test_stream_lines_across_chunks(tmp_path):
+    path = _write(tmp_path / "events.ndjson", LINES)
+    expected = _collect(mapped_lines(str(path)))
+
+    assert _collect(stream_lines(io.BytesIO(path.read_bytes()), read_size=4)) == expected
+    assert _collect(stream_lines(io.BytesIO(path.read_bytes()), start=10, read_size=7)) == expected[1:]
+    assert _collect(stream_lines(io.BytesIO(b'{"id": 1}\n{"id": 2}'))) == [(0, 10, b'{"id": 1}'), (10, 19, b'{"id": 2}')]
+
+
+def test_open_lines_decompresses(tmp_path):
+    plain = _write(tmp_path / "events.ndjson", LINES)
+    compressed = tmp_path / "events.ndjson.gz"
+    compressed.write_bytes(gzip.compress(plain.read_bytes()))
+    expected = _collect(open_lines(str(plain)))
+
+    assert _collect(open_lines(str(compressed), read_size=8)) == expected
+
+    zstandard = pytest.importorskip("zstandard")
+    compressed = tmp_path / "events.ndjson.zst"
+    compressed.write_bytes(zstandard.ZstdCompressor().compress(plain.read_bytes()))
+    assert _collect(open_lines(str(compressed))) == expected
+
+
+@patch("ports.input.file_service.process_events", new_callable=AsyncMock)
+async def test_loader_indexes_files(mock_process, tmp_path):
+    first = _write(tmp_path / "first.ndjson", [b'{"id": %d}' % number for number in range(10)])
+    second = _write(tmp_path / "second.ndjson", [b'{"id": 10}', b"not json", b"[1]", b'{"id": 11, "drop": true}'])
+    dead_letters = MagicMock()
+    transform = compile_transform({"drop_if": [{"field": "drop", "equals": True}]})
+    checkpoint = FileCheckpoint(str(tmp_path / "checkpoint.json"))
+    loader = FileLoaderService(MagicMock(), FileSettings(batch_size=3, max_in_flight=2), dead_letters=dead_letters,
+                               transform=transform, checkpoint=checkpoint)
+
+    assert await loader.load([str(first), str(second)])
+
+    assert sorted(_indexed(mock_process)) == list(range(11))
+    sources = mock_process.await_args_list[-1].kwargs["sources"]
+    assert (sources[0].topic, sources[0].partition, sources[0].offset) == (os.path.realpath(second), 0, 0)
+    rejected = [call.args[0] for call in dead_letters.publish.call_args_list]
+    assert [(record.value, record.topic, record.offset) for record in rejected] == [
+        (b"not json", os.path.realpath(second), 11), (b"[1]", os.path.realpath(second), 20)]
+    saved = json.loads(Path(checkpoint.path).read_text())
+    assert saved[str(first)]["complete"] and saved[str(second)]["complete"]
+    assert saved[str(first)]["offset"] == first.stat().st_size
+
+
+async def test_loader_resumes_from_checkpoint(tmp_path):
+    path = _write(tmp_path / "events.ndjson", [b'{"id": %d}' % number for number in range(20)])
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    settings = FileSettings(batch_size=5, max_in_flight=1, codec="json")
+    loader = FileLoaderService(MagicMock(), settings, checkpoint=FileCheckpoint(checkpoint_path))
+
+    async def stop_after_first(elastic_client, events, sources=None):
+        loader.stop()
+
+    with patch("ports.input.file_service.process_events", side_effect=stop_after_first) as mock_process:
+        assert not await loader.load([str(path)])
+    # The batch read while the first one was indexed is still indexed, nothing after it
+    indexed = _indexed(mock_process)
+    assert indexed in (list(range(5)), list(range(10)))
+    assert FileCheckpoint(checkpoint_path).files[str(path)] == {
+        "offset": len(indexed) * 10, "complete": False, "updated_at": pytest.approx(time.time(), abs=5)}
+
+    resumed = FileLoaderService(MagicMock(), settings, checkpoint=FileCheckpoint(checkpoint_path))
+    with patch("ports.input.file_service.process_events", new_callable=AsyncMock) as mock_process:
+        assert await resumed.load([str(path)])
+        assert _indexed(mock_process) == list(range(len(indexed), 20))
+        calls = mock_process.await_count
+        assert await resumed.load([str(path)])
+        assert mock_process.await_count == calls
+
+
+async def test_loader_checkpoint_waits_for_earlier_batches(tmp_path):
+    path = _write(tmp_path / "events.ndjson", [b'{"id": %d}' % number for number in range(4)])
+    checkpoint = FileCheckpoint(str(tmp_path / "checkpoint.json"))
+    loader = FileLoaderService(
+        MagicMock(), FileSettings(batch_size=2, max_in_flight=2, checkpoint_interval_s=0), checkpoint=checkpoint)
+    saved = []
+    checkpoint.save = lambda key, offset, complete=False: saved.append((offset, complete))
+
+    async def slow_first(elastic_client, events, sources=None):
+        await asyncio.sleep(0.05 if events[0]["id"] == 0 else 0)
+
+    with patch("ports.input.file_service.process_events", side_effect=slow_first):
+        assert await loader.load([str(path)])
+
+    assert saved == [(40, False), (40, True)]
+
+
+async def test_loader_restarts_past_end(tmp_path):
+    path = _write(tmp_path / "events.ndjson", [b'{"id": 1}'])
+    checkpoint = FileCheckpoint(str(tmp_path / "checkpoint.json"))
+    checkpoint.save(str(path), 500)
+    loader = FileLoaderService(MagicMock(), FileSettings(), checkpoint=checkpoint)
+
+    with patch("ports.input.file_service.process_events", new_callable=AsyncMock) as mock_process:
+        assert await loader.load([str(path)])
+
+    assert _indexed(mock_process) == [1]
+    assert checkpoint.files[str(path)]["offset"] == 10
+
+
+async def test_loader_names_sources_by_path(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    paths = [str(_write(tmp_path / folder / "events.ndjson", [b'{"id": 1}'])) for folder in ("a", "b")]
+    loader = FileLoaderService(MagicMock(), FileSettings())
+
+    with patch("ports.input.file_service.process_events", new_callable=AsyncMock) as mock_process:
+        assert await loader.load(paths)
+
+    topics = [call.kwargs["sources"][0].topic for call in mock_process.await_args_list]
+    assert topics == [os.path.realpath(path) for path in paths]
+
+
+async def test_loader_stdin_needs_source_name():
+    stdin = MagicMock(buffer=io.BufferedReader(io.BytesIO(b'{"id": 1}\n')))
+
+    with pytest.raises(ValueError):
+        await FileLoaderService(MagicMock(), FileSettings()).load(["-"])
+
+    loader = FileLoaderService(MagicMock(), FileSettings(stdin_source="export-2024"))
+    with patch("ports.input.file_service.sys.stdin", stdin), \
+            patch("ports.input.file_service.process_events", new_callable=AsyncMock) as mock_process:
+        assert await loader.load(["-"])
+
+    sources = mock_process.await_args.kwargs["sources"]
+    assert (sources[0].topic, sources[0].offset) == ("export-2024", 0)
+
+
+def test_loader_settings():
+    spec = importlib.util.spec_from_file_location(
+        "file_loader", Path(__file__).resolve().parent.parent / "file-loader.py")
+    file_loader = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(file_loader)
+
+    args = file_loader.parse_args(
+        ["a.ndjson", "-", "--in-flight", "16", "--checkpoint", "load.json", "--stdin-source", "export"])
+    settings = file_loader.loader_settings(args, FileSettings(batch_size=1000))
+
+    assert args.paths == ["a.ndjson", "-"]
+    assert (settings.batch_size, settings.max_in_flight, settings.checkpoint_path) == (1000, 16, "load.json")
+    assert settings.stdin_source == "export"
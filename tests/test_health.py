@@ -0,0 +1,150 @@
+"""
+test_health_reporter_publishes_readiness: the ready gauge follows the checks and the heartbeat is refreshed
+test_health_app_ready: /ready answers 200 only while the workers report ready
+test_health_app_live: /live fails once the heartbeat is older than the timeout, not before the first one
+test_health_app_serves_metrics: other paths reach the metrics app
+test_kafka_connect_retries_with_backoff: a failed start is retried on a new consumer after a jittered delay
+test_kafka_start_reuses_connected_consumer: start subscribes the consumer of connect instead of creating another
+test_kafka_ready_follows_pipeline: the consumer is ready while fetching and not once stop was called
+test_elastic_connect_retries_errors: ping errors are retried until the cluster answers
+"""
+
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from prometheus_client import REGISTRY
+
+from config import ElasticSettings, KafkaSettings
+from health import HealthApp, HealthReporter
+from metrics import worker_heartbeat_seconds, worker_ready
+from ports.input.kafka_service import KafkaConsumerService
+from ports.output.elastic_service import ElasticsearchClientService
+
+
+def _get(app: HealthApp, path: str) -> tuple[str, bytes]:
+    response = {}
+
+    def start_response(status, headers):
+        response["status"] = status
+
+    body = b"".join(app({"PATH_INFO": path}, start_response))
+    return response["status"], body
+
+
+def _idle_consumer() -> AsyncMock:
+    consumer = AsyncMock()
+    consumer.subscribe = MagicMock()
+
+    async def getmany(**kwargs):
+        await asyncio.sleep(0.01)
+        return {}
+
+    consumer.getmany.side_effect = getmany
+    return consumer
+
+
+def _app(**kwargs) -> HealthApp:
+    def metrics_app(environ, start_response):
+        start_response("200 OK", [])
+        return [b"metrics\n"]
+
+    return HealthApp(metrics_app, REGISTRY, **kwargs)
+
+
+def test_health_reporter_publishes_readiness():
+    state = {"kafka": False}
+    reporter = HealthReporter({"kafka": lambda: state["kafka"], "elasticsearch": lambda: True})
+
+    assert not reporter.report()
+    assert worker_ready._value.get() == 0
+    assert time.time() - worker_heartbeat_seconds._value.get() < 1
+
+    state["kafka"] = True
+    assert reporter.report()
+    assert worker_ready._value.get() == 1
+
+
+def test_health_app_ready():
+    app = _app()
+    worker_ready.set(0)
+    assert _get(app, "/ready")[0].startswith("503")
+
+    worker_ready.set(1)
+    assert _get(app, "/ready") == ("200 OK", b"ready\n")
+
+
+def test_health_app_live():
+    app = _app(live_timeout_s=5)
+    worker_heartbeat_seconds.set(0)
+    assert _get(app, "/live")[0] == "200 OK"
+
+    worker_heartbeat_seconds.set(time.time() - 1)
+    assert _get(app, "/live")[0] == "200 OK"
+
+    worker_heartbeat_seconds.set(time.time() - 10)
+    assert _get(app, "/live")[0].startswith("503")
+
+
+def test_health_app_serves_metrics():
+    assert _get(_app(), "/metrics") == ("200 OK", b"metrics\n")
+
+
+async def test_kafka_connect_retries_with_backoff():
+    failing, working = AsyncMock(), AsyncMock()
+    failing.start.side_effect = ConnectionError("broker not available")
+    service = KafkaConsumerService(MagicMock(), KafkaSettings(connect_backoff_ms=10))
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", side_effect=[failing, working]), \
+            patch("ports.input.kafka_service.full_jitter", return_value=0.01) as backoff:
+        await service.connect()
+
+    failing.stop.assert_awaited_once()
+    working.start.assert_awaited_once()
+    working.stop.assert_not_awaited()
+    backoff.assert_called_once_with(1, 0.01, 5)
+
+
+async def test_kafka_start_reuses_connected_consumer():
+    consumer = _idle_consumer()
+    service = KafkaConsumerService(MagicMock(), KafkaSettings(timeout_ms=10, lag_interval_s=0))
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer) as consumer_class:
+        await service.connect()
+        task = asyncio.create_task(service.start())
+        await asyncio.sleep(0.05)
+        service.stop()
+        await asyncio.wait_for(task, 1)
+
+    consumer_class.assert_called_once()
+    consumer.start.assert_awaited_once()
+    consumer.subscribe.assert_called_once()
+    consumer.stop.assert_awaited_once()
+
+
+async def test_kafka_ready_follows_pipeline():
+    consumer = _idle_consumer()
+    service = KafkaConsumerService(MagicMock(), KafkaSettings(timeout_ms=10, lag_interval_s=0))
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        await service.connect()
+        assert not service.ready
+        task = asyncio.create_task(service.start())
+        await asyncio.sleep(0.05)
+        assert service.ready
+        service.stop()
+        assert not service.ready
+        await asyncio.wait_for(task, 1)
+
+    assert not service.ready
+
+
+async def test_elastic_connect_retries_errors():
+    service = ElasticsearchClientService(ElasticSettings(connect_backoff_ms=1))
+
+    with patch.object(service.client, "ping", new_callable=AsyncMock) as ping:
+        ping.side_effect = [ConnectionError("refused"), False, True]
+        await service.connect()
+
+    assert ping.await_count == 3
+    assert service.connected
@@ -0,0 +1,144 @@
+"""
+test_static_index_renders_plain_action: a plain index name gives the same line for every event
+test_template_resolves_fields_and_dates: event fields and formatted dates build the index name
+test_template_date_formats: epoch seconds, milliseconds and ISO strings are formatted, bad values are not
+test_missing_field_and_index_sanitizing: missing fields and invalid characters are replaced
+test_object_and_array_fields_fall_back: object and array values take the missing placeholder and default routing
+test_unformattable_field_falls_back: a value its format spec does not apply to takes the missing placeholder
+test_routing_template: routing is added when its field is present
+test_heads_cached_per_target: events of the same target share one rendered line
+test_raw_events_use_batch_timestamp: raw events are only decoded when a template needs their fields
+test_data_stream_creates_documents: data streams force the create op type
+test_mixed_targets_sent_in_one_bulk: documents of several indices go out in a single request
+test_bootstrap_installs_index_template: the index template covers every resolvable index
+"""
+
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from codec import get_codec
+from config import ElasticSettings
+from ports.output.document_ids import DocumentIds
+from ports.output.elastic_service import ElasticsearchClientService
+from ports.output.index_router import IndexRouter, RouteTemplate
+
+CODEC = get_codec("json")
+# 2024-03-05T10:00:00Z
+TIMESTAMP = 1709632800
+
+
+def _router(**settings) -> IndexRouter:
+    return IndexRouter(ElasticSettings(**settings), CODEC, "index")
+
+
+def _action(head: bytes) -> dict:
+    return CODEC.loads(head + b"}}")
+
+
+def test_static_index_renders_plain_action():
+    router = _router(index="events")
+    assert not router.dynamic
+    heads = router.heads([{"a": 1}, b'{"a": 2}'], TIMESTAMP)
+    assert [_action(head) for head in heads] == [{"index": {"_index": "events"}}] * 2
+
+
+def test_template_resolves_fields_and_dates():
+    router = _router(index="logs-{tenant}-{timestamp:%Y.%m.%d}")
+    heads = router.heads([{"tenant": "acme", "timestamp": TIMESTAMP}], TIMESTAMP)
+    assert _action(heads[0]) == {"index": {"_index": "logs-acme-2024.03.05"}}
+
+
+@pytest.mark.parametrize("value, expected", [
+    (TIMESTAMP, "2024.03"),
+    (TIMESTAMP * 1000, "2024.03"),
+    ("2024-03-05T10:00:00Z", "2024.03"),
+    (str(TIMESTAMP), "2024.03"),
+    ("yesterday", "unknown"),
+])
+def test_template_date_formats(value, expected):
+    template = RouteTemplate("{ts:%Y.%m}")
+    assert template.render(template.values({"ts": value})) == expected
+
+
+def test_missing_field_and_index_sanitizing():
+    router = _router(index="logs-{user.tenant}")
+    heads = router.heads([{"user": {"tenant": "Big Co/EU"}}, {"user": {}}], TIMESTAMP)
+    assert [_action(head)["index"]["_index"] for head in heads] == ["logs-big-co-eu", "logs-unknown"]
+
+
+def test_object_and_array_fields_fall_back():
+    router = _router(index="logs-{tenant}", routing="{user}")
+    heads = router.heads([{"tenant": ["a", "b"], "user": {"id": 1}}, {"tenant": {"id": 1}, "user": [1]}], TIMESTAMP)
+    assert [_action(head) for head in heads] == [{"index": {"_index": "logs-unknown"}}] * 2
+
+
+def test_unformattable_field_falls_back():
+    router = _router(index="logs-{shard:03d}")
+    heads = router.heads([{"shard": 7}, {"shard": "seven"}], TIMESTAMP)
+    assert [_action(head)["index"]["_index"] for head in heads] == ["logs-007", "logs-unknown"]
+
+
+def test_routing_template():
+    router = _router(index="events", routing="{tenant}")
+    heads = router.heads([{"tenant": "acme"}, {}], TIMESTAMP)
+    assert _action(heads[0]) == {"index": {"_index": "events", "routing": "acme"}}
+    assert _action(heads[1]) == {"index": {"_index": "events"}}
+
+
+def test_heads_cached_per_target():
+    router = _router(index="logs-{tenant}")
+    heads = router.heads([{"tenant": "a"}, {"tenant": "b"}, {"tenant": "a"}], TIMESTAMP)
+    assert heads[0] is heads[2]
+    assert heads[0] != heads[1]
+
+
+def test_raw_events_use_batch_timestamp():
+    router = _router(index="logs-{timestamp:%Y}")
+    with patch.object(CODEC, "loads") as mock_loads:
+        heads = router.heads([b'{"timestamp": 0}'], TIMESTAMP)
+        mock_loads.assert_not_called()
+    assert _action(heads[0])["index"]["_index"] == "logs-2024"
+
+    router = _router(index="logs-{tenant}-{timestamp:%Y}")
+    heads = router.heads([b'{"tenant": "acme"}', b"not json"], TIMESTAMP)
+    assert [_action(head)["index"]["_index"] for head in heads] == ["logs-acme-2024", "logs-unknown-2024"]
+
+
+def test_data_stream_creates_documents():
+    assert DocumentIds(ElasticSettings(data_stream=True), CODEC).op_type == "create"
+    with pytest.raises(ValueError):
+        DocumentIds(ElasticSettings(data_stream=True, op_type="index"), CODEC)
+
+
+@pytest.mark.asyncio
+async def test_mixed_targets_sent_in_one_bulk():
+    service = ElasticsearchClientService(ElasticSettings(index="logs-{tenant}", id_strategy="field", id_fields="id"))
+
+    with patch.object(service.client, "bulk", new_callable=AsyncMock) as mock_bulk:
+        mock_bulk.return_value = {"errors": False}
+        await service.bulk_insert([{"tenant": "a", "id": 1}, {"tenant": "b", "id": 2}])
+
+    mock_bulk.assert_awaited_once()
+    actions = bytes(mock_bulk.await_args.kwargs["operations"]).splitlines()[::2]
+    assert [CODEC.loads(action) for action in actions] == [
+        {"index": {"_index": "logs-a", "_id": "1"}},
+        {"index": {"_index": "logs-b", "_id": "2"}},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_bootstrap_installs_index_template(tmp_path):
+    template_file = tmp_path / "template.json"
+    template_file.write_text(json.dumps({"template": {"settings": {"number_of_shards": 1}}, "priority": 300}))
+    router = _router(index="logs-{tenant}-{timestamp:%Y.%m}", index_template_name="logs",
+                     index_template_file=str(template_file), data_stream=True)
+    client = MagicMock()
+    client.indices.put_index_template = AsyncMock()
+
+    await router.bootstrap(client)
+
+    client.indices.put_index_template.assert_awaited_once_with(
+        name="logs", index_patterns=["logs-*-*"], template={"settings": {"number_of_shards": 1}},
+        priority=300, data_stream={})
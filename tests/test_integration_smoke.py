@@ -45,6 +45,7 @@ async def test_kafka_to_elastic_smoke_flow(events_by_tp, should_process, raises_
         msg_list = []
         for i, val in enumerate(msgs):
             m = MagicMock()
+            m.serialized_value_size = 16
             m.offset = 100 + i
             m.value = val
             msg_list.append(m)
@@ -53,6 +54,7 @@ async def test_kafka_to_elastic_smoke_flow(events_by_tp, should_process, raises_
 
     consumer_mock.getmany = AsyncMock(return_value=events_by_tp)
 
+    consumer_mock.subscribe = MagicMock()
     with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
         with patch("ports.input.kafka_service.process_events", new_callable=AsyncMock) as process_events_mock:
             if raises_error:
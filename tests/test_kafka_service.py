@@ -21,7 +21,7 @@ async def test_connect_success():
 @pytest.mark.asyncio
 async def test_connect_failure():
     with patch("ports.input.kafka_service.AIOKafkaConsumer", side_effect=Exception("Kafka down")):
-        service = KafkaConsumerService(elastic_client=MagicMock(), settings=KafkaSettings())
+        service = KafkaConsumerService(elastic_client=MagicMock(), settings=KafkaSettings(connect_backoff_ms=1))
         with pytest.raises(ConnectionError, match="Could not connect to Kafka"):
             await service.connect()
 
@@ -31,6 +31,7 @@ async def test_start_consumes_valid_messages_and_commits():
     consumer_mock = AsyncMock()
     tp = TopicPartition("topic_name", 0)
     message_mock = MagicMock()
+    message_mock.serialized_value_size = 16
     message_mock.value = {"field": "value"}
     message_mock.offset = 10
 
@@ -42,6 +43,7 @@ async def test_start_consumes_valid_messages_and_commits():
         asyncio.CancelledError()
     ]
 
+    consumer_mock.subscribe = MagicMock()
     with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
         with patch("ports.input.kafka_service.process_events", new_callable=AsyncMock) as process_events_mock:
             service = KafkaConsumerService(elastic_client=MagicMock(), settings=KafkaSettings())
@@ -59,6 +61,7 @@ async def test_start_handles_invalid_message_format():
     consumer_mock = AsyncMock()
     tp = TopicPartition("topic_name", 0)
     message_mock = MagicMock()
+    message_mock.serialized_value_size = 16
     message_mock.value = "invalid"  # не dict
     message_mock.offset = 5
 
@@ -67,6 +70,7 @@ async def test_start_handles_invalid_message_format():
     consumer_mock.commit = AsyncMock()
     consumer_mock.getmany = AsyncMock(side_effect=asyncio.CancelledError())
 
+    consumer_mock.subscribe = MagicMock()
     with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
         with patch("ports.input.kafka_service.process_events", new_callable=AsyncMock) as process_events_mock:
             service = KafkaConsumerService(elastic_client=MagicMock(), settings=KafkaSettings())
@@ -84,6 +88,7 @@ async def test_start_does_not_commit_if_process_events_fails():
     consumer_mock = AsyncMock()
     tp = TopicPartition("topic_name", 0)
     message_mock = MagicMock()
+    message_mock.serialized_value_size = 16
     message_mock.value = {"field": "value"}
     message_mock.offset = 10
 
@@ -92,6 +97,7 @@ async def test_start_does_not_commit_if_process_events_fails():
     consumer_mock.commit = AsyncMock()
     consumer_mock.getmany = AsyncMock(return_value={tp: [message_mock]})
 
+    consumer_mock.subscribe = MagicMock()
     with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
         with patch("ports.input.kafka_service.process_events", new_callable=AsyncMock) as process_events_mock:
             process_events_mock.side_effect = Exception("fail")
@@ -101,3 +107,283 @@ async def test_start_does_not_commit_if_process_events_fails():
                 await service.start()
 
             consumer_mock.commit.assert_not_called()
+
+
+def _message(offset, value=None):
+    message = MagicMock()
+    message.serialized_value_size = 16
+    message.offset = offset
+    message.value = value if value is not None else {"field": offset}
+    return message
+
+
+@pytest.mark.asyncio
+async def test_pipelined_commits_only_after_earlier_batches():
+    tp = TopicPartition("topic_name", 0)
+    release_first = asyncio.Event()
+    idle = asyncio.Event()
+
+    async def getmany(**kwargs):
+        if getmany.calls < 2:
+            getmany.calls += 1
+            return {tp: [_message(getmany.calls)]}
+        await idle.wait()
+
+    getmany.calls = 0
+
+    async def bulk(client, events, **kwargs):
+        if events[0]["field"] == 1:
+            await release_first.wait()
+
+    consumer_mock = AsyncMock()
+    consumer_mock.getmany = AsyncMock(side_effect=getmany)
+
+    consumer_mock.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
+        with patch("ports.input.kafka_service.process_events", side_effect=bulk) as process_events_mock:
+            settings = KafkaSettings(mode="pipelined", max_in_flight=2)
+            service = KafkaConsumerService(elastic_client=MagicMock(), settings=settings)
+            task = asyncio.create_task(service.start())
+
+            for _ in range(20):
+                await asyncio.sleep(0)
+            assert process_events_mock.call_count == 2
+            consumer_mock.commit.assert_not_called()
+
+            release_first.set()
+            for _ in range(20):
+                await asyncio.sleep(0)
+            consumer_mock.commit.assert_awaited_once()
+            (offsets,), _ = consumer_mock.commit.await_args
+            assert offsets[tp].offset == 3
+
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            consumer_mock.stop.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_pipelined_limits_in_flight_batches():
+    tp = TopicPartition("topic_name", 0)
+    running = []
+    gate = asyncio.Event()
+    offsets = iter(range(10))
+
+    async def getmany(**kwargs):
+        offset = next(offsets, None)
+        if offset is None:
+            await gate.wait()
+        return {tp: [_message(offset)]}
+
+    async def bulk(client, events, **kwargs):
+        running.append(events)
+        await gate.wait()
+
+    consumer_mock = AsyncMock()
+    consumer_mock.getmany = AsyncMock(side_effect=getmany)
+
+    consumer_mock.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
+        with patch("ports.input.kafka_service.process_events", side_effect=bulk):
+            settings = KafkaSettings(mode="pipelined", max_in_flight=3, queue_size=2)
+            service = KafkaConsumerService(elastic_client=MagicMock(), settings=settings)
+            task = asyncio.create_task(service.start())
+            for _ in range(20):
+                await asyncio.sleep(0)
+            assert len(running) == 3
+
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+
+@pytest.mark.asyncio
+async def test_pipelined_propagates_index_failure():
+    tp = TopicPartition("topic_name", 0)
+    consumer_mock = AsyncMock()
+    consumer_mock.getmany = AsyncMock(return_value={tp: [_message(1)]})
+
+    consumer_mock.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
+        with patch("ports.input.kafka_service.process_events", new_callable=AsyncMock) as process_events_mock:
+            process_events_mock.side_effect = Exception("fail")
+            service = KafkaConsumerService(elastic_client=MagicMock(), settings=KafkaSettings(mode="pipelined"))
+
+            with pytest.raises(Exception, match="fail"):
+                await service.start()
+
+            consumer_mock.commit.assert_not_called()
+            consumer_mock.stop.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_partitioned_slow_partition_does_not_block_others():
+    slow, fast = TopicPartition("topic_name", 0), TopicPartition("topic_name", 1)
+    release_slow = asyncio.Event()
+    idle = asyncio.Event()
+    fetches = iter([{slow: [_message(0, {"p": 0})], fast: [_message(7, {"p": 1})]}])
+
+    async def getmany(**kwargs):
+        messages = next(fetches, None)
+        if messages is None:
+            await idle.wait()
+        return messages
+
+    async def bulk(client, events, **kwargs):
+        if events[0]["p"] == 0:
+            await release_slow.wait()
+
+    consumer_mock = AsyncMock()
+    consumer_mock.getmany = AsyncMock(side_effect=getmany)
+    consumer_mock.pause = MagicMock()
+    consumer_mock.resume = MagicMock()
+
+    consumer_mock.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
+        with patch("ports.input.kafka_service.process_events", side_effect=bulk):
+            settings = KafkaSettings(mode="partitioned", batch_size=1)
+            service = KafkaConsumerService(elastic_client=MagicMock(), settings=settings)
+            task = asyncio.create_task(service.start())
+
+            for _ in range(20):
+                await asyncio.sleep(0)
+            consumer_mock.commit.assert_awaited_once()
+            (offsets,), _ = consumer_mock.commit.await_args
+            assert {tp: meta.offset for tp, meta in offsets.items()} == {fast: 8}
+
+            release_slow.set()
+            for _ in range(20):
+                await asyncio.sleep(0)
+            (offsets,), _ = consumer_mock.commit.await_args
+            assert {tp: meta.offset for tp, meta in offsets.items()} == {slow: 1}
+
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+
+@pytest.mark.asyncio
+async def test_partitioned_pauses_partition_with_full_queue():
+    tp = TopicPartition("topic_name", 0)
+    gate = asyncio.Event()
+    offsets = iter(range(5))
+
+    async def getmany(**kwargs):
+        offset = next(offsets, None)
+        if offset is None:
+            await gate.wait()
+        return {tp: [_message(offset)]}
+
+    async def bulk(client, events, **kwargs):
+        await gate.wait()
+
+    consumer_mock = AsyncMock()
+    consumer_mock.getmany = AsyncMock(side_effect=getmany)
+    consumer_mock.pause = MagicMock()
+    consumer_mock.resume = MagicMock()
+
+    consumer_mock.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
+        with patch("ports.input.kafka_service.process_events", side_effect=bulk):
+            settings = KafkaSettings(mode="partitioned", batch_size=1, queue_size=2)
+            service = KafkaConsumerService(elastic_client=MagicMock(), settings=settings)
+            task = asyncio.create_task(service.start())
+            for _ in range(20):
+                await asyncio.sleep(0)
+
+            consumer_mock.pause.assert_called_with(tp)
+
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+
+@pytest.mark.parametrize("mode, checked", [("partitioned", True), ("pipelined", False)])
+def test_assignment_checks_pool_in_partitioned_mode(mode, checked):
+    es_client = MagicMock()
+    settings = KafkaSettings(mode=mode, partition_in_flight=2)
+    service = KafkaConsumerService(elastic_client=es_client, settings=settings)
+    partitions = {TopicPartition("topic_name", partition) for partition in range(3)}
+
+    service.assigned(MagicMock(), partitions)
+
+    if checked:
+        es_client.check_pool.assert_called_once_with(6)
+    else:
+        es_client.check_pool.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_raw_bulk_passes_message_bytes_through():
+    tp = TopicPartition("topic_name", 0)
+    consumer_mock = AsyncMock()
+    consumer_mock.getmany.side_effect = [
+        {tp: [_message(1, b'{"a":1}'), _message(2, b'not json'), _message(3, b'{"b":2}')]},
+        asyncio.CancelledError(),
+    ]
+
+    consumer_mock.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock) as consumer_cls:
+        with patch("ports.input.kafka_service.process_events", new_callable=AsyncMock) as process_events_mock:
+            service = KafkaConsumerService(elastic_client=MagicMock(), settings=KafkaSettings(raw_bulk=True))
+            with pytest.raises(asyncio.CancelledError):
+                await service.start()
+
+            assert "value_deserializer" not in consumer_cls.call_args.kwargs
+            (_, events), _ = process_events_mock.await_args
+            assert events == [b'{"a":1}', b'{"b":2}']
+
+
+@pytest.mark.asyncio
+async def test_adaptive_batching_shrinks_fetch_after_throttled_bulk():
+    tp = TopicPartition("topic_name", 0)
+    messages = [_message(i) for i in range(100)]
+    for message in messages:
+        message.serialized_value_size = 100
+    consumer_mock = AsyncMock()
+    consumer_mock.getmany.side_effect = [{tp: messages}, asyncio.CancelledError()]
+
+    consumer_mock.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
+        with patch("ports.input.kafka_service.process_events", new_callable=AsyncMock) as process_events_mock:
+            process_events_mock.return_value = MagicMock(throttled=3)
+            settings = KafkaSettings(adaptive_batching=True, batch_size=100)
+            service = KafkaConsumerService(elastic_client=MagicMock(), settings=settings)
+            with pytest.raises(asyncio.CancelledError):
+                await service.start()
+
+            first, second = consumer_mock.getmany.await_args_list
+            assert first.kwargs["max_records"] == 100
+            assert second.kwargs["max_records"] == 50
+
+
+@pytest.mark.asyncio
+async def test_adaptive_batching_sizes_partitioned_batches():
+    tp = TopicPartition("topic_name", 0)
+    fetches = iter([{tp: [_message(offset), _message(offset + 1)]} for offset in range(0, 10, 2)])
+
+    async def getmany(**kwargs):
+        await asyncio.sleep(0.001)
+        return next(fetches, {})
+
+    consumer_mock = AsyncMock()
+    consumer_mock.getmany.side_effect = getmany
+    consumer_mock.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer_mock):
+        with patch("ports.input.kafka_service.process_events", new_callable=AsyncMock) as process_events_mock:
+            settings = KafkaSettings(mode="partitioned", adaptive_batching=True, batch_size=100, timeout_ms=10000)
+            service = KafkaConsumerService(elastic_client=MagicMock(), settings=settings)
+            service.batcher.records = 4
+            task = asyncio.create_task(service.start())
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if sum(len(call.args[1]) for call in process_events_mock.await_args_list) == 10:
+                    break
+            service.stop()
+            await asyncio.wait_for(task, 1)
+
+            # Flushed at the batcher's size long before the timeout, which then grows after the full bulk
+            sizes = [len(call.args[1]) for call in process_events_mock.await_args_list]
+            assert sizes[0] == 4
+            assert sum(sizes) == 10
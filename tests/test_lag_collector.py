@@ -0,0 +1,113 @@
+"""
+test_lag_collector_reports_partition_and_total_lag: lag per assigned partition and summed per topic
+test_lag_collector_uncommitted_partition_lags_from_beginning: no committed offset counts from the beginning offset
+test_lag_collector_zeroes_revoked_partitions: partitions lost in a rebalance are reported as 0
+test_lag_collector_survives_errors: a failed collection is logged and retried on the next round
+test_consumer_runs_lag_collector: KafkaConsumerService runs the collector next to consumption
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from aiokafka import TopicPartition
+
+from config import KafkaSettings
+from metrics import consumer_lag, consumer_partition_lag
+from ports.input.kafka_service import KafkaConsumerService
+from ports.input.lag_collector import LagCollector
+
+
+def _consumer(assignment: set, end: dict, committed: dict, beginning: dict | None = None) -> MagicMock:
+    consumer = MagicMock()
+    consumer.assignment.return_value = assignment
+    consumer.end_offsets = AsyncMock(side_effect=lambda partitions: {tp: end[tp] for tp in partitions})
+    consumer.committed = AsyncMock(side_effect=lambda tp: committed.get(tp))
+    consumer.beginning_offsets = AsyncMock(side_effect=lambda partitions: {tp: beginning[tp] for tp in partitions})
+    return consumer
+
+
+def _partition_lag(topic: str, partition: int) -> float:
+    return consumer_partition_lag.labels(topic=topic, partition=str(partition))._value.get()
+
+
+async def test_lag_collector_reports_partition_and_total_lag():
+    tp0, tp1 = TopicPartition("lag-a", 0), TopicPartition("lag-a", 1)
+    consumer = _consumer({tp0, tp1}, end={tp0: 120, tp1: 50}, committed={tp0: 100, tp1: 50})
+
+    lags = await LagCollector(KafkaSettings()).collect(consumer)
+
+    assert lags == {tp0: 20, tp1: 0}
+    assert _partition_lag("lag-a", 0) == 20
+    assert _partition_lag("lag-a", 1) == 0
+    assert consumer_lag.labels(topic="lag-a")._value.get() == 20
+
+
+async def test_lag_collector_uncommitted_partition_lags_from_beginning():
+    tp = TopicPartition("lag-b", 0)
+    consumer = _consumer({tp}, end={tp: 300}, committed={}, beginning={tp: 100})
+
+    lags = await LagCollector(KafkaSettings()).collect(consumer)
+
+    assert lags == {tp: 200}
+    consumer.beginning_offsets.assert_awaited_once_with([tp])
+
+
+async def test_lag_collector_zeroes_revoked_partitions():
+    tp0, tp1 = TopicPartition("lag-c", 0), TopicPartition("lag-c", 1)
+    collector = LagCollector(KafkaSettings())
+    await collector.collect(_consumer({tp0, tp1}, end={tp0: 10, tp1: 30}, committed={tp0: 0, tp1: 0}))
+    assert consumer_lag.labels(topic="lag-c")._value.get() == 40
+
+    await collector.collect(_consumer({tp0}, end={tp0: 15}, committed={tp0: 5}))
+
+    assert _partition_lag("lag-c", 0) == 10
+    assert _partition_lag("lag-c", 1) == 0
+    assert consumer_lag.labels(topic="lag-c")._value.get() == 10
+
+    await collector.collect(_consumer(set(), end={}, committed={}))
+    assert consumer_lag.labels(topic="lag-c")._value.get() == 0
+
+
+async def test_lag_collector_survives_errors():
+    tp = TopicPartition("lag-d", 0)
+    consumer = _consumer({tp}, end={tp: 10}, committed={tp: 5})
+    consumer.end_offsets.side_effect = [RuntimeError("coordinator not available"), {tp: 10}]
+    collector = LagCollector(KafkaSettings(lag_interval_s=0.01))
+
+    task = asyncio.create_task(collector.run(consumer))
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if collector.lags:
+            break
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert collector.lags == {tp: 5}
+    assert consumer.end_offsets.await_count >= 2
+
+
+async def test_consumer_runs_lag_collector():
+    settings = KafkaSettings(lag_interval_s=0.01)
+    service = KafkaConsumerService(MagicMock(), settings)
+    consumer = AsyncMock()
+    consumer.assignment = MagicMock(return_value=set())
+
+    async def getmany(**kwargs):
+        await asyncio.sleep(0.01)
+        return {}
+
+    consumer.getmany.side_effect = getmany
+
+    consumer.subscribe = MagicMock()
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer), \
+            patch.object(service.lag, "collect", AsyncMock()) as collect:
+        task = asyncio.create_task(service.start())
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if collect.await_count:
+                break
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert collect.await_count >= 1
+    consumer.stop.assert_awaited_once()
@@ -0,0 +1,200 @@
+"""
+test_parse_chunk_reads_json_fields: documents and duration come from the structured fields of a log record
+test_parse_chunk_legacy_duration_line: older logs take the duration from a following duration line
+test_parse_chunk_skips_unrelated_lines: other records and broken lines are ignored
+test_read_chunks_cuts_at_line_boundaries: chunks never split a line, gzip input included
+test_parse_logs_globs_and_processes: globs, plain and gzip files parsed in a process pool into typed columns
+test_parse_logs_missing_file: a missing input yields an empty typed frame
+test_enrich_dataframe_flags_peaks: speed, rolling average, peaks and drops are derived from the parsed rows
+test_load_journal_reads_every_format: arrow, parquet and jsonl journals of a directory load into one sorted frame
+test_load_journal_truncated_arrow: a journal cut short by a crash loads up to its last complete batch
+test_journal_throughput_flags_stalls: per-interval throughput counts idle intervals and flags the stall as a drop
+"""
+
+import gzip
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+spec = importlib.util.spec_from_file_location(
+    "log_analyzer", Path(__file__).resolve().parent.parent / "log-analyzer.py")
+log_analyzer = importlib.util.module_from_spec(spec)
+# Registered so the process pool can pickle its functions
+sys.modules["log_analyzer"] = log_analyzer
+spec.loader.exec_module(log_analyzer)
+
+BASE = 1_735_725_600.0  # 2025-01-01 10:00:00 UTC
+
+
+def _insert(second: int, documents: int, duration: float) -> bytes:
+    return json.dumps({
+        "asctime": f"2025-01-01 10:00:{second:02d},250",
+        "levelname": "INFO",
+        "name": "ports.output.elastic_service",
+        "message": f"Successfully inserted {documents} documents.",
+        "filename": "elastic_service.py",
+        "documents": documents,
+        "duration_s": duration,
+    }).encode() + b"\n"
+
+
+def _other(second: int) -> bytes:
+    return json.dumps({"asctime": f"2025-01-01 10:00:{second:02d},000", "message": "Kafka is available!"}).encode() + b"\n"
+
+
+def test_parse_chunk_reads_json_fields():
+    columns = log_analyzer.parse_chunk(_insert(1, 100, 0.5) + _other(2) + _insert(3, 50, 0.25))
+
+    assert columns == {
+        "timestamp": ["2025-01-01 10:00:01,250", "2025-01-01 10:00:03,250"],
+        "num_docs": [100, 50],
+        "duration_sec": [0.5, 0.25],
+    }
+
+
+def test_parse_chunk_legacy_duration_line():
+    lines = (
+        b'{"asctime": "2025-01-01 10:00:01,000", "message": "Successfully inserted 10 documents."}\n'
+        b'{"asctime": "2025-01-01 10:00:01,001", "message": "bulk_insert duration:0.200s"}\n'
+        b'{"asctime": "2025-01-01 10:00:02,000", "message": "Successfully inserted 20 documents."}\n'
+        + _other(3) + _other(4) +
+        b'{"asctime": "2025-01-01 10:00:05,000", "message": "bulk_insert duration:0.300s"}\n'
+    )
+
+    columns = log_analyzer.parse_chunk(lines)
+
+    assert columns["num_docs"] == [10, 20]
+    # The second duration line is too far from its insert
+    assert columns["duration_sec"] == [0.2, 0.0]
+
+
+def test_parse_chunk_skips_unrelated_lines():
+    lines = _other(1) + b"not json at all\n" + b'{"message": "Successfully inserted many documents."}\n' + b"\xff\xfe\n"
+
+    assert log_analyzer.parse_chunk(lines)["num_docs"] == []
+
+
+@pytest.mark.parametrize("suffix", [".log", ".log.gz"])
+def test_read_chunks_cuts_at_line_boundaries(tmp_path, suffix):
+    data = b"".join(_insert(second % 60, second, 0.1) for second in range(200))
+    path = tmp_path / f"loader{suffix}"
+    path.write_bytes(gzip.compress(data) if suffix.endswith(".gz") else data)
+
+    chunks = list(log_analyzer.read_chunks(str(path), chunk_bytes=1000))
+
+    assert len(chunks) > 1
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+    assert b"".join(chunks) == data
+
+
+def test_parse_logs_globs_and_processes(tmp_path):
+    (tmp_path / "a.log").write_bytes(b"".join(_insert(second, 10, 0.5) for second in range(30)))
+    (tmp_path / "b.log.gz").write_bytes(gzip.compress(b"".join(_insert(second, 20, 0.5) for second in range(30, 50))))
+    (tmp_path / "ignored.txt").write_bytes(_insert(0, 1000, 1.0))
+
+    df = log_analyzer.parse_logs([str(tmp_path / "*.log"), str(tmp_path / "*.gz")], workers=2, chunk_bytes=2048)
+
+    assert len(df) == 50
+    assert df["num_docs"].sum() == 30 * 10 + 20 * 20
+    assert str(df["num_docs"].dtype) == "int64"
+    assert str(df["duration_sec"].dtype) == "float64"
+    assert pd.api.types.is_datetime64_any_dtype(df["timestamp"])
+    assert df["timestamp"].min() == pd.Timestamp("2025-01-01 10:00:00.250")
+
+
+def test_parse_logs_missing_file(tmp_path):
+    df = log_analyzer.parse_logs([str(tmp_path / "missing.log")], workers=1)
+
+    assert df.empty
+    assert list(df.columns) == ["timestamp", "num_docs", "duration_sec"]
+
+
+def test_enrich_dataframe_flags_peaks():
+    lines = b"".join(_insert(second, 100, 1.0) for second in range(10)) + _insert(10, 1000, 1.0) + _insert(11, 0, 0.0)
+
+    df = log_analyzer.enrich_dataframe(log_analyzer.to_frame(log_analyzer.parse_chunk(lines)))
+
+    assert len(df) == 11
+    assert df["speed_per_min"].iloc[0] == 6000
+    assert df["is_peak"].iloc[-1]
+    assert not df["is_drop"].any()
+
+
+def _journal_columns(seconds: list[int], documents: int = 100) -> dict[str, list]:
+    return {
+        "started_at": [BASE + second - 0.5 for second in seconds],
+        "finished_at": [BASE + second for second in seconds],
+        "partitions": [["test-topic:0"] for _ in seconds],
+        "records": [documents] * len(seconds),
+        "documents": [documents] * len(seconds),
+        "bytes": [documents * 100] * len(seconds),
+        "decode_s": [0.001] * len(seconds),
+        "transform_s": [0.002] * len(seconds),
+        "index_s": [0.2] * len(seconds),
+        "commit_s": [0.003] * len(seconds),
+        "attempts": [1] * len(seconds),
+        "retries": [0] * len(seconds),
+        "failed": [0] * len(seconds),
+        "throttled": [0] * len(seconds),
+    }
+
+
+def _write_arrow(path, *tables):
+    pa = pytest.importorskip("pyarrow")
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_stream(sink, tables[0].schema) as writer:
+        for table in tables:
+            writer.write_table(table)
+
+
+def test_load_journal_reads_every_format(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pytest.importorskip("pyarrow.parquet").write_table(
+        pa.table(_journal_columns([120, 180])), tmp_path / "batches-2.parquet")
+    _write_arrow(tmp_path / "batches-1.arrow", pa.table(_journal_columns([0, 60])))
+    columns = _journal_columns([240])
+    (tmp_path / "batches-3.jsonl").write_text(json.dumps({name: values[0] for name, values in columns.items()}) + "\n")
+    (tmp_path / "ignored.log").write_text("not a journal\n")
+
+    df = log_analyzer.load_journal([str(tmp_path)])
+
+    assert len(df) == 5
+    assert df["finished_at"].is_monotonic_increasing
+    assert df["finished_at"].iloc[0] == pd.Timestamp("2025-01-01 10:00:00", tz="UTC")
+    assert df["documents"].sum() == 500
+    assert list(df["partitions"].iloc[-1]) == ["test-topic:0"]
+
+
+def test_load_journal_truncated_arrow(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    path = tmp_path / "batches-1.arrow"
+    _write_arrow(path, pa.table(_journal_columns([0])), pa.table(_journal_columns([1])))
+    data = path.read_bytes()
+    # The end-of-stream marker and part of the second batch are lost
+    path.write_bytes(data[:-200])
+
+    df = log_analyzer.load_journal([str(path)])
+
+    assert len(df) == 1
+
+
+def test_journal_throughput_flags_stalls():
+    pa = pytest.importorskip("pyarrow")
+    # One batch every 6 seconds for 10 minutes, then 3 idle minutes and a catch-up minute
+    seconds = list(range(0, 600, 6)) + [13 * 60 + second for second in range(0, 60, 2)]
+    batches = pa.table(_journal_columns(seconds)).to_pandas()
+    for column in ("started_at", "finished_at"):
+        batches[column] = pd.to_datetime(batches[column], unit="s", utc=True)
+
+    throughput = log_analyzer.journal_throughput(batches, "1min")
+
+    assert len(throughput) == 14
+    assert throughput["speed_per_min"].iloc[0] == 1000
+    assert list(throughput["documents"].iloc[10:13]) == [0, 0, 0]
+    assert throughput["is_drop"].iloc[10:13].all()
+    assert throughput["is_peak"].iloc[13]
+    assert not throughput["is_peak"].iloc[:10].any()
@@ -1,16 +1,22 @@
 import pytest
 
-from prometheus_client import Summary
+from prometheus_client import Histogram
 from metrics import (
     counter_metric_decorator,
-    consume_time_metric,
     errors_total,
     messages_processed,
+    batch_bytes_metric,
     batch_processing_time_metric,
-    response_time_metric
+    batch_records_metric,
+    bulk_time_metric,
+    stage_time_metric
 )
 
 
+def _count(histogram: Histogram) -> float:
+    return sum(bucket.get() for bucket in histogram._buckets)
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("raise_error", [False, True])
 async def test_counter_metric_decorator_counts(raise_error):
@@ -55,7 +61,7 @@ def test_errors_total_no_increment():
 
 @pytest.mark.asyncio
 async def test_consume_time_metric_decorator_measures():
-    metric = Summary("test_consume_time", "test")
+    metric = Histogram("test_consume_time", "test")
     calls = []
 
     @counter_metric_decorator(metric=metric)
@@ -64,30 +70,28 @@ async def test_consume_time_metric_decorator_measures():
 
     await dummy()
     assert sum(calls) == 1
-    assert metric._count.get() >= 1
-
-
-@pytest.mark.asyncio
-async def test_batch_processing_time_metric_decorator_measures():
-    metric = batch_processing_time_metric
-    metric._count.set(0)
-
-    @metric.time()
-    async def dummy():
-        return True
-
-    await dummy()
-    assert metric._count.get() >= 1
-
-
-@pytest.mark.asyncio
-async def test_response_time_metric_measures():
-    metric = response_time_metric
-    metric._count.set(0)
-
-    @metric.time()
-    async def dummy():
-        return True
-
-    await dummy()
-    assert metric._count.get() >= 1
+    assert metric._sum.get() > 0
+    assert _count(metric) == 1
+
+
+@pytest.mark.parametrize("metric, labels", [
+    (stage_time_metric, {"stage": "fetch", "topic": "test-topic"}),
+    (bulk_time_metric, {"index": "test-index"}),
+    (batch_processing_time_metric, {"topic": "test-topic"}),
+])
+def test_stage_metrics_are_histograms(metric, labels):
+    child = metric.labels(**labels)
+    count = _count(child)
+    child.observe(0.02)
+    assert isinstance(metric, Histogram)
+    assert _count(child) == count + 1
+
+
+def test_batch_shape_histograms():
+    records = batch_records_metric.labels(topic="shape-topic")
+    size = batch_bytes_metric.labels(topic="shape-topic")
+    records.observe(100)
+    size.observe(5000)
+    # 100 records fall into the 100 bucket, 5000 bytes into the 16 KiB one
+    assert records._buckets[list(records._upper_bounds).index(100)].get() == 1
+    assert size._buckets[list(size._upper_bounds).index(16384)].get() == 1
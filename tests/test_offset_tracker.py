@@ -0,0 +1,63 @@
+"""
+test_tracker_commits_in_order_completion: watermark follows in-order acks
+test_tracker_holds_back_out_of_order_completion: later range waits for an earlier one
+test_tracker_partitions_are_independent: one partition does not block another
+test_tracker_reports_only_new_watermarks: committed watermarks are not reported again
+test_tracker_ignores_unknown_ranges: ack of an untracked range is a no-op
+"""
+
+from services.offset_tracker import OffsetTracker
+
+
+def test_tracker_commits_in_order_completion():
+    tracker = OffsetTracker()
+    tracker.track("p0", 0, 10)
+    tracker.track("p0", 10, 20)
+
+    tracker.ack("p0", 0)
+    assert tracker.committable() == {"p0": 10}
+
+    tracker.ack("p0", 10)
+    assert tracker.committable() == {"p0": 20}
+
+
+def test_tracker_holds_back_out_of_order_completion():
+    tracker = OffsetTracker()
+    tracker.track("p0", 0, 10)
+    tracker.track("p0", 10, 20)
+    tracker.track("p0", 20, 30)
+
+    tracker.ack("p0", 20)
+    tracker.ack("p0", 10)
+    assert tracker.committable() == {}
+
+    tracker.ack("p0", 0)
+    assert tracker.committable() == {"p0": 30}
+
+
+def test_tracker_partitions_are_independent():
+    tracker = OffsetTracker()
+    tracker.track("p0", 0, 10)
+    tracker.track("p1", 5, 8)
+
+    tracker.ack("p1", 5)
+    assert tracker.committable() == {"p1": 8}
+
+
+def test_tracker_reports_only_new_watermarks():
+    tracker = OffsetTracker()
+    tracker.track("p0", 0, 10)
+    tracker.track("p1", 0, 3)
+    tracker.ack("p0", 0)
+    tracker.mark_committed(tracker.committable())
+
+    tracker.ack("p1", 0)
+    assert tracker.committable() == {"p1": 3}
+
+
+def test_tracker_ignores_unknown_ranges():
+    tracker = OffsetTracker()
+    tracker.ack("p0", 42)
+    tracker.track("p0", 0, 1)
+    tracker.ack("p0", 42)
+    assert tracker.committable() == {}
@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import AsyncMock, MagicMock
 from metrics import messages_processed, errors_total
+from ports.output.circuit_breaker import CircuitOpenError
 from services.event_service import process_events
 
 
@@ -33,3 +34,15 @@ async def test_process_events_behavior(events, side_effect, expected_bulk_called
 
     if expect_log:
         assert any("Bulk insert failed" in r.message for r in caplog.records)
+
+
+@pytest.mark.asyncio
+async def test_process_events_propagates_open_circuit():
+    mock_client = MagicMock()
+    mock_client.bulk_insert = AsyncMock(side_effect=CircuitOpenError("open"))
+    errors_total._value.set(0)
+
+    with pytest.raises(CircuitOpenError):
+        await process_events(mock_client, [{"field": "value"}])
+
+    assert errors_total._value.get() == 0
@@ -0,0 +1,174 @@
+"""
+test_metrics_pass_through: other paths are served by the metrics app without a token
+test_debug_endpoints_require_token: missing or wrong tokens are refused
+test_profile_collapsed: the CPU profile samples other threads in folded format
+test_profile_speedscope: the CPU profile converts to a speedscope sampled profile
+test_profile_rejects_long_runs: durations above the configured maximum are refused
+test_profile_rejects_interval_out_of_range: sampling intervals outside the profiling window are refused
+test_memory_rejects_counts_out_of_range: top and frames outside their bounds are refused
+test_loop_rejects_samples_out_of_range: loop lag sample counts outside [1, 100] are refused
+test_memory_snapshot: top allocations are listed and tracing stops afterwards
+test_tasks_and_loop_lag: task stacks and loop lag come from the attached event loop
+test_blocked_loop_is_reported: a blocked loop is reported with the stack it is stuck in
+"""
+
+import asyncio
+import json
+import threading
+import time
+import tracemalloc
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+import profiling
+from profiling import ProfilingApp
+
+TOKEN = "secret"
+
+
+def _call(app: ProfilingApp, path: str, query: str = "", token: str | None = TOKEN) -> tuple[str, bytes]:
+    environ = {"PATH_INFO": path, "QUERY_STRING": query}
+    if token is not None:
+        environ["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers):
+        response["status"] = status
+
+    body = b"".join(app(environ, start_response))
+    return response["status"], body
+
+
+def _metrics_app(environ, start_response):
+    start_response("200 OK", [])
+    return [b"metrics"]
+
+
+@pytest.fixture
+def app():
+    return ProfilingApp(_metrics_app, TOKEN, max_seconds=5)
+
+
+def busy_worker(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_worker, args=(stop,), name="busy")
+    thread.start()
+    yield
+    stop.set()
+    thread.join()
+
+
+async def _cancel_tasks():
+    """ Lets the tasks a test left on the loop finish cancelling before it stops """
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@pytest.fixture
+def running_loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="loop")
+    thread.start()
+    profiling.attach_loop(loop)
+    yield loop
+    profiling.attach_loop(None)
+    asyncio.run_coroutine_threadsafe(_cancel_tasks(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def test_metrics_pass_through(app):
+    assert _call(app, "/metrics", token=None) == ("200 OK", b"metrics")
+
+
+@pytest.mark.parametrize("token", [None, "wrong"])
+def test_debug_endpoints_require_token(app, token):
+    status, _ = _call(app, "/debug/tasks", token=token)
+    assert status == "401 Unauthorized"
+
+
+def test_profile_collapsed(app, busy_thread):
+    status, body = _call(app, "/debug/profile", "seconds=0.3&interval_ms=1")
+    assert status == "200 OK"
+    lines = body.decode().splitlines()
+    assert any(line.startswith("busy;") and "busy_worker" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_profile_speedscope(app, busy_thread):
+    status, body = _call(app, "/debug/profile", "seconds=0.2&interval_ms=1&format=speedscope")
+    assert status == "200 OK"
+    document = json.loads(body)
+    profile = document["profiles"][0]
+    assert profile["type"] == "sampled"
+    assert len(profile["samples"]) == len(profile["weights"])
+    frames = document["shared"]["frames"]
+    assert any("busy_worker" in frames[index]["name"] for sample in profile["samples"] for index in sample)
+
+
+def test_profile_rejects_long_runs(app):
+    status, _ = _call(app, "/debug/profile", "seconds=60")
+    assert status == "400 Bad Request"
+
+
+@pytest.mark.parametrize("interval_ms", ["0", "-5", "inf", "nan", "1001"])
+def test_profile_rejects_interval_out_of_range(app, interval_ms):
+    status, _ = _call(app, "/debug/profile", f"seconds=1&interval_ms={interval_ms}")
+    assert status == "400 Bad Request"
+
+
+@pytest.mark.parametrize("query", ["top=0", "top=-2", "top=1001", "frames=0", "frames=101"])
+def test_memory_rejects_counts_out_of_range(app, query):
+    status, _ = _call(app, "/debug/memory", f"seconds=0.1&{query}")
+    assert status == "400 Bad Request"
+
+
+@pytest.mark.parametrize("samples", ["0", "-1", "101"])
+def test_loop_rejects_samples_out_of_range(app, running_loop, samples):
+    status, _ = _call(app, "/debug/loop", f"samples={samples}")
+    assert status == "400 Bad Request"
+
+
+def test_memory_snapshot(app):
+    status, body = _call(app, "/debug/memory", "seconds=0.1&top=5")
+    assert status == "200 OK"
+    assert len(body.decode().splitlines()) <= 5
+    assert not tracemalloc.is_tracing()
+
+
+def test_tasks_and_loop_lag(app, running_loop):
+    async def sleeper():
+        await asyncio.sleep(60)
+
+    task = asyncio.run_coroutine_threadsafe(sleeper(), running_loop)
+    try:
+        status, body = _call(app, "/debug/tasks")
+        assert status == "200 OK"
+        assert "sleeper" in body.decode()
+
+        status, body = _call(app, "/debug/loop", "samples=2")
+        report = json.loads(body)
+        assert status == "200 OK"
+        assert len(report["samples_ms"]) == 2
+        assert report["max_ms"] < 1000
+    finally:
+        task.cancel()
+
+
+def test_blocked_loop_is_reported(running_loop):
+    running_loop.call_soon_threadsafe(time.sleep, 1)
+    time.sleep(0.05)
+    report = profiling.dump_tasks(running_loop, timeout=0.2)
+    assert report.startswith("Event loop blocked")
+    assert "in _run_once" in report
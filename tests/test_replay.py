@@ -0,0 +1,193 @@
+"""
+test_replay_range_resolves_offsets: offset bounds are clamped to the partitions and empty partitions are skipped
+test_replay_range_resolves_times: time bounds resolve through offsets_for_times, a time past the end is the end offset
+test_replay_range_rejects_unknown_partitions: unknown topics and partitions fail before anything is consumed
+test_replay_progress_reports_eta: progress counts committed records of the range with rate and remaining time
+test_consumer_replays_range_and_exits: the range is assigned without a group, clipped at its end and fully committed
+test_consumer_replay_finishes_on_gap: a partition whose end sits behind a compacted gap finishes on its position
+test_bulk_load_settings_applied_and_restored: indices are switched to bulk settings and their own values restored
+test_backfill_settings: the backfill tunes the live consumer settings and parses times
+"""
+
+import asyncio
+import importlib.util
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from aiokafka import TopicPartition
+from aiokafka.structs import OffsetAndTimestamp
+
+from config import BackfillSettings, KafkaSettings
+from metrics import replay_remaining_records
+from ports.input.kafka_service import KafkaConsumerService
+from ports.input.replay import ReplayProgress, ReplayRange
+from ports.output.bulk_load import BULK_SETTINGS, BulkLoadSettings
+
+TP0 = TopicPartition("events", 0)
+TP1 = TopicPartition("events", 1)
+TP2 = TopicPartition("events", 2)
+
+
+def _cluster(beginning: dict, end: dict) -> AsyncMock:
+    consumer = AsyncMock()
+    consumer.subscribe = MagicMock()
+    consumer.assign = MagicMock()
+    consumer.seek = MagicMock()
+    consumer.pause = MagicMock()
+    consumer.resume = MagicMock()
+    consumer.partitions_for_topic = MagicMock(return_value={tp.partition for tp in end})
+    consumer.beginning_offsets.return_value = beginning
+    consumer.end_offsets.return_value = end
+    return consumer
+
+
+async def test_replay_range_resolves_offsets():
+    consumer = _cluster({TP0: 0, TP1: 10, TP2: 0}, {TP0: 100, TP1: 50, TP2: 0})
+
+    ranges = await ReplayRange("events", start_offset=20, end_offset=80).resolve(consumer)
+
+    assert ranges == {TP0: (20, 80), TP1: (20, 50)}
+    assert await ReplayRange("events", [1]).resolve(consumer) == {TP1: (10, 50)}
+
+
+async def test_replay_range_resolves_times():
+    consumer = _cluster({TP0: 0, TP1: 0}, {TP0: 100, TP1: 50})
+    consumer.offsets_for_times.side_effect = [
+        {TP0: OffsetAndTimestamp(30, 1000), TP1: OffsetAndTimestamp(5, 1000)},
+        {TP0: OffsetAndTimestamp(60, 2000), TP1: None},
+    ]
+
+    ranges = await ReplayRange("events", start_time_ms=1000, end_time_ms=2000).resolve(consumer)
+
+    assert ranges == {TP0: (30, 60), TP1: (5, 50)}
+    assert consumer.offsets_for_times.await_args_list[0].args[0] == {TP0: 1000, TP1: 1000}
+
+
+async def test_replay_range_rejects_unknown_partitions():
+    consumer = _cluster({TP0: 0}, {TP0: 10})
+
+    with pytest.raises(ValueError, match="no partitions \\[3\\]"):
+        await ReplayRange("events", [0, 3]).resolve(consumer)
+    with pytest.raises(ValueError, match="Topic other not found"):
+        consumer.partitions_for_topic.return_value = None
+        await ReplayRange("other").resolve(consumer)
+    with pytest.raises(ValueError):
+        ReplayRange("events", start_offset=1, start_time_ms=1)
+
+
+def test_replay_progress_reports_eta():
+    progress = ReplayProgress({TP0: (10, 110), TP1: (0, 100)})
+    progress.started -= 10
+
+    report = progress.report({TP0: 60, TP1: 150})
+
+    assert progress.total == 200
+    assert progress.done({TP0: 60, TP1: 150}) == 150
+    assert report.startswith("Replayed 150/200 records (75.0%), 15 records/s, ETA 3")
+    assert replay_remaining_records._value.get() == 50
+
+
+def _replaying(consumer: AsyncMock, log: dict[TopicPartition, list[int]], batch: int = 5):
+    """ Serves the offsets of `log` in fetches of `batch` records from the positions set by seek """
+    positions = {}
+    consumer.seek.side_effect = lambda topic_partition, offset: positions.__setitem__(topic_partition, offset)
+
+    async def position(topic_partition):
+        return positions[topic_partition]
+
+    async def getmany(**kwargs):
+        await asyncio.sleep(0.001)
+        fetched = {}
+        for topic_partition, offsets in log.items():
+            pending = [offset for offset in offsets if offset >= positions[topic_partition]][:batch]
+            if pending:
+                messages = []
+                for offset in pending:
+                    message = MagicMock()
+                    message.offset = offset
+                    message.value = {"offset": offset}
+                    message.serialized_value_size = 16
+                    messages.append(message)
+                fetched[topic_partition] = messages
+                positions[topic_partition] = pending[-1] + 1
+        return fetched
+
+    consumer.position.side_effect = position
+    consumer.getmany.side_effect = getmany
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_consumer_replays_range_and_exits(mock_process):
+    consumer = _cluster({TP0: 0, TP1: 0}, {TP0: 30, TP1: 30})
+    _replaying(consumer, {TP0: list(range(30)), TP1: list(range(30))})
+    service = KafkaConsumerService(
+        MagicMock(), KafkaSettings(mode="pipelined", timeout_ms=10, lag_interval_s=0),
+        replay=ReplayRange("events", start_offset=5, end_offset=12, progress_interval_s=0.01))
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        await asyncio.wait_for(service.start(), 2)
+
+    consumer.subscribe.assert_not_called()
+    assert set(consumer.assign.call_args.args[0]) == {TP0, TP1}
+    indexed = sorted(event["offset"] for call in mock_process.await_args_list for event in call.args[1])
+    assert indexed == sorted(list(range(5, 12)) * 2)
+    (offsets,), _ = consumer.commit.await_args
+    assert {tp: offset.offset for tp, offset in offsets.items()} == {TP0: 12, TP1: 12}
+    assert service.replay_complete
+    consumer.stop.assert_awaited_once()
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_consumer_replay_finishes_on_gap(mock_process):
+    consumer = _cluster({TP0: 0}, {TP0: 20})
+    # Offsets 8 and 9 were compacted away, the last record before the end is 7
+    _replaying(consumer, {TP0: list(range(8)) + list(range(10, 20))}, batch=4)
+    service = KafkaConsumerService(
+        MagicMock(), KafkaSettings(timeout_ms=10, lag_interval_s=0), replay=ReplayRange("events", end_offset=10))
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        await asyncio.wait_for(service.start(), 2)
+
+    indexed = [event["offset"] for call in mock_process.await_args_list for event in call.args[1]]
+    assert indexed == list(range(8))
+    consumer.pause.assert_called_with(TP0)
+    assert service.replay_complete
+
+
+async def test_bulk_load_settings_applied_and_restored():
+    client = MagicMock()
+    client.indices = AsyncMock()
+    client.indices.get_settings.return_value = {
+        "logs-a": {"settings": {"index.refresh_interval": "5s", "index.number_of_replicas": "1"}},
+        "logs-b": {"settings": {"index.number_of_replicas": "1"}},
+    }
+
+    async with BulkLoadSettings(client, "logs-*"):
+        client.indices.put_settings.assert_awaited_once_with(index="logs-a,logs-b", settings=BULK_SETTINGS)
+
+    restored = {call.kwargs["index"]: call.kwargs["settings"] for call in client.indices.put_settings.await_args_list[1:]}
+    assert restored == {
+        "logs-a": {"index.refresh_interval": "5s", "index.number_of_replicas": "1"},
+        "logs-b": {"index.refresh_interval": None, "index.number_of_replicas": "1"},
+    }
+    client.indices.refresh.assert_awaited_once_with(index="logs-a,logs-b")
+
+
+def test_backfill_settings():
+    spec = importlib.util.spec_from_file_location("backfill", Path(__file__).resolve().parent.parent / "backfill.py")
+    backfill = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(backfill)
+
+    args = backfill.parse_args(["events", "--partitions", "0,2", "--from-time", "2025-01-01T00:00:00",
+                                "--to-time", "1735776000000", "--in-flight", "32"])
+    settings = backfill.backfill_settings(args, KafkaSettings(consumer_group="loader"), BackfillSettings())
+
+    assert args.partitions == [0, 2]
+    assert args.from_time == 1735689600000
+    assert args.to_time == 1735776000000
+    assert backfill.parse_time("2025-01-01T01:00:00+01:00") == 1735689600000
+    assert settings.consumer_group == "loader-backfill"
+    assert settings.consumer_topics == "events"
+    assert (settings.mode, settings.batch_size, settings.max_in_flight, settings.lag_interval_s) == (
+        "pipelined", 5000, 32, 0)
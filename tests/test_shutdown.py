@@ -0,0 +1,259 @@
+"""
+test_stop_drains_in_flight_batch: stop during indexing finishes the batch, commits it and leaves the group
+test_stop_drains_queued_batches: pipelined mode indexes every fetched batch before returning
+test_stop_flushes_partition_buffers: partitioned mode flushes buffers without waiting for timeout_ms
+test_stop_deadline_cancels_drain: a drain longer than drain_timeout_s is cancelled, the consumer still stops
+test_stop_commits_trailing_rejected_records: fetch positions past rejected records are committed on stop
+test_revoke_waits_for_in_flight_and_commits: revocation waits for in-flight batches and commits revoked partitions
+test_revoke_times_out: revocation gives up after drain_timeout_s without committing
+test_commit_after_reassignment_is_tolerated: a commit rejected after a rebalance does not stop consumption
+test_assignment_keeps_backpressure_pause: new partitions stay paused while backpressure holds fetching
+test_rebalance_listener_is_registered: the consumer subscribes with the commit-on-revoke listener
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from aiokafka import TopicPartition
+from aiokafka.errors import CommitFailedError
+
+from config import KafkaSettings
+from ports.input.kafka_service import CommitOnRevoke, KafkaConsumerService
+
+TP = TopicPartition("test-topic", 0)
+
+
+def _message(offset: int, value=None) -> MagicMock:
+    message = MagicMock()
+    message.offset = offset
+    message.value = {"offset": offset} if value is None else value
+    message.serialized_value_size = 16
+    return message
+
+
+def _consumer(*fetches: dict) -> AsyncMock:
+    """ Consumer returning `fetches` one after the other, then nothing """
+    consumer = AsyncMock()
+    consumer.subscribe = MagicMock()
+    consumer.assignment = MagicMock(return_value={TP})
+    consumer.pause = MagicMock()
+    consumer.resume = MagicMock()
+    pending = list(fetches)
+
+    async def getmany(**kwargs):
+        if pending:
+            return pending.pop(0)
+        await asyncio.sleep(0.01)
+        return {}
+
+    consumer.getmany.side_effect = getmany
+    return consumer
+
+
+def _committed(consumer: AsyncMock) -> list[dict]:
+    return [{tp: offset.offset for tp, offset in call.args[0].items()} for call in consumer.commit.await_args_list]
+
+
+def _service(**settings) -> KafkaConsumerService:
+    return KafkaConsumerService(MagicMock(), KafkaSettings(timeout_ms=10, lag_interval_s=0, **settings))
+
+
+async def _wait_for(condition, timeout: float = 2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_stop_drains_in_flight_batch(mock_process):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_process(*args, **kwargs):
+        started.set()
+        await release.wait()
+
+    mock_process.side_effect = slow_process
+    consumer = _consumer({TP: [_message(0), _message(1)]})
+    service = _service()
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        task = asyncio.create_task(service.start())
+        await started.wait()
+        service.stop()
+        release.set()
+        await asyncio.wait_for(task, 2)
+
+    assert _committed(consumer) == [{TP: 2}]
+    consumer.stop.assert_awaited_once()
+
+
+@pytest.mark.parametrize("mode", ["pipelined", "partitioned"])
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_stop_drains_queued_batches(mock_process, mode):
+    indexed = []
+
+    async def slow_process(es_client, events, sources=None):
+        await asyncio.sleep(0.02)
+        indexed.extend(event["offset"] for event in events)
+
+    mock_process.side_effect = slow_process
+    consumer = _consumer(*({TP: [_message(offset)]} for offset in range(5)))
+    service = _service(mode=mode, batch_size=1, max_in_flight=2)
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        task = asyncio.create_task(service.start())
+        await _wait_for(lambda: consumer.getmany.await_count >= 5)
+        service.stop()
+        await asyncio.wait_for(task, 2)
+
+    assert sorted(indexed) == [0, 1, 2, 3, 4]
+    assert _committed(consumer)[-1] == {TP: 5}
+    consumer.stop.assert_awaited_once()
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_stop_flushes_partition_buffers(mock_process):
+    consumer = _consumer({TP: [_message(0), _message(1)]})
+    service = KafkaConsumerService(MagicMock(), KafkaSettings(
+        mode="partitioned", batch_size=100, timeout_ms=60_000, lag_interval_s=0))
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        task = asyncio.create_task(service.start())
+        await _wait_for(lambda: consumer.getmany.await_count >= 2)
+        service.stop()
+        await asyncio.wait_for(task, 1)
+
+    mock_process.assert_awaited_once()
+    assert _committed(consumer) == [{TP: 2}]
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_stop_deadline_cancels_drain(mock_process):
+    started = asyncio.Event()
+
+    async def stuck_process(*args, **kwargs):
+        started.set()
+        await asyncio.Event().wait()
+
+    mock_process.side_effect = stuck_process
+    consumer = _consumer({TP: [_message(0)]})
+    service = _service(drain_timeout_s=0.05)
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        task = asyncio.create_task(service.start())
+        await started.wait()
+        service.stop()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(task, 1)
+
+    consumer.commit.assert_not_awaited()
+    consumer.stop.assert_awaited_once()
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_stop_commits_trailing_rejected_records(mock_process):
+    consumer = _consumer({TP: [_message(0), _message(1, value=b"not json")]})
+    service = _service()
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        task = asyncio.create_task(service.start())
+        await _wait_for(lambda: consumer.commit.await_count >= 1)
+        service.stop()
+        await asyncio.wait_for(task, 1)
+
+    assert _committed(consumer) == [{TP: 1}, {TP: 2}]
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_revoke_waits_for_in_flight_and_commits(mock_process):
+    release = asyncio.Event()
+    started = asyncio.Event()
+
+    async def slow_process(*args, **kwargs):
+        started.set()
+        await release.wait()
+
+    mock_process.side_effect = slow_process
+    other = TopicPartition("test-topic", 1)
+    consumer = _consumer({TP: [_message(0), _message(1, value=b"bad")], other: [_message(7)]})
+    service = _service()
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        task = asyncio.create_task(service.start())
+        await started.wait()
+        revoke = asyncio.create_task(CommitOnRevoke(service, consumer).on_partitions_revoked({TP}))
+        await asyncio.sleep(0.05)
+        assert not revoke.done()
+
+        release.set()
+        await asyncio.wait_for(revoke, 1)
+        service.stop()
+        await asyncio.wait_for(task, 1)
+
+    committed = _committed(consumer)
+    assert committed[0] == {TP: 1, other: 8}
+    # The rejected record at the end of the revoked partition is committed before the handoff
+    assert committed[1] == {TP: 2}
+    assert all(TP not in offsets for offsets in committed[2:])
+
+
+async def test_revoke_times_out():
+    consumer = _consumer()
+    service = _service(drain_timeout_s=0.05)
+    service._hold(1)
+
+    await service.drain(consumer, {TP})
+
+    consumer.commit.assert_not_awaited()
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_commit_after_reassignment_is_tolerated(mock_process):
+    consumer = _consumer({TP: [_message(0)]}, {TP: [_message(1)]})
+    consumer.commit.side_effect = [CommitFailedError("group rebalanced"), None, None]
+    service = _service()
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        task = asyncio.create_task(service.start())
+        await _wait_for(lambda: consumer.commit.await_count >= 2)
+        service.stop()
+        await asyncio.wait_for(task, 1)
+
+    assert mock_process.await_count == 2
+    assert _committed(consumer)[1] == {TP: 2}
+
+
+def test_assignment_keeps_backpressure_pause():
+    consumer = _consumer()
+    service = _service()
+    service._queue_paused.add(TP)
+
+    service.assigned(consumer, {TP})
+    consumer.pause.assert_not_called()
+    assert not service._queue_paused
+
+    service._paused = True
+    service.assigned(consumer, {TP})
+    consumer.pause.assert_called_once_with(TP)
+
+
+async def test_rebalance_listener_is_registered():
+    consumer = _consumer()
+    service = _service()
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer) as consumer_cls:
+        task = asyncio.create_task(service.start())
+        await asyncio.sleep(0.02)
+        service.stop()
+        await asyncio.wait_for(task, 1)
+
+    assert "group_id" in consumer_cls.call_args.kwargs
+    topics = consumer.subscribe.call_args.args[0]
+    listener = consumer.subscribe.call_args.kwargs["listener"]
+    assert topics == ["topic_name"]
+    assert isinstance(listener, CommitOnRevoke)
+    assert listener.consumer is consumer
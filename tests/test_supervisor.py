@@ -0,0 +1,93 @@
+"""
+test_supervisor_restarts_crashed_workers: a worker that exits is started again with a growing delay
+test_supervisor_stops_workers_on_shutdown: running workers are terminated and joined
+test_supervisor_aggregates_worker_metrics: counters of all workers add up in the multiprocess collector
+test_prepare_multiprocess_metrics_clears_stale_files: an existing metrics directory is emptied
+test_prepare_multiprocess_metrics_creates_directory: a temporary directory is used by default
+"""
+
+import os
+import threading
+import time
+
+import pytest
+from prometheus_client import CollectorRegistry, multiprocess
+
+from supervisor import MULTIPROC_DIR_ENV, Supervisor, prepare_multiprocess_metrics
+
+
+def crash():
+    raise SystemExit(3)
+
+
+def idle():
+    time.sleep(60)
+
+
+def count():
+    from metrics import messages_processed
+    messages_processed.inc(5)
+
+
+@pytest.fixture
+def fast_supervisor(monkeypatch):
+    monkeypatch.delenv(MULTIPROC_DIR_ENV, raising=False)
+    monkeypatch.setattr(Supervisor, "POLL_INTERVAL_S", 0.05)
+
+
+def _supervise(supervisor: Supervisor, seconds: float):
+    thread = threading.Thread(target=supervisor.supervise)
+    supervisor.start()
+    thread.start()
+    time.sleep(seconds)
+    supervisor.stop()
+    thread.join()
+    supervisor.shutdown()
+
+
+def test_supervisor_restarts_crashed_workers(fast_supervisor):
+    supervisor = Supervisor(crash, workers=1, restart_delay_s=0.1)
+    _supervise(supervisor, 3)
+    assert supervisor.restarts >= 2
+    assert supervisor._crashes[0] == supervisor.restarts
+
+
+def test_supervisor_stops_workers_on_shutdown(fast_supervisor):
+    supervisor = Supervisor(idle, workers=2, shutdown_timeout_s=5)
+    supervisor.start()
+    processes = list(supervisor._processes)
+    assert all(process.is_alive() for process in processes)
+    supervisor.shutdown()
+    assert not any(process.is_alive() for process in processes)
+    assert supervisor.restarts == 0
+
+
+def test_supervisor_aggregates_worker_metrics(tmp_path, monkeypatch):
+    monkeypatch.setenv(MULTIPROC_DIR_ENV, str(tmp_path))
+    supervisor = Supervisor(count, workers=2)
+    supervisor.start()
+    for process in supervisor._processes:
+        process.join(30)
+    supervisor.shutdown()
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=str(tmp_path))
+    assert registry.get_sample_value("messages_processed_total") == 10
+
+
+def test_prepare_multiprocess_metrics_clears_stale_files(tmp_path, monkeypatch):
+    monkeypatch.setenv(MULTIPROC_DIR_ENV, str(tmp_path))
+    (tmp_path / "counter_1.db").write_bytes(b"stale")
+    (tmp_path / "keep.txt").write_text("other")
+    assert prepare_multiprocess_metrics() == str(tmp_path)
+    assert os.listdir(tmp_path) == ["keep.txt"]
+
+
+def test_prepare_multiprocess_metrics_creates_directory(monkeypatch):
+    monkeypatch.delenv(MULTIPROC_DIR_ENV, raising=False)
+    path = prepare_multiprocess_metrics()
+    try:
+        assert os.path.isdir(path)
+        assert os.environ[MULTIPROC_DIR_ENV] == path
+    finally:
+        os.rmdir(path)
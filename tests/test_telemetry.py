@@ -0,0 +1,156 @@
+"""
+test_journal_writes_arrow_stream: buffered records are written as typed Arrow columns on stop
+test_journal_writes_json_lines: the jsonl format writes one object per record
+test_journal_rotates_and_prunes: files rotate at max_bytes and only max_files are kept
+test_journal_drops_when_buffer_full: records beyond the buffer are dropped and counted
+test_journal_flushes_in_background: records are written every flush interval while running
+test_consumer_journals_batches: every indexed batch is journaled with its partitions, counts and stage durations
+"""
+
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from aiokafka import TopicPartition
+
+from config import KafkaSettings, TelemetrySettings
+from metrics import telemetry_dropped_total
+from ports.input.kafka_service import KafkaConsumerService
+from ports.output.elastic_service import BulkResult
+from ports.output.telemetry import FIELDS, TelemetryJournal
+
+pa = pytest.importorskip("pyarrow")
+
+TP0 = TopicPartition("test-topic", 0)
+
+
+def _record(documents: int = 10, **values) -> dict:
+    record = {
+        "started_at": 1_700_000_000.0, "finished_at": 1_700_000_000.5, "partitions": ["test-topic:0"],
+        "records": documents, "documents": documents, "bytes": documents * 100, "decode_s": 0.001,
+        "transform_s": 0.002, "index_s": 0.1, "commit_s": 0.003, "attempts": 1, "retries": 0, "failed": 0,
+        "throttled": 0,
+    }
+    record.update(values)
+    return record
+
+
+def _read_arrow(path) -> "pa.Table":
+    with pa.OSFile(str(path), "rb") as source:
+        return pa.ipc.open_stream(source).read_all()
+
+
+async def test_journal_writes_arrow_stream(tmp_path):
+    journal = TelemetryJournal(TelemetrySettings(path=str(tmp_path), format="arrow"))
+    await journal.start()
+    journal.record(**_record(10))
+    journal.record(**_record(20, partitions=["test-topic:0", "test-topic:1"]))
+    await journal.stop()
+
+    (path,) = tmp_path.glob("batches-*.arrow")
+    table = _read_arrow(path)
+    assert table.column_names == list(FIELDS)
+    assert table["documents"].to_pylist() == [10, 20]
+    assert table["partitions"].to_pylist()[1] == ["test-topic:0", "test-topic:1"]
+    assert str(table.schema.field("index_s").type) == "double"
+
+
+async def test_journal_writes_json_lines(tmp_path):
+    journal = TelemetryJournal(TelemetrySettings(path=str(tmp_path), format="jsonl"))
+    await journal.start()
+    journal.record(**_record(10))
+    await journal.stop()
+
+    (path,) = tmp_path.glob("batches-*.jsonl")
+    (line,) = path.read_bytes().splitlines()
+    assert json.loads(line) == _record(10)
+
+
+async def test_journal_rotates_and_prunes(tmp_path):
+    journal = TelemetryJournal(TelemetrySettings(path=str(tmp_path), format="jsonl", max_bytes=1, max_files=2))
+    await journal.start()
+    for documents in range(4):
+        journal.record(**_record(documents))
+        await journal._flush()
+    await journal.stop()
+
+    paths = sorted(tmp_path.glob("batches-*.jsonl"))
+    assert len(paths) == 2
+    assert [json.loads(path.read_bytes())["documents"] for path in paths] == [2, 3]
+
+
+async def test_journal_drops_when_buffer_full(tmp_path):
+    journal = TelemetryJournal(TelemetrySettings(path=str(tmp_path), format="jsonl", buffer_size=2))
+    dropped = telemetry_dropped_total._value.get()
+    for documents in range(3):
+        journal.record(**_record(documents))
+
+    assert telemetry_dropped_total._value.get() == dropped + 1
+    await journal.start()
+    await journal.stop()
+    (path,) = tmp_path.glob("batches-*.jsonl")
+    assert len(path.read_bytes().splitlines()) == 2
+
+
+async def test_journal_flushes_in_background(tmp_path):
+    journal = TelemetryJournal(TelemetrySettings(path=str(tmp_path), format="arrow", flush_interval_ms=10))
+    await journal.start()
+    journal.record(**_record(10))
+    await asyncio.sleep(0.1)
+
+    (path,) = tmp_path.glob("batches-*.arrow")
+    assert path.stat().st_size > 0
+    await journal.stop()
+    assert _read_arrow(path).num_rows == 1
+
+
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+async def test_consumer_journals_batches(mock_process, tmp_path):
+    result = BulkResult()
+    result.attempts, result.retried, result.failed = 2, 1, 1
+    mock_process.return_value = result
+    consumer = AsyncMock()
+    consumer.subscribe = MagicMock()
+    consumer.assignment = MagicMock(return_value={TP0})
+    fetched = iter([0, 3])
+
+    async def getmany(**kwargs):
+        first = next(fetched, None)
+        if first is None:
+            await asyncio.sleep(0.01)
+            return {}
+        messages = []
+        for offset in range(first, first + 3):
+            message = MagicMock()
+            message.offset = offset
+            message.value = {"offset": offset}
+            message.serialized_value_size = 16
+            messages.append(message)
+        return {TP0: messages}
+
+    consumer.getmany.side_effect = getmany
+    journal = TelemetryJournal(TelemetrySettings(path=str(tmp_path), format="arrow"))
+    service = KafkaConsumerService(
+        MagicMock(), KafkaSettings(timeout_ms=10, lag_interval_s=0), journal=journal)
+
+    with patch("ports.input.kafka_service.AIOKafkaConsumer", return_value=consumer):
+        await journal.start()
+        task = asyncio.create_task(service.start())
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if mock_process.await_count == 2:
+                break
+        service.stop()
+        await asyncio.wait_for(task, 1)
+        await journal.stop()
+
+    (path,) = tmp_path.glob("batches-*.arrow")
+    table = _read_arrow(path).to_pylist()
+    assert len(table) == 2
+    record = table[0]
+    assert record["partitions"] == ["test-topic:0"]
+    assert (record["records"], record["documents"], record["bytes"]) == (3, 3, 48)
+    assert (record["attempts"], record["retries"], record["failed"]) == (2, 1, 1)
+    assert record["finished_at"] >= record["started_at"]
+    assert all(record[stage] >= 0 for stage in ("decode_s", "transform_s", "index_s", "commit_s"))
@@ -0,0 +1,177 @@
+"""
+test_default_spec_stamps_batch_timestamp: without a spec every event gets the batch timestamp, like EventModel
+test_projection_exclude_and_rename: include, exclude and rename shape the event
+test_cast_types: values are coerced, None is left alone
+test_failed_cast_rejects_event: an event that cannot be cast is reported, the others are kept
+test_drop_if_rules: equals, not_equals, in, missing and exists rules drop events
+test_failed_rule_rejects_event: an unhashable value tested by an in rule or a non-object event is reported
+test_invalid_spec: unknown keys, cast types and rules are refused at compile time
+test_invalid_spec_shape: values of the wrong shape are refused with the key they are set on
+test_load_transform_spec: the spec is read inline or from YAML and JSON files
+test_consumer_applies_transform: the consumer indexes transformed events and rejects failed ones
+test_raw_bulk_refuses_transform: raw bulk indexing only allows the default spec
+"""
+
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from aiokafka import TopicPartition
+
+from config import KafkaSettings, TransformSettings
+from domain.transform import compile_transform, load_transform_spec
+from metrics import events_filtered_total
+from ports.input.kafka_service import KafkaConsumerService
+
+
+def test_default_spec_stamps_batch_timestamp():
+    transform = compile_transform()
+    assert transform.identity
+    result = transform([{"a": 1}, {"timestamp": None}], 1700000000)
+    assert result.events == [{"a": 1, "timestamp": 1700000000}, {"timestamp": 1700000000}]
+    assert result.positions == [0, 1]
+
+
+def test_projection_exclude_and_rename():
+    transform = compile_transform({
+        "include": ["msg", "level", "secret"],
+        "exclude": ["secret"],
+        "rename": {"msg": "message"},
+        "timestamp": "@timestamp",
+    })
+    result = transform([{"msg": "hi", "level": "INFO", "secret": "x", "noise": 1}], 5)
+    assert result.events == [{"level": "INFO", "message": "hi", "@timestamp": 5}]
+
+
+def test_cast_types():
+    transform = compile_transform({"cast": {"a": "int", "b": "float", "c": "str", "d": "bool", "e": "int"}})
+    result = transform([{"a": "7", "b": "1.5", "c": 3, "d": "yes", "e": None}], 0)
+    assert result.events == [{"a": 7, "b": 1.5, "c": "3", "d": True, "e": None}]
+
+
+def test_failed_cast_rejects_event():
+    transform = compile_transform({"cast": {"status": "int"}})
+    result = transform([{"status": "200"}, {"status": "oops"}, {"status": 2.5}, {}], 0)
+    assert result.events == [{"status": 200}, {}]
+    assert result.positions == [0, 3]
+    assert [position for position, _ in result.failures] == [1, 2]
+    assert result.dropped == 0
+
+
+def test_drop_if_rules():
+    transform = compile_transform({"drop_if": [
+        {"field": "level", "equals": "DEBUG"},
+        {"field": "status", "in": [200, 204]},
+        {"field": "env", "not_equals": "prod"},
+        {"field": "user", "missing": True},
+        {"field": "internal", "exists": True},
+    ], "timestamp": None})
+    events = [
+        {"level": "DEBUG", "env": "prod", "user": 1},
+        {"status": 204, "env": "prod", "user": 1},
+        {"env": "dev", "user": 1},
+        {"env": "prod"},
+        {"env": "prod", "user": 1, "internal": True},
+        {"level": "ERROR", "status": 500, "env": "prod", "user": 1},
+    ]
+    result = transform(events, 0)
+    assert result.events == [events[5]]
+    assert result.positions == [5]
+    assert result.dropped == 5
+
+
+def test_failed_rule_rejects_event():
+    transform = compile_transform({"drop_if": [{"field": "status", "in": [200, 204]}], "timestamp": None})
+    result = transform([{"status": [200]}, {"status": {"code": 200}}, [1], {"status": 204}, {"status": 500}], 0)
+    assert result.events == [{"status": 500}]
+    assert result.positions == [4]
+    assert [position for position, _ in result.failures] == [0, 1, 2]
+    assert result.dropped == 1
+
+
+@pytest.mark.parametrize("spec", [
+    {"unknown": 1},
+    {"cast": {"a": "decimal"}},
+    {"drop_if": [{"field": "a"}]},
+    {"drop_if": [{"equals": 1}]},
+    {"drop_if": [{"field": "a", "equals": 1, "in": [1]}]},
+])
+def test_invalid_spec(spec):
+    with pytest.raises(ValueError):
+        compile_transform(spec)
+
+
+@pytest.mark.parametrize("key, value", [
+    ("include", "field"),
+    ("include", ["a", 1]),
+    ("exclude", "field"),
+    ("rename", [["a", "b"]]),
+    ("rename", {"a": 1}),
+    ("cast", ["a", "int"]),
+    ("drop_if", {"field": "a", "exists": True}),
+    ("drop_if", ["a"]),
+])
+def test_invalid_spec_shape(key, value):
+    with pytest.raises(ValueError, match=f"Transform key {key} "):
+        compile_transform({key: value})
+
+
+def test_load_transform_spec(tmp_path):
+    assert load_transform_spec(TransformSettings()) is None
+    assert load_transform_spec(TransformSettings(spec='{"exclude": ["a"]}')) == {"exclude": ["a"]}
+
+    json_file = tmp_path / "spec.json"
+    json_file.write_text(json.dumps({"rename": {"a": "b"}}))
+    assert load_transform_spec(TransformSettings(file=str(json_file))) == {"rename": {"a": "b"}}
+
+    pytest.importorskip("yaml")
+    yaml_file = tmp_path / "spec.yaml"
+    yaml_file.write_text("cast:\n  status: int\ndrop_if:\n  - field: level\n    equals: DEBUG\n")
+    assert load_transform_spec(TransformSettings(file=str(yaml_file))) == {
+        "cast": {"status": "int"}, "drop_if": [{"field": "level", "equals": "DEBUG"}]}
+
+
+@pytest.mark.asyncio
+@patch("ports.input.kafka_service.process_events", new_callable=AsyncMock)
+@patch("ports.input.kafka_service.AIOKafkaConsumer")
+async def test_consumer_applies_transform(mock_consumer_cls, mock_process):
+    tp = TopicPartition("test-topic", 0)
+    messages = []
+    for offset, value in enumerate([b'{"status": "200"}', b'{"status": "bad"}', b'{"status": "1", "level": "DEBUG"}']):
+        message = MagicMock()
+        message.serialized_value_size = 16
+        message.offset = offset
+        message.value = value
+        messages.append(message)
+
+    consumer_mock = AsyncMock()
+    consumer_mock.subscribe = MagicMock()
+    consumer_mock.getmany.side_effect = [{tp: messages}, asyncio.CancelledError()]
+    mock_consumer_cls.return_value = consumer_mock
+    dead_letters = MagicMock()
+    filtered_before = events_filtered_total._value.get()
+
+    transform = compile_transform({"cast": {"status": "int"}, "drop_if": [{"field": "level", "equals": "DEBUG"}]})
+    settings = KafkaSettings(bootstrap_servers="localhost:9092", consumer_topics="test-topic",
+                             consumer_group="test-group")
+    service = KafkaConsumerService(MagicMock(), settings, dead_letters, transform=transform)
+
+    with pytest.raises(asyncio.CancelledError):
+        await service.start()
+
+    events = mock_process.await_args.args[1]
+    assert [event["status"] for event in events] == [200]
+    assert mock_process.await_args.kwargs["sources"] == [messages[0]]
+    dead_letters.publish.assert_called_once()
+    assert dead_letters.publish.call_args.args[0].offset == 1
+    assert events_filtered_total._value.get() == filtered_before + 1
+    assert consumer_mock.commit.await_args.args[0][tp].offset == 1
+
+
+def test_raw_bulk_refuses_transform():
+    settings = KafkaSettings(bootstrap_servers="localhost:9092", consumer_topics="test-topic",
+                             consumer_group="test-group", raw_bulk=True)
+    KafkaConsumerService(MagicMock(), settings)
+    with pytest.raises(ValueError):
+        KafkaConsumerService(MagicMock(), settings, transform=compile_transform({"exclude": ["a"]}))